@@ -16,6 +16,12 @@ export class NewQuizService {
   // The API URL to answer a quiz, but we must add a quiz ID number and a slash to the end (eg http://localhost:8000/api/attempt_quiz/46/)
   public answerQuizUrl = `${environment.API_URL}/api/attempt_quiz/`;
 
+  // The layout of quizzes and quiz attempts to ask the API for. The default row layout is faster to render on the API,
+  // and once the response is compressed it is barely larger than the columnar one, which does not repeat the key names
+  // for every question and choice. Set this to 'columnar' to get that layout; the payloads are converted back to the row
+  // layout with fromColumnar as soon as they arrive.
+  public layout = '';
+
 
   public quiz: any;
 
@@ -56,8 +62,10 @@ export class NewQuizService {
       show_all_alternative_answers: quizSettings.showAllAlternativeAnswers,
       fixed_choices_only: quizSettings.fixedQuizMode
     });
-    this.http.put(this.generateQuizUrl + `${quizSettings.topicId}/`, payload, this.generateHttpHeaders()).subscribe(
-      data => {
+    this.http.put(this.generateQuizUrl + `${quizSettings.topicId}/${this.layoutQuery()}`, payload,
+      this.generateHttpHeaders()).subscribe(
+      columnarData => {
+        const data = this.fromColumnar(columnarData);
         // Reset errors.
         this.errors = [];
         console.log('Success', data);
@@ -134,8 +142,9 @@ export class NewQuizService {
   answerQuiz(quizId, answerList): any {
     // Attempt the quiz and check answers.
     const payload = JSON.stringify({answers: answerList});
-    this.http.put(this.answerQuizUrl + `${quizId}/`, payload, this.generateHttpHeaders()).subscribe(
-      data => {
+    this.http.put(this.answerQuizUrl + `${quizId}/${this.layoutQuery()}`, payload, this.generateHttpHeaders()).subscribe(
+      columnarData => {
+        const data = this.fromColumnar(columnarData);
         console.log('Success', data);
         this.answerKeyAndScore = data;
         // Set 'answered' to true.
@@ -192,8 +201,9 @@ export class NewQuizService {
   }
 
   retryQuiz(quizId): any {
-    this.http.get(this.generateQuizUrl + `${quizId}/`, this.generateHttpHeaders()).subscribe(
-      data => {
+    this.http.get(this.generateQuizUrl + `${quizId}/${this.layoutQuery()}`, this.generateHttpHeaders()).subscribe(
+      columnarData => {
+        const data = this.fromColumnar(columnarData);
         console.log('Success', data);
 
         // Start the quiz form anew.
@@ -209,6 +219,44 @@ export class NewQuizService {
     );
   }
 
+  layoutQuery(): string {
+    return this.layout ? `?layout=${this.layout}` : '';
+  }
+
+  // Convert a dict of lists back into a list of dicts, e.g. {a: [1, 2], b: [3, 4]} to [{a: 1, b: 3}, {a: 2, b: 4}].
+  // Columns holding one columnar dict per row (e.g. the choices of a quiz attempt) are converted as well.
+  columnsToRows(columns): Array<any> {
+    const keys = Object.keys(columns);
+    const noOfRows = keys.length ? columns[keys[0]].length : 0;
+    const rows = [];
+    for (let i = 0; i < noOfRows; i++) {
+      const row = {};
+      for (const key of keys) {
+        const value = columns[key][i];
+        const isColumnarDict = value !== null && typeof value === 'object' && !Array.isArray(value);
+        row[key] = isColumnarDict ? this.columnsToRows(value) : value;
+      }
+      rows.push(row);
+    }
+    return rows;
+  }
+
+  // Returns the quiz or quiz attempt in the row layout, whichever layout the API sent it in.
+  fromColumnar(payload): any {
+    if (!payload || payload.layout !== 'columnar') {
+      return payload;
+    }
+    const rowPayload = {...payload};
+    delete rowPayload.layout;
+    for (const key of Object.keys(rowPayload)) {
+      const value = rowPayload[key];
+      if (value !== null && typeof value === 'object' && !Array.isArray(value)) {
+        rowPayload[key] = this.columnsToRows(value);
+      }
+    }
+    return rowPayload;
+  }
+
   // Generating HTTP Headers dynamically so that we can access the token in userservice.
   generateHttpHeaders(): any {
     return {
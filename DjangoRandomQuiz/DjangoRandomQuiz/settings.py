@@ -60,21 +60,49 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    # As early as possible, so that the timings include the other middleware (see quiz/middleware.py). Django 3.1's
+    #  SecurityMiddleware does not mark itself as async under ASGI, so this has to come after it to run in async mode.
+    'quiz.middleware.PerformanceMiddleware',
+    # Right below PerformanceMiddleware, so that it compresses everything the other middleware added to the response.
+    'quiz.middleware.APICompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'oauth2_provider.middleware.OAuth2TokenMiddleware',
-    "whitenoise.middleware.WhiteNoiseMiddleware"
+    # Same as oauth2_provider.middleware.OAuth2TokenMiddleware, but validates tokens with the token cache (see
+    #  quiz/authentication.py).
+    'quiz.authentication.CachedOAuth2TokenMiddleware',
+    # Sends the reads of the users who just wrote to the primary database instead of a replica (see quiz/routers.py).
+    'quiz.middleware.ReplicaStickinessMiddleware',
+    # Profiles the requests of staff users that ask for it (see quiz/profiling.py). After
+    #  CachedOAuth2TokenMiddleware, which sets their user.
+    'quiz.middleware.ProfilingMiddleware',
+    # Same as whitenoise.middleware.WhiteNoiseMiddleware, but can run in async mode as well (see quiz/middleware.py).
+    "quiz.middleware.AsyncWhiteNoiseMiddleware",
 ]
 
 # Use the oauth toolkit's oauth tokens instead of the django rest framework tokens.
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'oauth2_provider.contrib.rest_framework.OAuth2Authentication',
-    ]
+        # Same as oauth2_provider.contrib.rest_framework.OAuth2Authentication, but validates tokens with the token
+        #  cache (see quiz/authentication.py).
+        'quiz.authentication.CachedOAuth2Authentication',
+    ],
+    # Use orjson instead of the standard library json module, and allow clients to use MessagePack instead of JSON by
+    #  sending 'Accept: application/msgpack' and 'Content-Type: application/msgpack'.
+    'DEFAULT_RENDERER_CLASSES': [
+        'quiz.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+        'quiz.renderers.MessagePackRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'quiz.renderers.ORJSONParser',
+        'quiz.renderers.MessagePackParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
 }
 
 # Authentication configuration
@@ -110,6 +138,27 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'DjangoRandomQuiz.wsgi.application'
 
+# Number of threads per worker process used by the async views (see quiz/async_views.py) to generate and grade quizzes.
+QUIZ_EXECUTOR_WORKERS = env('QUIZ_EXECUTOR_WORKERS', int, 4)
+
+# The stateless quizzes (see quiz/quiz_tokens.py) can be attempted for QUIZ_TOKEN_MAX_AGE seconds after they were
+#  generated.
+QUIZ_TOKEN_MAX_AGE = env('QUIZ_TOKEN_MAX_AGE', int, 24 * 60 * 60)
+
+# Regrade jobs (see quiz/regrading.py) regrade the attempts in batches of REGRADE_BATCH_SIZE, with REGRADE_WORKERS
+#  threads per job (each with its own database connection). With 0 workers, the batches are regraded one after the
+#  other in the thread that runs the job.
+REGRADE_WORKERS = env('REGRADE_WORKERS', int, 2)
+REGRADE_BATCH_SIZE = env('REGRADE_BATCH_SIZE', int, 500)
+
+# With ATTEMPT_BUFFER_SIZE > 0, the quiz attempts are inserted in batches of up to that many, at most
+#  ATTEMPT_BUFFER_DELAY seconds after they were graded, instead of one by one (see quiz/attempt_buffer.py). Until they
+#  are inserted, they are kept in a spool file in ATTEMPT_SPOOL_DIR, which must be on a local disk that outlives the
+#  process.
+ATTEMPT_BUFFER_SIZE = env('ATTEMPT_BUFFER_SIZE', int, 0)
+ATTEMPT_BUFFER_DELAY = env('ATTEMPT_BUFFER_DELAY', float, 1.0)
+ATTEMPT_SPOOL_DIR = env('ATTEMPT_SPOOL_DIR', str, str(Path(BASE_DIR, 'attempt_spool')))
+
 
 # Database
 # https://docs.djangoproject.com/en/3.1/ref/settings/#databases
@@ -119,8 +168,120 @@ DATABASES = {
     'default': env.db(default='sqlite:////{}'.format(os.path.join(BASE_DIR, 'db.sqlite3'))),
 }
 
+# Read replica (see quiz/routers.py): set REPLICA_DATABASE_URL to send the reads of the GET requests of most views to a
+#  replica of the database (e.g. a streaming replica on PostgreSQL, or a copy of the database file to try it out with
+#  SQLite). After a successful write, the reads of the user go to the primary for REPLICA_STICKINESS seconds, which
+#  should be longer than the replication lag. The users are pinned to the primary in the default cache, so it must be
+#  shared by the workers (a CACHE_URL, see below), which is checked at startup. The tests use the test database as
+#  the replica.
+if env('REPLICA_DATABASE_URL', str, ''):
+    DATABASES['replica'] = {**env.db('REPLICA_DATABASE_URL'), 'TEST': {'MIRROR': 'default'}}
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+REPLICA_STICKINESS = env('REPLICA_STICKINESS', float, 5.0)
+DATABASE_ROUTERS = ['quiz.routers.ReplicaRouter']
+
+# Connection reuse (see quiz/backends/pooling.py). By default, each thread keeps its connection open for
+#  DATABASE_CONN_MAX_AGE seconds instead of opening a new one for every request (set it to 0 to close connections at
+#  the end of every request), and checks that it still works before the first query of every request.
+# Set DATABASE_POOL_SIZE to share a pool of that many connections between all the threads of each worker process
+#  instead. Connections then go back to the pool at the end of every request, and a request waits for up to
+#  DATABASE_POOL_TIMEOUT seconds when all of them are in use. Note that the database must accept (number of workers) *
+#  DATABASE_POOL_SIZE connections.
+for database in DATABASES.values():
+    database.update({
+        'ENGINE': {
+            'django.db.backends.postgresql': 'quiz.backends.postgresql',
+            'django.db.backends.postgresql_psycopg2': 'quiz.backends.postgresql',
+            'django.db.backends.sqlite3': 'quiz.backends.sqlite3',
+        }.get(database['ENGINE'], database['ENGINE']),
+        'CONN_MAX_AGE': env('DATABASE_CONN_MAX_AGE', int, 60),
+        'CONN_HEALTH_CHECKS': env('DATABASE_CONN_HEALTH_CHECKS', bool, True),
+        'POOL_SIZE': env('DATABASE_POOL_SIZE', int, 0),
+        'POOL_TIMEOUT': env('DATABASE_POOL_TIMEOUT', float, 10.0),
+        # Check connections that have been idle in the pool for this many seconds before reusing them.
+        'POOL_CHECK_DELAY': env('DATABASE_POOL_CHECK_DELAY', float, 30.0),
+    })
+    if database['POOL_SIZE']:
+        # Return the connection to the pool at the end of every request.
+        database['CONN_MAX_AGE'] = 0
+
 CLIENT_ID = env('CLIENT_ID', str, 'ABCDEFG')
 
+# Caches configuration, e.g. CACHE_URL=rediscache://redis:6379/1
+CACHES = {
+    'default': env.cache('CACHE_URL', default='locmemcache://'),
+}
+
+# Set OAUTH2_TOKEN_CACHE to the alias of a shared cache in CACHES (e.g. 'default' with a redis CACHE_URL) to cache the
+#  validated OAuth2 access tokens, in it and in each worker process, for up to OAUTH2_TOKEN_CACHE_TTL seconds (but
+#  never past the expiry of the token). The shared cache is required, as that is how a revoked token is dropped by every
+#  worker at once: without it, the tokens are not cached. A cache local to each process (such as the default locmem
+#  cache) is rejected at startup. See quiz/authentication.py.
+OAUTH2_TOKEN_CACHE_TTL = env('OAUTH2_TOKEN_CACHE_TTL', int, 300)
+OAUTH2_TOKEN_CACHE_MAX_SIZE = env('OAUTH2_TOKEN_CACHE_MAX_SIZE', int, 10000)
+OAUTH2_TOKEN_CACHE = env('OAUTH2_TOKEN_CACHE', str, '')
+
+# Cache the top of every leaderboard for LEADERBOARD_CACHE_TIMEOUT seconds (0 to compute it on every request), so
+#  that it is computed at most once per interval. See quiz/leaderboards.py.
+LEADERBOARD_CACHE_TIMEOUT = env('LEADERBOARD_CACHE_TIMEOUT', int, 0)
+
+# The unfiltered admin change lists of tables with more than about ADMIN_EXACT_COUNT_THRESHOLD rows show an estimate of
+#  the number of rows instead of counting them on every page. See quiz/admin.py.
+ADMIN_EXACT_COUNT_THRESHOLD = env('ADMIN_EXACT_COUNT_THRESHOLD', int, 10000)
+
+# Every request gets a Server-Timing header and a JSON log line on the 'quiz.performance' logger with its SQL query
+#  count and time, serialization time and total time. Set PERFORMANCE_TRACE_ALLOCATIONS to also trace the peak memory
+#  allocation of every request with tracemalloc (this makes requests noticeably slower). The last
+#  PERFORMANCE_HISTOGRAM_WINDOW requests per route are kept for the histograms at /api/performance/. See
+#  quiz/instrumentation.py.
+PERFORMANCE_TRACE_ALLOCATIONS = env('PERFORMANCE_TRACE_ALLOCATIONS', bool, False)
+PERFORMANCE_HISTOGRAM_WINDOW = env('PERFORMANCE_HISTOGRAM_WINDOW', int, 1000)
+PERFORMANCE_LOG_LEVEL = env('PERFORMANCE_LOG_LEVEL', str, 'INFO')
+
+# Set SLOW_QUERY_LOG to log the SQL queries that take at least SLOW_QUERY_THRESHOLD_MS ms to the 'quiz.slow_queries'
+#  logger, with the route of the request and the fingerprint of the query, and (with SLOW_QUERY_EXPLAIN) the plan of
+#  the slowest SELECT of each fingerprint. Note that on PostgreSQL this is EXPLAIN ANALYZE, which runs the query again.
+#  The SLOW_QUERY_TOP fingerprints with the most time are kept for /api/performance/slow_queries/. See
+#  quiz/slow_queries.py.
+SLOW_QUERY_LOG = env('SLOW_QUERY_LOG', bool, False)
+SLOW_QUERY_THRESHOLD_MS = env('SLOW_QUERY_THRESHOLD_MS', float, 100.0)
+SLOW_QUERY_EXPLAIN = env('SLOW_QUERY_EXPLAIN', bool, True)
+SLOW_QUERY_TOP = env('SLOW_QUERY_TOP', int, 50)
+
+# Staff users can profile a request with an 'X-Profile: 1' header or a profile=1 query parameter. The profile (a .pstats
+#  file and stacks sampled every PROFILE_SAMPLE_INTERVAL seconds, in the collapsed format of flame graphs) is saved in
+#  PROFILE_DIR, where the last PROFILE_KEEP profiles are kept. See quiz/profiling.py.
+PROFILE_DIR = env('PROFILE_DIR', str, str(Path(BASE_DIR, 'profiles')))
+PROFILE_KEEP = env('PROFILE_KEEP', int, 100)
+PROFILE_SAMPLE_INTERVAL = env('PROFILE_SAMPLE_INTERVAL', float, 0.001)
+
+# The Prometheus metrics at /metrics (see quiz/metrics.py) are open to anyone who can reach the server, unless
+#  METRICS_TOKEN is set: Prometheus then has to send it as a bearer token (bearer_token in its scrape config).
+METRICS_TOKEN = env('METRICS_TOKEN', str, '')
+
+# Compress the responses of the paths starting with one of API_COMPRESSION_PATHS with brotli or gzip, if they are at
+#  least API_COMPRESSION_MIN_SIZE bytes. Higher levels compress better but take more CPU time: gzip goes from 1 to 9,
+#  brotli from 0 to 11 (its highest levels are much too slow to run on every response). See quiz/middleware.py.
+API_COMPRESSION_PATHS = env('API_COMPRESSION_PATHS', list, ['/api/'])
+API_COMPRESSION_MIN_SIZE = env('API_COMPRESSION_MIN_SIZE', int, 1024)
+API_COMPRESSION_GZIP_LEVEL = env('API_COMPRESSION_GZIP_LEVEL', int, 6)
+API_COMPRESSION_BROTLI_QUALITY = env('API_COMPRESSION_BROTLI_QUALITY', int, 5)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'message': {'format': '%(message)s'},
+    },
+    'handlers': {
+        'performance': {'class': 'logging.StreamHandler', 'formatter': 'message'},
+    },
+    'loggers': {
+        'quiz.performance': {'handlers': ['performance'], 'level': PERFORMANCE_LOG_LEVEL, 'propagate': False},
+        'quiz.slow_queries': {'handlers': ['performance'], 'level': 'INFO', 'propagate': False},
+    },
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
 
@@ -162,4 +323,8 @@ STATIC_URL = env(
         'STATIC_URL',
         cast=str,
         default='/static/'
-)
\ No newline at end of file
+)
+# collectstatic adds a content hash to the file names and writes a gzip and a brotli version of every file next to it.
+#  Whitenoise serves the compressed version the client accepts, and serves the hashed names with far-future immutable
+#  cache headers (the templates refer to the hashed names through the {% static %} tag).
+STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
@@ -18,8 +18,12 @@ from django.urls import path, include
 # from quiz.api import TopicResource
 from rest_framework import routers
 
+from quiz import async_views
+
 from quiz.views import TopicAPIView, QuestionAPIView, AnswerAPIView, UserCreateView, QuestionAnswerAPIView, \
-    GenerateQuizAPIView, CheckQuizAnswersAPIView
+    GenerateQuizAPIView, CheckQuizAnswersAPIView, PerformanceStatsView, LeaderboardAPIView, SearchAPIView, \
+    QuizByUUIDAPIView, QuizAttemptByUUIDAPIView, QuizHistoryAPIView, QuizAttemptHistoryAPIView, RegradeJobAPIView, \
+    SlowQueriesView, ProfilesView, ProfileArtifactView, metrics_view
 
 router = routers.DefaultRouter()
 # We need to pass in basename as we have not set a queryset (we used get_queryset instead) in the TopicAPIView.
@@ -30,6 +34,13 @@ router.register('answers', AnswerAPIView, basename='answer')
 router.register('qna', QuestionAnswerAPIView, basename='qna')
 router.register('generate_quiz', GenerateQuizAPIView, basename='generate_quiz')
 router.register('attempt_quiz', CheckQuizAnswersAPIView, basename='attempt_quiz')
+router.register('quizzes', QuizByUUIDAPIView, basename='quiz')
+router.register('quiz_attempts', QuizAttemptByUUIDAPIView, basename='quiz_attempt')
+router.register('leaderboard', LeaderboardAPIView, basename='leaderboard')
+router.register('search', SearchAPIView, basename='search')
+router.register('history/quizzes', QuizHistoryAPIView, basename='quiz_history')
+router.register('history/quiz_attempts', QuizAttemptHistoryAPIView, basename='quiz_attempt_history')
+router.register('regrade_jobs', RegradeJobAPIView, basename='regrade_job')
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -40,6 +51,19 @@ urlpatterns = [
     # The obtain_auth_token view will return a JSON response when valid username and password fields are POSTed to the
     # view using form data or JSON:
     # path('auth/', ObtainAuthToken.as_view(), name='auth'),
+    # Async versions of the generate_quiz and attempt_quiz endpoints. Use these when running under ASGI.
+    path('api/async/generate_quiz/<int:pk>/', async_views.generate_quiz, name='async_generate_quiz'),
+    path('api/async/attempt_quiz/<int:pk>/', async_views.attempt_quiz, name='async_attempt_quiz'),
+    path('api/async/attempt_quiz/', async_views.attempt_stateless_quiz, name='async_attempt_stateless_quiz'),
+    # Per route latency histograms (staff only).
+    path('api/performance/', PerformanceStatsView.as_view(), name='performance'),
+    # The slow queries with the most time (staff only).
+    path('api/performance/slow_queries/', SlowQueriesView.as_view(), name='slow_queries'),
+    # The profiled requests, and their profiles (staff only).
+    path('api/performance/profiles/', ProfilesView.as_view(), name='profiles'),
+    path('api/performance/profiles/<str:profile_id>/<str:kind>/', ProfileArtifactView.as_view(), name='profile'),
+    # Prometheus metrics of all the worker processes (see quiz/metrics.py).
+    path('metrics', metrics_view, name='metrics'),
     path('api/', include(router.urls,), name='api'),
     path('register/', UserCreateView.as_view(), name='register'),
 ]
@@ -0,0 +1,25 @@
+"""
+Gunicorn settings, read from the working directory when gunicorn starts (see run_django.sh).
+
+Sets up the multiprocess mode of the Prometheus metrics (see quiz/metrics.py): every worker process writes its metrics
+to files in PROMETHEUS_MULTIPROC_DIR, and /metrics adds up the files of all of them. The directory is emptied when the
+server starts, so that the totals start from zero, and the files of the workers that exit are marked as dead (their
+counters and histograms stay in the totals).
+"""
+import os
+import shutil
+import tempfile
+
+# Set before the workers import the app, as prometheus_client picks the multiprocess mode when it is imported.
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'quiz_metrics'))
+
+
+def on_starting(server):
+    metrics_dir = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -1,8 +1,287 @@
-from django.contrib import admin
+"""
+The admin of the quiz models, made to stay fast on tables with millions of rows:
 
-# Register your models here.
-from .models import Question, Answer, Topic
+    - The change lists select the related objects they show in the same query (list_select_related), only load the
+      first characters of the texts, and do not count the rows of unfiltered tables (EstimatedCountPaginator).
+    - The search box looks up ids and UUIDs with their indexes, and texts with the full-text index (quiz/search.py),
+      instead of a LIKE '%...%' scan.
+    - The creator and topic filters are autocomplete boxes instead of a link per user or topic, and the foreign keys
+      and many-to-many fields are edited as ids (raw_id_fields) instead of select boxes with every row.
+    - The bulk actions run as a few SQL statements however many rows are selected (see quiz/bulk_edits.py).
+"""
+import pprint
+import uuid
 
-admin.site.register(Question)
-admin.site.register(Topic)
-admin.site.register(Answer)
+from django import forms
+from django.conf import settings
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ActionForm
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models.functions import Substr
+from django.utils.functional import cached_property
+from django.utils.html import format_html
+from django.utils.translation import gettext_lazy as _
+
+from quiz import bulk_edits, search
+from .models import Answer, Question, Quiz, QuizAttempt, Topic
+
+# The most results of the full-text search shown in a change list.
+SEARCH_RESULTS_LIMIT = 1000
+# The number of characters of the texts shown in the change lists.
+PREVIEW_LENGTH = 100
+
+
+def is_changelist(request):
+    """Returns whether the request is for a change list page (and not for its actions, which may need every field)."""
+    return (request.method == 'GET' and request.resolver_match is not None
+            and request.resolver_match.url_name.endswith('_changelist'))
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Counts the rows of a change list only when it is filtered, or when the table is small. The unfiltered change list
+    of a large table gets an estimate instead: the planner's row count on PostgreSQL, and the largest id on SQLite
+    (both without a scan of the table).
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = self.estimate_count(queryset)
+            if estimate is not None and estimate > settings.ADMIN_EXACT_COUNT_THRESHOLD:
+                return estimate
+        return super().count
+
+    @staticmethod
+    def estimate_count(queryset):
+        """Returns an estimate of the number of rows of the table of the queryset, or None if there is none."""
+        connection = connections[queryset.db]
+        table = queryset.model._meta.db_table
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # -1 (or 0) until the table has been analyzed.
+                cursor.execute("SELECT reltuples FROM pg_class WHERE oid = %s::regclass", [table])
+            elif connection.vendor == 'sqlite':
+                # Ids are not reused, so this is an upper bound, off by the number of deleted rows.
+                cursor.execute(f"SELECT MAX({connection.ops.quote_name(queryset.model._meta.pk.column)}) "
+                               f"FROM {connection.ops.quote_name(table)}")
+            else:
+                return None
+            row = cursor.fetchone()
+        return int(row[0]) if row and row[0] is not None and row[0] > 0 else None
+
+
+class AutocompleteFilter(admin.FieldListFilter):
+    """
+    A list filter on a foreign key or many-to-many field with an autocomplete box (the admin's select2 widget, which
+    loads the choices matching what is typed), instead of a link per related object. The admin of the related model
+    needs search_fields.
+    """
+    template = 'admin/quiz/autocomplete_filter.html'
+
+    def __init__(self, field, request, params, model, model_admin, field_path):
+        self.lookup_kwarg = f'{field_path}__{field.target_field.name}__exact'
+        self.lookup_val = params.get(self.lookup_kwarg)
+        super().__init__(field, request, params, model, model_admin, field_path)
+        self.choice_field = forms.ModelChoiceField(
+            queryset=field.remote_field.model._default_manager.all(),
+            required=False,
+            widget=AutocompleteSelect(field.remote_field, model_admin.admin_site),
+        )
+
+    def expected_parameters(self):
+        return [self.lookup_kwarg]
+
+    def choices(self, changelist):
+        self.query_string = changelist.get_query_string(remove=[self.lookup_kwarg])
+        yield {
+            'selected': self.lookup_val is None,
+            'query_string': self.query_string,
+            'display': _('All'),
+        }
+
+    def widget(self):
+        """The autocomplete box, which reloads the change list filtered on the object picked (see choices)."""
+        return self.choice_field.widget.render(self.lookup_kwarg, self.lookup_val, attrs={
+            'class': 'quiz-autocomplete-filter',
+            'data-lookup': self.lookup_kwarg,
+            'data-query-string': self.query_string,
+            'style': 'width: 100%',
+        })
+
+
+class IndexedSearchMixin:
+    """
+    Looks up searches that are a UUID with the index of the UUIDs, and searches that are a number with the primary key
+    as well. Other searches go to search_text, which defaults to the search_fields of the admin.
+    """
+    paginator = EstimatedCountPaginator
+    # The "(N total)" next to the results of a search would count the whole table.
+    show_full_result_count = False
+    ordering = ('-id',)
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if search_term.isdigit():
+            # A number may also be (a part of) a text.
+            results, use_distinct = self.search_text(request, queryset, search_term)
+            return queryset.filter(id=int(search_term)) | results, use_distinct
+        try:
+            return queryset.filter(uuid=uuid.UUID(search_term)), False
+        except ValueError:
+            pass
+        return self.search_text(request, queryset, search_term)
+
+    def search_text(self, request, queryset, search_term):
+        return super().get_search_results(request, queryset, search_term)
+
+    @property
+    def media(self):
+        media = super().media
+        if any(isinstance(list_filter, tuple) and issubclass(list_filter[1], AutocompleteFilter)
+               for list_filter in self.list_filter):
+            # Loads jQuery and select2 before autocomplete_filter.js.
+            media += AutocompleteSelect(None, self.admin_site).media
+            media += forms.Media(js=['quiz/js/autocomplete_filter.js'])
+        return media
+
+
+class FullTextSearchMixin(IndexedSearchMixin):
+    """Searches the texts with the full-text index (see quiz/search.py), among the texts of all users."""
+    search_kind = None
+
+    def search_text(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        results = search.search(None, search_term, self.search_kind, limit=SEARCH_RESULTS_LIMIT)
+        return queryset.filter(id__in=[result['id'] for result in results]), False
+
+    def get_queryset(self, request):
+        # Only the start of the texts is shown in the change list.
+        queryset = super().get_queryset(request).annotate(text_preview=Substr('text', 1, PREVIEW_LENGTH))
+        return queryset.defer('text') if is_changelist(request) else queryset
+
+    def preview(self, obj):
+        text = obj.text_preview
+        return text + '…' if len(text) == PREVIEW_LENGTH else text
+    preview.short_description = _('Text')
+    preview.admin_order_field = 'text'
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        search.index([obj])
+
+    def delete_model(self, request, obj):
+        search.unindex([obj])
+        super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        sql, params = queryset.values('id').query.sql_with_params()
+        search.unindex_subquery(self.search_kind, sql, params)
+        super().delete_queryset(request, queryset)
+
+
+class MoveQuestionsForm(ActionForm):
+    topic = forms.IntegerField(label=_('Topic ID'), required=False, min_value=1)
+
+
+@admin.register(Question)
+class QuestionAdmin(FullTextSearchMixin, admin.ModelAdmin):
+    search_kind = search.QUESTION
+    list_display = ('id', 'preview', 'creator', 'created_at')
+    list_display_links = ('id', 'preview')
+    list_select_related = ('creator',)
+    list_filter = (('creator', AutocompleteFilter), ('topic', AutocompleteFilter))
+    search_fields = ('text',)
+    raw_id_fields = ('creator', 'topic', 'answers', 'wrong_answers')
+    action_form = MoveQuestionsForm
+    actions = ['move_to_topic']
+
+    def move_to_topic(self, request, queryset):
+        topic_id = request.POST.get('topic')
+        topic = Topic.objects.filter(id=topic_id).first() if topic_id and topic_id.isdigit() else None
+        if topic is None:
+            self.message_user(request, _("Enter the ID of the topic to move the questions to."), messages.ERROR)
+            return
+        moved = bulk_edits.move_questions(queryset, topic)
+        self.message_user(request, _("Moved %(moved)d questions to %(topic)s. Only the questions of the creator of the "
+                                     "topic are moved.") % {'moved': moved, 'topic': topic})
+    move_to_topic.short_description = _("Move the selected questions to the topic")
+
+
+@admin.register(Answer)
+class AnswerAdmin(FullTextSearchMixin, admin.ModelAdmin):
+    search_kind = search.ANSWER
+    list_display = ('id', 'preview', 'creator', 'created_at')
+    list_display_links = ('id', 'preview')
+    list_select_related = ('creator',)
+    list_filter = (('creator', AutocompleteFilter),)
+    search_fields = ('text',)
+    raw_id_fields = ('creator',)
+    actions = ['merge_duplicates']
+
+    def merge_duplicates(self, request, queryset):
+        merged = bulk_edits.merge_duplicate_answers(queryset)
+        self.message_user(request, _("Merged %(merged)d duplicate answers.") % {'merged': merged})
+    merge_duplicates.short_description = _("Merge the selected answers that differ only in case and spaces")
+
+
+@admin.register(Topic)
+class TopicAdmin(IndexedSearchMixin, admin.ModelAdmin):
+    list_display = ('id', 'name', 'creator', 'created_at')
+    list_display_links = ('id', 'name')
+    list_select_related = ('creator',)
+    list_filter = (('creator', AutocompleteFilter),)
+    # Also what the topic autocomplete boxes search.
+    search_fields = ('name',)
+    raw_id_fields = ('creator',)
+
+
+class PayloadAdmin(IndexedSearchMixin, admin.ModelAdmin):
+    """
+    The quizzes and attempts are created by the API only. Their pickled payloads are only loaded on the change page,
+    where they are shown read-only.
+    """
+    payload_field = None
+    list_select_related = ('creator', 'topic')
+    list_filter = (('topic', AutocompleteFilter),)
+    # Only ids and UUIDs are searched (see IndexedSearchMixin).
+    search_fields = ('uuid',)
+    raw_id_fields = ('topic',)
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        return queryset.defer(self.payload_field) if is_changelist(request) else queryset
+
+    def search_text(self, request, queryset, search_term):
+        return queryset.none(), False
+
+    def get_readonly_fields(self, request, obj=None):
+        return ('uuid', 'payload', *super().get_readonly_fields(request, obj))
+
+    def payload(self, obj):
+        return format_html('<pre>{}</pre>', pprint.pformat(getattr(obj, self.payload_field), width=100))
+    payload.short_description = _('Payload')
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(Quiz)
+class QuizAdmin(PayloadAdmin):
+    payload_field = 'quiz'
+    list_display = ('id', 'uuid', 'creator', 'topic', 'created_at')
+    list_filter = (('creator', AutocompleteFilter), ('topic', AutocompleteFilter))
+    raw_id_fields = ('creator', 'topic')
+
+
+@admin.register(QuizAttempt)
+class QuizAttemptAdmin(PayloadAdmin):
+    payload_field = 'quiz_attempt'
+    list_display = ('id', 'uuid', 'user', 'topic', 'score', 'created_at')
+    list_select_related = ('user', 'topic')
+    list_filter = (('user', AutocompleteFilter), ('topic', AutocompleteFilter))
+    raw_id_fields = ('quiz',)
@@ -3,3 +3,19 @@ from django.apps import AppConfig
 
 class QuizConfig(AppConfig):
     name = 'quiz'
+
+    def ready(self):
+        # Connect the signals that invalidate cached access tokens, and register the system checks of the caches.
+        import quiz.authentication  # noqa: F401
+        import quiz.routers  # noqa: F401
+
+        # Count and time the queries of every request (see quiz/instrumentation.py).
+        from django.db.backends.signals import connection_created
+        from quiz.instrumentation import install_query_recorder
+        connection_created.connect(install_query_recorder, dispatch_uid='quiz.instrumentation.install_query_recorder')
+
+        # Log the slow queries, if enabled (see quiz/slow_queries.py).
+        from django.conf import settings
+        if settings.SLOW_QUERY_LOG:
+            from quiz.slow_queries import install_slow_query_log
+            connection_created.connect(install_slow_query_log, dispatch_uid='quiz.slow_queries.install_slow_query_log')
@@ -0,0 +1,216 @@
+"""
+Async versions of the generate quiz, retrieve quiz and attempt quiz endpoints, used when Django is served over ASGI
+(see run_django.sh). With sync views, a slow generate_quiz blocks a whole gunicorn worker. Here, the event loop keeps
+serving other requests while we wait for the database or for the quiz executor.
+
+Django 3.1 does not have an async ORM yet, so the (short) queries are run with sync_to_async, which is what the async
+ORM methods of later Django versions do as well. The CPU heavy parts (sampling in Topic.generate_quiz, grading in
+Quiz.check_quiz_answers and rendering of the response) are run in a bounded thread pool so that one large quiz cannot
+use up all the threads.
+
+Authentication, permissions, content negotiation and the payload layout are all handled by the same DRF views as the
+sync endpoints, so both behave the same way.
+"""
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core import signing
+from django.db import close_old_connections
+from django.http import HttpResponseNotAllowed
+from rest_framework import status
+from rest_framework.response import Response
+
+from quiz import quiz_tokens
+from quiz.models import Topic, Quiz
+from quiz.serializers import QuizSerializer, QuizAnswerSerializer, QuizTokenAnswerSerializer
+from quiz.views import GenerateQuizAPIView, CheckQuizAnswersAPIView
+
+# Every thread in this pool holds its own database connection, so QUIZ_EXECUTOR_WORKERS also bounds the number of
+#  connections used per worker process.
+quiz_executor = ThreadPoolExecutor(max_workers=settings.QUIZ_EXECUTOR_WORKERS, thread_name_prefix='quiz-executor')
+
+
+def _call_with_connection_cleanup(func, *args, **kwargs):
+    """Runs in a quiz executor thread. Close the thread's connection afterwards, as a request would."""
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def run_in_quiz_executor(func, *args, **kwargs):
+    """Run a sync function in the bounded quiz executor and wait for the result without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    # Unlike sync_to_async, run_in_executor does not copy the context variables to the executor thread. Copy them so
+    #  that the queries and phases in the executor are added to the timings of the request (see PerformanceMiddleware).
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(quiz_executor, functools.partial(
+        context.run, _call_with_connection_cleanup, func, *args, **kwargs))
+
+
+def database_sync_to_async(func):
+    """Short ORM calls are run in the thread that Django uses for sync code."""
+    return sync_to_async(func, thread_sensitive=True)
+
+
+def _initial(view_class, request, action, **kwargs):
+    """
+    Does what APIView.dispatch does before calling the handler: authenticate the user, check permissions and pick
+    a renderer.
+
+    Returns the view and a response if the request failed any of these checks.
+    """
+    view = view_class()
+    # The viewset sets view.action from the action map when initializing the request.
+    view.action_map = {request.method.lower(): action}
+    view.args = ()
+    view.kwargs = kwargs
+    view.request = view.initialize_request(request, **kwargs)
+    view.headers = view.default_response_headers
+    try:
+        view.initial(view.request, **kwargs)
+    except Exception as exc:
+        return view, view.handle_exception(exc)
+    return view, None
+
+
+async def _handle(view, handler, pk):
+    """
+    Does what APIView.dispatch does around the handler: exceptions raised by the handler (e.g. the ParseError of a
+    malformed request body) are turned into a response by view.handle_exception, as for the sync views.
+    """
+    try:
+        return await handler(view, pk)
+    except Exception as exc:
+        return await database_sync_to_async(view.handle_exception)(exc)
+
+
+async def _finalize(view, response):
+    """Does what APIView.dispatch does after the handler, then renders the response in the quiz executor."""
+    response = view.finalize_response(view.request, response, **view.kwargs)
+    return await run_in_quiz_executor(response.render)
+
+
+async def _retrieve_quiz(view, pk):
+    try:
+        quiz = await database_sync_to_async(view.quiz_queryset().get)(id=pk)
+    except Quiz.DoesNotExist:
+        return Response({"error_description": "Quiz Does Not Exist"}, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response(view.to_layout(quiz.quiz), status=status.HTTP_200_OK)
+
+
+async def _generate_quiz(view, pk):
+    try:
+        topic = await database_sync_to_async(view.topic_queryset().get)(id=pk)
+    except Topic.DoesNotExist:
+        return Response({"error_description": "Topic does not exist"}, status=status.HTTP_400_BAD_REQUEST)
+
+    if not await database_sync_to_async(topic.questions.exists)():
+        return Response({"error_description": "Topic has no questions. Add some questions to the topic first."},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    serializer = QuizSerializer(data=view.request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    stateless = serializer.validated_data['stateless']
+    quiz_object = await run_in_quiz_executor(
+        topic.generate_quiz,
+        no_of_questions=serializer.validated_data['no_of_questions'],
+        no_of_choices=serializer.validated_data['no_of_choices'],
+        show_all_alternative_answers=serializer.validated_data['show_all_alternative_answers'],
+        fixed_choices_only=serializer.validated_data['fixed_choices_only'],
+        adaptive=serializer.validated_data['adaptive'],
+        rotation=serializer.validated_data['rotation'],
+        save=not stateless,
+    )
+    randomly_generated_quiz = view.to_layout(quiz_object.quiz)
+    if stateless:
+        randomly_generated_quiz = {**randomly_generated_quiz,
+                                   'token': await run_in_quiz_executor(quiz_tokens.dumps, quiz_object,
+                                                                       view.request.user)}
+    return Response(randomly_generated_quiz, status=status.HTTP_201_CREATED)
+
+
+async def _check_quiz_answers(view, pk):
+    try:
+        quiz = await database_sync_to_async(view.quiz_queryset().get)(id=pk)
+    except Quiz.DoesNotExist:
+        return Response({"error_description": "Quiz Does Not Exist"}, status=status.HTTP_400_BAD_REQUEST)
+
+    serializer = QuizAnswerSerializer(data=view.request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    quiz_attempt = await run_in_quiz_executor(quiz.check_quiz_answers,
+                                              chosen_answers=serializer.validated_data['answers'])
+    return Response(view.to_layout(quiz_attempt.quiz_attempt), status=status.HTTP_201_CREATED)
+
+
+async def _check_stateless_quiz_answers(view, pk):
+    serializer = QuizTokenAnswerSerializer(data=view.request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        quiz_attempt = await run_in_quiz_executor(quiz_tokens.check_answers, serializer.validated_data['token'],
+                                                  serializer.validated_data['answers'], view.request.user)
+    except signing.BadSignature:
+        return Response({"error_description": "Invalid or expired quiz token"}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(view.to_layout(quiz_attempt.quiz_attempt), status=status.HTTP_201_CREATED)
+
+
+async def generate_quiz(request, pk):
+    """
+    Async version of GenerateQuizAPIView.
+
+    GET retrieves an older quiz with the pk of the quiz. PUT generates a new quiz with the pk of a topic, which is not
+    saved with "stateless": true, but returned with a token to POST to attempt_stateless_quiz.
+    """
+    actions = {'GET': 'retrieve', 'PUT': 'update'}
+    if request.method not in actions:
+        return HttpResponseNotAllowed(list(actions))
+
+    view, response = await database_sync_to_async(_initial)(GenerateQuizAPIView, request, actions[request.method],
+                                                            pk=pk)
+    if response is None:
+        response = await _handle(view, _retrieve_quiz if request.method == 'GET' else _generate_quiz, pk)
+    return await _finalize(view, response)
+
+
+async def attempt_quiz(request, pk):
+    """Async version of CheckQuizAnswersAPIView. PUT the answers to the quiz with the given pk."""
+    if request.method != 'PUT':
+        return HttpResponseNotAllowed(['PUT'])
+
+    view, response = await database_sync_to_async(_initial)(CheckQuizAnswersAPIView, request, 'update', pk=pk)
+    if response is None:
+        response = await _handle(view, _check_quiz_answers, pk)
+    return await _finalize(view, response)
+
+
+async def attempt_stateless_quiz(request):
+    """
+    Async version of CheckQuizAnswersAPIView.create. POST the token of a stateless quiz (see generate_quiz) with the
+    answers.
+    """
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+
+    view, response = await database_sync_to_async(_initial)(CheckQuizAnswersAPIView, request, 'create')
+    if response is None:
+        response = await _handle(view, _check_stateless_quiz_answers, None)
+    return await _finalize(view, response)
+
+
+# Authentication is done with OAuth tokens, as with the DRF views. Django's csrf_exempt decorator returns a sync
+#  function, which would stop Django from recognising these views as async, so we set the attribute directly.
+generate_quiz.csrf_exempt = True
+attempt_quiz.csrf_exempt = True
+attempt_stateless_quiz.csrf_exempt = True
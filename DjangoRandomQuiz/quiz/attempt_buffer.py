@@ -0,0 +1,332 @@
+"""
+Write-behind buffer of the quiz attempts, for the spikes of attempts at the end of an exam.
+
+Without it, every attempt is inserted and then saved again with its id in its payload, and then the question weights
+of its user are updated (if the user has adaptive quizzes of its topic): two to six writes per attempt. With
+ATTEMPT_BUFFER_SIZE set, the graded attempts are kept in the process instead, and inserted in batches, with the
+question weights (see QuizAttempt.record):
+
+    - An attempt is first appended to the spool file of the process and synced to disk, so that it is not lost if the
+      process dies before it is inserted. Then it is added to the buffer, and the client gets its graded attempt at
+      once, with its UUID but without its id.
+    - The buffer is flushed when it holds ATTEMPT_BUFFER_SIZE attempts (by the request that fills it),
+      ATTEMPT_BUFFER_DELAY seconds after the first of them was added (by a timer thread), and when the process exits.
+      A flush inserts the attempts with bulk_create, looks up their ids by UUID, saves the ids in the payloads with
+      bulk_update and updates the question weights of all of them (see QuestionWeight.update_from_attempts), in one
+      transaction: 4 queries per batch, or 8 if some of the users have adaptive quizzes, instead of 3 to 7 per
+      attempt. From then on, the attempt can be fetched by its UUID (see QuizAttemptByUUIDAPIView), with its id.
+    - The spool files of a batch are deleted once the batch is committed. If the flush fails, the attempts are put
+      back in the buffer, to be flushed again with the next ones. If it fails because of some of the attempts (an
+      IntegrityError, e.g. the quiz of an attempt was deleted), the attempts are inserted one by one instead, and the
+      ones that cannot be inserted at all are moved to a dead-letter spool file (dead-attempts-*.spool) and logged.
+    - The spool files left by a process that died are inserted when the buffer of another process is created, or with
+      manage.py flush_attempts. The UUIDs are unique, so the attempts that were inserted already are skipped.
+
+The created_at of a buffered attempt is the time it was inserted, not the time it was graded. The spool files are per
+process: ATTEMPT_SPOOL_DIR must be on a local disk that outlives the processes.
+"""
+import atexit
+import logging
+import os
+import pickle
+import struct
+import threading
+import uuid
+from pathlib import Path
+
+from django.apps import apps
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, router, transaction
+
+logger = logging.getLogger(__name__)
+
+# The fields of an attempt that are kept in the spool files (the others are set when it is inserted), and the
+#  attributes that are not saved but are needed to insert it.
+FIELDS = ('uuid', 'quiz_id', 'user_id', 'topic_id', 'quiz_attempt', 'score', 'topic_name', 'no_of_questions')
+ATTRIBUTES = ('question_ids',)
+# Each record of a spool file is the size of the pickled fields, then the pickled fields.
+RECORD_HEADER = struct.Struct('>I')
+# The most attempts inserted per transaction (and per UUID lookup).
+INSERT_BATCH_SIZE = 500
+
+
+def _model():
+    # Not imported, as quiz.models imports this module.
+    return apps.get_model('quiz', 'QuizAttempt')
+
+
+def write_records(file, attempts):
+    """Append the attempts to the spool file, and sync it to disk."""
+    file.write(b''.join(
+        RECORD_HEADER.pack(len(data)) + data
+        for data in (pickle.dumps({field: getattr(attempt, field) for field in FIELDS + ATTRIBUTES},
+                                  pickle.HIGHEST_PROTOCOL)
+                     for attempt in attempts)
+    ))
+    file.flush()
+    os.fsync(file.fileno())
+
+
+def read_records(path):
+    """Returns the attempts of a spool file. A record cut short (by a crash while it was written) is skipped."""
+    model = _model()
+    data = Path(path).read_bytes()
+    attempts = []
+    offset = 0
+    while offset + RECORD_HEADER.size <= len(data):
+        size, = RECORD_HEADER.unpack_from(data, offset)
+        offset += RECORD_HEADER.size
+        if offset + size > len(data):
+            break
+        fields = pickle.loads(data[offset:offset + size])
+        # The spool files written before an attribute was added do not have it.
+        attributes = {attribute: fields.pop(attribute, None) for attribute in ATTRIBUTES}
+        attempt = model(**fields)
+        for attribute, value in attributes.items():
+            setattr(attempt, attribute, value)
+        attempts.append(attempt)
+        offset += size
+    return attempts
+
+
+def insert(attempts, spool_dir, skip_existing=False):
+    """
+    Insert the attempts, with their ids in their payloads, in batches of INSERT_BATCH_SIZE. With skip_existing, the
+    attempts whose UUID is in the database already are left out. Returns the attempts inserted.
+
+    One attempt that cannot be inserted (e.g. its quiz was deleted after it was graded) must not hold back the others,
+    so if the batches fail with an IntegrityError, the attempts are inserted one by one instead (see
+    _insert_one_by_one). Any other error (e.g. the database is down) is raised.
+    """
+    try:
+        return _insert(attempts, skip_existing)
+    except IntegrityError:
+        logger.warning("Could not insert a batch of %s quiz attempts, inserting them one by one", len(attempts),
+                       exc_info=True)
+    return _insert_one_by_one(attempts, spool_dir)
+
+
+def _insert_one_by_one(attempts, spool_dir):
+    """
+    Insert the attempts one by one. The quiz and topic of an attempt are set to NULL if they do not exist anymore, as
+    deleting them does for the attempts in the database. The attempts that still cannot be inserted (e.g. of a deleted
+    user) are moved to a dead-letter spool file in spool_dir, which is not recovered, and logged.
+    """
+    model = _model()
+    using = router.db_for_write(model)
+    for attempt in attempts:
+        # Set by the batch that was rolled back.
+        attempt.id = None
+        attempt.quiz_attempt = {key: value for key, value in attempt.quiz_attempt.items() if key != 'id'}
+
+    existing_ids = {}
+    for field in ('quiz', 'topic'):
+        related_model = model._meta.get_field(field).related_model
+        ids = {getattr(attempt, f'{field}_id') for attempt in attempts} - {None}
+        existing_ids[field] = set(related_model.objects.using(using).filter(id__in=ids).values_list('id', flat=True))
+
+    inserted = []
+    failed = []
+    for attempt in attempts:
+        for field, ids in existing_ids.items():
+            if getattr(attempt, f'{field}_id') not in ids:
+                setattr(attempt, f'{field}_id', None)
+        try:
+            # The attempts inserted before a flush that failed are skipped.
+            inserted.extend(_insert([attempt], skip_existing=True))
+        except IntegrityError:
+            logger.exception("Could not insert the quiz attempt %s", attempt.uuid)
+            failed.append(attempt)
+
+    if failed:
+        path = Path(spool_dir) / f'dead-attempts-{os.getpid()}-{uuid.uuid4().hex}.spool'
+        with open(path, 'ab') as file:
+            write_records(file, failed)
+        logger.error("Moved %s quiz attempts that could not be inserted to %s: %s", len(failed), path,
+                     ', '.join(str(attempt.uuid) for attempt in failed))
+    return inserted
+
+
+def _insert(attempts, skip_existing):
+    model = _model()
+    inserted = []
+    with transaction.atomic(using=router.db_for_write(model)):
+        for start in range(0, len(attempts), INSERT_BATCH_SIZE):
+            batch = attempts[start:start + INSERT_BATCH_SIZE]
+            if skip_existing:
+                existing = set(model.objects.filter(uuid__in=[attempt.uuid for attempt in batch])
+                               .values_list('uuid', flat=True))
+                batch = [attempt for attempt in batch if attempt.uuid not in existing]
+                if not batch:
+                    continue
+            model.objects.bulk_create(batch)
+            # Only PostgreSQL returns the ids of the rows inserted by bulk_create.
+            ids = dict(model.objects.filter(uuid__in=[attempt.uuid for attempt in batch]).values_list('uuid', 'id'))
+            for attempt in batch:
+                attempt.id = ids[attempt.uuid]
+                # A new dict, as the request that graded the attempt may still be rendering the old one.
+                attempt.quiz_attempt = {**attempt.quiz_attempt, 'id': attempt.id}
+            model.objects.bulk_update(batch, ['quiz_attempt'])
+            # In the same transaction, so that the weights are updated once per attempt, even if it is recovered.
+            apps.get_model('quiz', 'QuestionWeight').update_from_attempts([attempt.graded() for attempt in batch])
+            inserted.extend(batch)
+    return inserted
+
+
+def _spool_pid(path):
+    """Returns the id of the process that wrote the spool file (see AttemptBuffer.spool_path)."""
+    try:
+        return int(path.name.split('-')[1])
+    except (IndexError, ValueError):
+        return None
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Running, as another user.
+        return True
+    return True
+
+
+def recover(spool_dir):
+    """
+    Insert the attempts of the spool files left by the processes that are not running anymore, and delete the files.
+    Returns the number of attempts inserted.
+    """
+    spool_dir = Path(spool_dir)
+    if not spool_dir.is_dir():
+        return 0
+    recovered = 0
+    for path in sorted(spool_dir.glob('attempts-*.spool')):
+        pid = _spool_pid(path)
+        if pid is None:
+            continue
+        # The files of this process are left over from an earlier process with the same id, unless its buffer exists.
+        if (_is_running(pid) and pid != os.getpid()) or (pid == os.getpid() and _buffer is not None):
+            continue
+        # Take over the file first, so that no other process recovers it at the same time. If this process dies
+        #  before it is done, the file is recovered again, as one of its own.
+        claimed = spool_dir / f'attempts-{os.getpid()}-recovered{uuid.uuid4().hex}.spool'
+        try:
+            os.rename(path, claimed)
+        except FileNotFoundError:
+            continue
+        recovered += len(insert(read_records(claimed), spool_dir, skip_existing=True))
+        os.remove(claimed)
+    if recovered:
+        logger.info("Recovered %s quiz attempts from the spool files in %s", recovered, spool_dir)
+    return recovered
+
+
+class AttemptBuffer:
+    """The quiz attempts of the process that are not inserted yet, and their spool files (see the module docstring)."""
+
+    def __init__(self, spool_dir, size, delay):
+        self.spool_dir = Path(spool_dir)
+        self.size = size
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.pending = []
+        # The spool files of the pending attempts, the last of which is open for the next ones.
+        self.spool_paths = []
+        self.spool = None
+        self.spool_number = 0
+        self.timer = None
+        self.spool_dir.mkdir(parents=True, exist_ok=True)
+
+    def spool_path(self, number):
+        return self.spool_dir / f'attempts-{os.getpid()}-{number}.spool'
+
+    def add(self, attempt):
+        """Spool and buffer the attempt, and flush the buffer if it is full."""
+        with self.lock:
+            if self.spool is None:
+                self.spool_number += 1
+                path = self.spool_path(self.spool_number)
+                self.spool = open(path, 'ab')
+                self.spool_paths.append(path)
+            write_records(self.spool, [attempt])
+            self.pending.append(attempt)
+            full = len(self.pending) >= self.size
+            if not full:
+                self.schedule_flush()
+        if full:
+            try:
+                self.flush()
+            except Exception:
+                # The attempt is spooled and graded, and is flushed again with the next ones. Failing the request would
+                #  only make the client attempt the quiz again, and save the attempt twice.
+                logger.exception("Could not insert the buffered quiz attempts")
+
+    def schedule_flush(self):
+        """Flush in ATTEMPT_BUFFER_DELAY seconds, unless a flush is scheduled already. Call with the lock held."""
+        if self.timer is None:
+            self.timer = threading.Timer(self.delay, self.flush_in_background)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def flush(self):
+        """Insert the buffered attempts, and delete their spool files. Returns the attempts inserted."""
+        with self.lock:
+            attempts, self.pending = self.pending, []
+            spool_paths, self.spool_paths = self.spool_paths, []
+            if self.spool is not None:
+                self.spool.close()
+                self.spool = None
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+        if not attempts:
+            return []
+
+        try:
+            inserted = insert(attempts, self.spool_dir)
+        except Exception:
+            # Flushed again with the next attempts (or recovered from the spool files if the process dies).
+            with self.lock:
+                self.pending[:0] = attempts
+                self.spool_paths[:0] = spool_paths
+                self.schedule_flush()
+            raise
+        for path in spool_paths:
+            os.remove(path)
+        return inserted
+
+    def flush_in_background(self):
+        close_old_connections()
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Could not insert the buffered quiz attempts")
+        finally:
+            close_old_connections()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer():
+    """
+    Returns the buffer of the process, or None if ATTEMPT_BUFFER_SIZE is 0. The first call recovers the spool files
+    of the processes that died, and makes the buffer flush when the process exits.
+    """
+    global _buffer
+    if not settings.ATTEMPT_BUFFER_SIZE:
+        return None
+    with _buffer_lock:
+        if _buffer is None:
+            try:
+                recover(settings.ATTEMPT_SPOOL_DIR)
+            except Exception:
+                # The spool files that were not recovered are left for the next process, or for flush_attempts.
+                logger.exception("Could not recover the quiz attempts of the spool files in %s",
+                                 settings.ATTEMPT_SPOOL_DIR)
+            _buffer = AttemptBuffer(settings.ATTEMPT_SPOOL_DIR, settings.ATTEMPT_BUFFER_SIZE,
+                                    settings.ATTEMPT_BUFFER_DELAY)
+            atexit.register(_buffer.flush_in_background)
+        return _buffer
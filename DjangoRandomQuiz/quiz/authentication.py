@@ -0,0 +1,248 @@
+"""
+Cached validation of OAuth2 access tokens.
+
+Without caching, every API request looks up the AccessToken (with its application and user) in the database twice:
+once in oauth2_provider's OAuth2TokenMiddleware and once in its DRF OAuth2Authentication class. Here, both look in the
+token cache first, which holds the validated AccessToken instances (with the user and the scopes) for at most
+OAUTH2_TOKEN_CACHE_TTL seconds, and never past the expiry of the token.
+
+There are two layers:
+    1. An in-process cache, holding up to OAUTH2_TOKEN_CACHE_MAX_SIZE tokens per worker process.
+    2. A shared cache (the alias of one of the CACHES in OAUTH2_TOKEN_CACHE), shared by all the workers.
+
+Deleting (which is how oauth2_provider revokes access tokens) or changing an access token, or changing its user,
+invalidates the cached token straight away, in every worker: the in-process caches check the shared cache for revoked
+tokens on every hit. Without a shared cache, a worker could not tell the others, which would keep accepting a revoked
+token (or a deactivated user) until their entry expires. So the tokens are only cached if OAUTH2_TOKEN_CACHE is set,
+and every request validates its token with the database otherwise.
+
+As the cached value is the AccessToken itself, TokenHasReadWriteScope works exactly as before: it checks
+request.auth.is_valid(scopes), which checks the expiry and the scopes of the token.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import checks
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from oauth2_provider.contrib.rest_framework import OAuth2Authentication
+from oauth2_provider.middleware import OAuth2TokenMiddleware
+from oauth2_provider.models import get_access_token_model
+from oauth2_provider.oauth2_backends import get_oauthlib_core
+
+from quiz import metrics
+
+AccessToken = get_access_token_model()
+
+
+class AccessTokenCache:
+    """Two-layer cache of validated AccessToken instances, keyed by a hash of the token."""
+
+    def __init__(self, ttl, max_size, shared_cache_alias=None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.shared_cache_alias = shared_cache_alias
+
+        # Maps the key to (monotonic time the entry expires, access token), least recently used first.
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def shared_cache(self):
+        return caches[self.shared_cache_alias] if self.shared_cache_alias else None
+
+    @property
+    def enabled(self):
+        # Revocations can only reach the other workers through the shared cache (see the module docstring).
+        return bool(self.shared_cache_alias)
+
+    @staticmethod
+    def key(token):
+        # Do not use the raw token as a cache key, as cache keys may end up in logs.
+        return 'oauth2-token:' + hashlib.sha256(token.encode()).hexdigest()
+
+    @staticmethod
+    def revoked_key(key):
+        return key + ':revoked'
+
+    def get(self, token):
+        """Returns the cached AccessToken for the given token, or None."""
+        if not self.enabled:
+            return None
+        key = self.key(token)
+
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._local.move_to_end(key)
+                else:
+                    del self._local[key]
+                    entry = None
+
+        shared_cache = self.shared_cache
+        revoked_key = self.revoked_key(key)
+        if entry is not None:
+            if shared_cache.get(revoked_key):
+                # Revoked in another worker.
+                self._discard_local(key)
+                return None
+            return entry[1]
+
+        values = shared_cache.get_many([key, revoked_key])
+        access_token = values.get(key)
+        if access_token is None or values.get(revoked_key):
+            # Possibly cached by a worker that validated the token just before it was revoked.
+            return None
+        self._set_local(key, access_token)
+        return access_token
+
+    def set(self, access_token):
+        """Cache a validated AccessToken until the TTL or the expiry of the token, whichever comes first."""
+        if not self.enabled:
+            return
+        ttl = min(self.ttl, (access_token.expires - timezone.now()).total_seconds())
+        if ttl <= 0:
+            return
+
+        key = self.key(access_token.token)
+        shared_cache = self.shared_cache
+        # The token was revoked (or changed) while this worker was validating it. The revoked marker is never cleared
+        #  here, as that would undo the revocation: the token is not cached until the marker expires.
+        if shared_cache.get(self.revoked_key(key)):
+            return
+        self._set_local(key, access_token, ttl)
+        shared_cache.set(key, access_token, ttl)
+
+    def invalidate(self, token):
+        key = self.key(token)
+        self._discard_local(key)
+        shared_cache = self.shared_cache
+        if shared_cache is not None:
+            shared_cache.delete(key)
+            # Tell the in-process caches of the other workers. Their entries are gone after the TTL. The marker is kept
+            #  for twice as long, so that it outlives the entry of a worker that was validating the token when it was
+            #  revoked, and cached it just after.
+            shared_cache.set(self.revoked_key(key), True, 2 * self.ttl)
+
+    def clear(self):
+        with self._lock:
+            self._local.clear()
+
+    def _set_local(self, key, access_token, ttl=None):
+        ttl = ttl if ttl is not None else min(self.ttl, (access_token.expires - timezone.now()).total_seconds())
+        with self._lock:
+            self._local[key] = (time.monotonic() + ttl, access_token)
+            self._local.move_to_end(key)
+            while len(self._local) > self.max_size:
+                self._local.popitem(last=False)
+
+    def _discard_local(self, key):
+        with self._lock:
+            self._local.pop(key, None)
+
+
+token_cache = AccessTokenCache(
+    ttl=settings.OAUTH2_TOKEN_CACHE_TTL,
+    max_size=settings.OAUTH2_TOKEN_CACHE_MAX_SIZE,
+    shared_cache_alias=settings.OAUTH2_TOKEN_CACHE,
+)
+
+
+@checks.register(checks.Tags.caches)
+def check_token_cache(app_configs, **kwargs):
+    """OAUTH2_TOKEN_CACHE must be a cache shared by every worker process, or revocations do not reach them."""
+    alias = settings.OAUTH2_TOKEN_CACHE
+    if not alias:
+        return []
+    if alias not in settings.CACHES:
+        return [checks.Error(f"OAUTH2_TOKEN_CACHE is '{alias}', which is not in CACHES.", id='quiz.E001')]
+    if isinstance(caches[alias], (LocMemCache, DummyCache)):
+        return [checks.Error(
+            f"OAUTH2_TOKEN_CACHE is '{alias}', which is not shared between processes.",
+            hint="Use a cache shared by every worker process, e.g. 'default' with a redis CACHE_URL.",
+            id='quiz.E002',
+        )]
+    return []
+
+
+def get_bearer_token(request):
+    """Returns the token from an 'Authorization: Bearer <token>' header, or None."""
+    auth_type, _, token = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+    if auth_type.lower() != 'bearer' or not token.strip():
+        return None
+    return token.strip()
+
+
+def verify_request(request):
+    """
+    Returns the valid AccessToken of the request, from the token cache if possible. Otherwise, validate it with
+    oauth2_provider as usual and cache it.
+
+    Returns a tuple of (access token or None, oauthlib request or None). The oauthlib request is only returned when
+    the token was validated by oauth2_provider, and holds the error for the WWW-Authenticate header.
+    """
+    token = get_bearer_token(request)
+    if token is not None:
+        access_token = token_cache.get(token)
+        hit = access_token is not None and not access_token.is_expired()
+        metrics.observe_cache_lookup('access_token', hit)
+        if hit:
+            return access_token, None
+
+    valid, oauthlib_request = get_oauthlib_core().verify_request(request, scopes=[])
+    if not valid:
+        return None, oauthlib_request
+
+    if token is not None and oauthlib_request.access_token.token == token:
+        token_cache.set(oauthlib_request.access_token)
+    return oauthlib_request.access_token, oauthlib_request
+
+
+class CachedOAuth2Authentication(OAuth2Authentication):
+    """OAuth2Authentication that validates the access token with the token cache."""
+
+    def authenticate(self, request):
+        access_token, oauthlib_request = verify_request(request)
+        if access_token is not None:
+            return access_token.user, access_token
+        request.oauth2_error = getattr(oauthlib_request, "oauth2_error", {})
+        return None
+
+
+class CachedOAuth2TokenMiddleware(OAuth2TokenMiddleware):
+    """OAuth2TokenMiddleware that validates the access token with the token cache."""
+
+    def process_request(self, request):
+        # Do something only if request contains a Bearer token
+        if request.META.get("HTTP_AUTHORIZATION", "").startswith("Bearer"):
+            if not hasattr(request, "user") or request.user.is_anonymous:
+                access_token, _ = verify_request(request)
+                if access_token is not None:
+                    request.user = request._cached_user = access_token.user
+
+
+@receiver(post_save, sender=AccessToken)
+@receiver(post_delete, sender=AccessToken)
+def invalidate_access_token(sender, instance, created=False, **kwargs):
+    """Revoking a token deletes it. Changing a token may change its scopes or expiry."""
+    if created:
+        return
+    token_cache.invalidate(instance.token)
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_access_tokens(sender, instance, created, **kwargs):
+    """The cached tokens hold a copy of the user, so they must be dropped when the user changes (e.g. deactivated)."""
+    if created:
+        return
+    for token in AccessToken.objects.filter(user=instance).values_list('token', flat=True):
+        token_cache.invalidate(token)
@@ -0,0 +1,248 @@
+"""
+Connection reuse for the database backends in quiz/backends (see DATABASES in settings.py).
+
+Django opens a new database connection for every request unless CONN_MAX_AGE is set, and Django 3.1 does not check
+whether a persistent connection still works before reusing it. The backends here add:
+
+    1. Health checks (CONN_HEALTH_CHECKS): a persistent connection is checked before its first use in every request,
+       and replaced if the database closed it (e.g. after a restart or an idle timeout), instead of failing the request.
+    2. An optional in-process pool (POOL_SIZE connections per worker process). Connections are returned to the pool
+       at the end of every request instead of being closed, and are shared by all the threads of the worker (e.g. the
+       quiz executor of the async views). A request that finds every connection in use waits for up to POOL_TIMEOUT
+       seconds. Idle connections are checked before reuse if they have been idle for POOL_CHECK_DELAY seconds.
+
+The pools record how often and how long requests wait for a connection (see pool_stats), and every wait is added to
+the 'db.pool_wait' phase of the request (see quiz/instrumentation.py).
+"""
+import functools
+import os
+import threading
+import time
+from collections import deque
+
+from quiz.instrumentation import current_timings
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    """
+    A bounded pool of raw DB-API connections.
+
+    connect() opens a new connection, check(connection) returns whether a connection still works, and
+    reset(connection) prepares a connection for reuse (e.g. rolls back an open transaction).
+    """
+
+    def __init__(self, alias, size, timeout, check_delay, check, reset):
+        self.alias = alias
+        self.size = size
+        self.timeout = timeout
+        self.check_delay = check_delay
+        self.check = check
+        self.reset = reset
+
+        # Idle connections with the monotonic time they were returned, the most recently returned last.
+        self._idle = deque()
+        # Number of open connections, idle or in use.
+        self._open = 0
+        self._condition = threading.Condition()
+
+        self.acquired = 0
+        self.created = 0
+        self.discarded = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.timeouts = 0
+
+    def acquire(self, connect):
+        """Returns (connection, seconds waited for it). Raises PoolTimeout after waiting for timeout seconds."""
+        start = time.monotonic()
+        deadline = start + self.timeout
+        waited = False
+        while True:
+            with self._condition:
+                while not self._idle and self._open >= self.size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        raise PoolTimeout(f"No connection to the '{self.alias}' database available after waiting "
+                                          f"{self.timeout}s (POOL_SIZE={self.size}).")
+                    waited = True
+                    self._condition.wait(remaining)
+
+                if self._idle:
+                    connection, returned_at = self._idle.pop()
+                else:
+                    connection, returned_at = None, None
+                    self._open += 1
+
+            if connection is None:
+                try:
+                    connection = connect()
+                except Exception:
+                    self._forget()
+                    raise
+                self.created += 1
+            elif time.monotonic() - returned_at >= self.check_delay and not self.check(connection):
+                self.discard(connection)
+                continue
+
+            wait = time.monotonic() - start
+            with self._condition:
+                self.acquired += 1
+                if waited:
+                    self.waits += 1
+                    self.wait_time += wait
+                    self.max_wait_time = max(self.max_wait_time, wait)
+            return connection, wait if waited else 0.0
+
+    def release(self, connection):
+        """Return a connection to the pool, or close it if it cannot be reset."""
+        try:
+            self.reset(connection)
+        except Exception:
+            self.discard(connection)
+            return
+        with self._condition:
+            self._idle.append((connection, time.monotonic()))
+            self._condition.notify()
+
+    def discard(self, connection):
+        """Close a connection that was taken from the pool and make room for a new one."""
+        try:
+            connection.close()
+        except Exception:
+            pass
+        self.discarded += 1
+        self._forget()
+
+    def _forget(self):
+        with self._condition:
+            self._open -= 1
+            self._condition.notify()
+
+    def close_idle(self):
+        """Close all the idle connections."""
+        with self._condition:
+            idle, self._idle = self._idle, deque()
+        for connection, _ in idle:
+            self.discard(connection)
+
+    def stats(self):
+        with self._condition:
+            return {
+                'size': self.size,
+                'open': self._open,
+                'idle': len(self._idle),
+                'in_use': self._open - len(self._idle),
+                'acquired': self.acquired,
+                'created': self.created,
+                'discarded': self.discarded,
+                'waits': self.waits,
+                'wait_time': self.wait_time,
+                'max_wait_time': self.max_wait_time,
+                'timeouts': self.timeouts,
+            }
+
+
+# The pools of this process by database alias. Gunicorn forks its workers after importing the app (with --preload), so
+#  the pools are keyed by the pid as well: a worker must never use connections opened by its parent.
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def pool_stats():
+    """Returns the stats of the connection pools of this worker process, by database alias."""
+    pid = os.getpid()
+    return {alias: pool.stats() for (pool_pid, alias), pool in list(_pools.items()) if pool_pid == pid}
+
+
+def close_pool(alias):
+    """Close the idle connections of the pool of the given database alias and forget the pool."""
+    pool = _pools.pop((os.getpid(), alias), None)
+    if pool is not None:
+        pool.close_idle()
+
+
+class HealthCheckMixin:
+    """
+    Checks a persistent connection before its first use in every request (Django 4.1's CONN_HEALTH_CHECKS), for
+    DatabaseWrapper subclasses.
+    """
+    health_check_done = False
+
+    def connect(self):
+        super().connect()
+        self.health_check_done = True
+
+    def close_if_unusable_or_obsolete(self):
+        # Django calls this at the start and end of every request.
+        super().close_if_unusable_or_obsolete()
+        self.health_check_done = False
+
+    def ensure_connection(self):
+        if (self.connection is not None and not self.health_check_done and not self.in_atomic_block and
+                self.settings_dict.get('CONN_HEALTH_CHECKS')):
+            self.health_check_done = True
+            if not self.is_usable():
+                self.close()
+        super().ensure_connection()
+
+
+class PoolMixin:
+    """
+    Takes the connections of a DatabaseWrapper subclass from a ConnectionPool of POOL_SIZE connections, if POOL_SIZE is
+    set. Subclasses implement pool_check and pool_reset.
+    """
+
+    def get_pool(self):
+        size = self.settings_dict.get('POOL_SIZE')
+        if not size:
+            return None
+        key = (os.getpid(), self.alias)
+        pool = _pools.get(key)
+        if pool is None:
+            with _pools_lock:
+                pool = _pools.get(key)
+                if pool is None:
+                    pool = _pools[key] = ConnectionPool(
+                        self.alias, size,
+                        timeout=self.settings_dict.get('POOL_TIMEOUT', 10),
+                        check_delay=self.settings_dict.get('POOL_CHECK_DELAY', 30),
+                        check=self.pool_check,
+                        reset=self.pool_reset,
+                    )
+        return pool
+
+    def get_new_connection(self, conn_params):
+        pool = self.get_pool()
+        if pool is None:
+            return super().get_new_connection(conn_params)
+
+        try:
+            connection, wait = pool.acquire(functools.partial(super().get_new_connection, conn_params))
+        except PoolTimeout as e:
+            # Raise the driver's own error, so that Django turns it into a django.db.OperationalError.
+            raise self.Database.OperationalError(str(e)) from e
+
+        timings = current_timings()
+        if timings is not None and wait:
+            timings.add_phase('db.pool_wait', wait)
+        return connection
+
+    def _close(self):
+        pool = self.get_pool()
+        if pool is None:
+            return super()._close()
+        pool.release(self.connection)
+
+    def pool_check(self, connection):
+        """Returns whether the raw connection still works."""
+        raise NotImplementedError
+
+    def pool_reset(self, connection):
+        """Prepare the raw connection for reuse. Raise an exception to close it instead."""
+        raise NotImplementedError
@@ -0,0 +1,33 @@
+"""
+django.db.backends.postgresql with health checks and an optional connection pool (see quiz/backends/pooling.py).
+
+Set ENGINE to 'quiz.backends.postgresql' (settings.py does this for postgres:// DATABASE_URLs).
+"""
+from django.db.backends.postgresql import base
+from psycopg2 import extensions
+
+from quiz.backends.pooling import HealthCheckMixin, PoolMixin
+
+
+class DatabaseWrapper(HealthCheckMixin, PoolMixin, base.DatabaseWrapper):
+
+    def get_new_connection(self, conn_params):
+        connection = super().get_new_connection(conn_params)
+        # A connection from the pool was set up by the wrapper that opened it, so take the isolation level from the
+        #  connection, as django.db.backends.postgresql does for a new one.
+        self.isolation_level = self.settings_dict['OPTIONS'].get('isolation_level', connection.isolation_level)
+        return connection
+
+    def pool_check(self, connection):
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+        except base.Database.Error:
+            return False
+        return True
+
+    def pool_reset(self, connection):
+        if connection.closed:
+            raise base.Database.InterfaceError("Connection already closed")
+        if connection.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+            connection.rollback()
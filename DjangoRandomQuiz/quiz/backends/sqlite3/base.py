@@ -0,0 +1,34 @@
+"""
+django.db.backends.sqlite3 with health checks and an optional connection pool (see quiz/backends/pooling.py).
+
+Opening an SQLite connection is cheap, so this is mostly used to develop and benchmark the pool locally (see the
+benchmark_connections command). Set ENGINE to 'quiz.backends.sqlite3' (settings.py does this for sqlite:// URLs).
+"""
+from django.db.backends.sqlite3 import base
+
+from quiz.backends.pooling import HealthCheckMixin, PoolMixin
+
+
+class DatabaseWrapper(HealthCheckMixin, PoolMixin, base.DatabaseWrapper):
+
+    def get_pool(self):
+        # Every connection to an in-memory database (e.g. the test database) is a different database, so never pool
+        #  those.
+        if self.is_in_memory_db():
+            return None
+        return super().get_pool()
+
+    def is_usable(self):
+        # Django's SQLite backend always says yes, which would make the health checks a no-op.
+        return self.pool_check(self.connection)
+
+    def pool_check(self, connection):
+        try:
+            connection.execute('SELECT 1').close()
+        except base.Database.Error:
+            return False
+        return True
+
+    def pool_reset(self, connection):
+        if connection.in_transaction:
+            connection.rollback()
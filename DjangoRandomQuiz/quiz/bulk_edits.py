@@ -0,0 +1,98 @@
+"""
+Bulk edits of the admin actions (see quiz/admin.py), as a few set-based statements whatever the number of rows, instead
+of loading and saving every object.
+"""
+from django.db import connections, router, transaction
+
+from quiz import search
+from quiz.models import Answer, Question
+
+
+def move_questions(questions, topic):
+    """
+    Move the questions (a queryset) to the topic: remove them from their other topics and add them to it. Only the
+    questions of the creator of the topic are moved. Returns the number of questions moved.
+    """
+    through = Question.topic.through
+    using = router.db_for_write(through)
+    connection = connections[using]
+    questions = questions.filter(creator_id=topic.creator_id)
+    with transaction.atomic(using=using):
+        moved = questions.count()
+        through.objects.using(using).filter(question__in=questions.values('id')).exclude(topic=topic).delete()
+
+        sql, params = questions.exclude(topic=topic).values('id').query.sql_with_params()
+        quote = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {quote(through._meta.db_table)} ({quote('question_id')}, {quote('topic_id')}) "
+                f"SELECT id, %s FROM ({sql}) moved",
+                [topic.id, *params],
+            )
+    return moved
+
+
+def merge_duplicate_answers(answers):
+    """
+    Merge the answers (a queryset) of the same creator whose texts only differ in case and surrounding whitespace into
+    the oldest one: the questions of the duplicates get the oldest answer instead (as a correct answer if any of them
+    had it as a correct answer), and the duplicates are deleted. Returns the number of answers deleted.
+    """
+    using = router.db_for_write(Answer)
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    answer_table = quote(Answer._meta.db_table)
+    correct_table = quote(Question.answers.through._meta.db_table)
+    wrong_table = quote(Question.wrong_answers.through._meta.db_table)
+    selected_sql, selected_params = answers.values('id').query.sql_with_params()
+
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        # The duplicates and the answer that each of them is merged into.
+        cursor.execute("CREATE TEMPORARY TABLE quiz_answer_merge (duplicate_id integer PRIMARY KEY, "
+                       "keeper_id integer NOT NULL)")
+        try:
+            cursor.execute(
+                f"INSERT INTO quiz_answer_merge (duplicate_id, keeper_id) "
+                f"SELECT answer.id, keeper.id FROM {answer_table} answer JOIN ("
+                f"  SELECT creator_id, LOWER(TRIM(text)) AS normalized_text, MIN(id) AS id FROM {answer_table} "
+                f"  WHERE id IN ({selected_sql}) GROUP BY creator_id, LOWER(TRIM(text)) HAVING COUNT(*) > 1"
+                f") keeper ON answer.creator_id = keeper.creator_id AND LOWER(TRIM(answer.text)) = keeper.normalized_text "
+                f"WHERE answer.id IN ({selected_sql}) AND answer.id <> keeper.id",
+                [*selected_params, *selected_params],
+            )
+            merged = cursor.rowcount
+
+            for table in (correct_table, wrong_table):
+                # Drop the links that would be duplicates once the answers are merged: the ones of a question to a
+                #  duplicate when the question is also linked to the answer it is merged into, or to an older duplicate
+                #  of it.
+                cursor.execute(
+                    f"DELETE FROM {table} WHERE id IN ("
+                    f"  SELECT link.id FROM {table} link JOIN quiz_answer_merge merge "
+                    f"  ON link.answer_id = merge.duplicate_id WHERE EXISTS ("
+                    f"    SELECT 1 FROM {table} other LEFT JOIN quiz_answer_merge other_merge "
+                    f"    ON other.answer_id = other_merge.duplicate_id "
+                    f"    WHERE other.question_id = link.question_id AND other.id <> link.id "
+                    f"    AND COALESCE(other_merge.keeper_id, other.answer_id) = merge.keeper_id "
+                    f"    AND (other_merge.duplicate_id IS NULL OR other.id < link.id)"
+                    f"  )"
+                    f")"
+                )
+                cursor.execute(
+                    f"UPDATE {table} SET answer_id = ("
+                    f"  SELECT keeper_id FROM quiz_answer_merge WHERE duplicate_id = {table}.answer_id"
+                    f") WHERE answer_id IN (SELECT duplicate_id FROM quiz_answer_merge)"
+                )
+
+            # An answer that is now both a correct and a wrong answer of a question stays a correct answer.
+            cursor.execute(
+                f"DELETE FROM {wrong_table} WHERE answer_id IN (SELECT keeper_id FROM quiz_answer_merge) AND EXISTS ("
+                f"  SELECT 1 FROM {correct_table} correct WHERE correct.question_id = {wrong_table}.question_id "
+                f"  AND correct.answer_id = {wrong_table}.answer_id"
+                f")"
+            )
+            search.unindex_subquery(search.ANSWER, "SELECT duplicate_id AS id FROM quiz_answer_merge", [])
+            cursor.execute(f"DELETE FROM {answer_table} WHERE id IN (SELECT duplicate_id FROM quiz_answer_merge)")
+        finally:
+            cursor.execute("DROP TABLE quiz_answer_merge")
+    return merged
@@ -0,0 +1,158 @@
+"""
+Grading of quiz attempts.
+
+Grading only needs the quiz, the chosen answers and the correct answers of every question, so it does not touch the
+database. Quiz.check_quiz_answers loads the correct answers, grades the attempt and saves it. Regrading an attempt after
+the answer keys changed (see quiz/regrading.py) only needs the attempt itself, which keeps the choices and whether they
+were chosen.
+"""
+
+
+def grade_quiz_answers(quiz, chosen_answers, correct_answer_texts_by_question, normalize=True):
+    """
+    Grade the chosen answers to the quiz dict (see Quiz). correct_answer_texts_by_question maps the text of every
+    question of the quiz to a set of the texts of its correct answers.
+
+    Returns the quiz attempt dict (see Quiz.check_quiz_answers), without the id of the QuizAttempt.
+    """
+    questions = quiz['questions']
+    no_of_correct_answers = 0
+    no_of_wrong_answers = 0
+
+    # The total possible score will be the total of all the number of correct answers.
+    possible_points = 0
+
+    # The total score for the quiz.
+    # Answering a radio question correctly gives 1 / 1 points. Answering wrongly gives 0 points.
+    # Choosing a wrong checkbox question answer will subtract 1 from the points that were scored for that question
+    #  with a minimum of 0 points.
+    total_points_scored = 0
+
+    # For "questions": [{...}, {...}]... (See the docstring of Quiz.check_quiz_answers)
+    attempt_dict_questions_list = []
+    for question, chosen_answer_set in zip(questions, chosen_answers):
+        question_text = question['question_text']
+        question_type = question['question_type']
+        correct_answer_texts = correct_answer_texts_by_question[question_text]
+        original_choice_list = question['choices']
+
+        # To be passed as a dict into the attempt_dict_questions_list.
+        updated_dict_question = {'question_text': question_text,
+                                 'question_type': question_type,
+                                 'choices': [],
+                                 }
+
+        # Start the score counter at 0.
+
+        # The total question points without deduction
+        question_points_before_penalty = 0
+
+        # The total penalty.
+        penalty = 0
+
+        # The score will be the question_points - penalty with a minimum of 0.
+        question_points_scored = 0
+        possible_question_points = 0
+        for choice in original_choice_list:
+            choice_text = choice
+            chosen = choice_text in chosen_answer_set
+            is_correct = choice_text in correct_answer_texts
+            updated_dict_question['choices'].append({
+                'choice_text': choice_text,
+                'chosen': chosen,
+                'correct': is_correct,
+                # We will also add the number of points scored per question and the possible number of points per
+                #  question
+            })
+            if is_correct:
+                # The possible score will increase per answer that is correct (though not necessarily chosen).
+                possible_question_points += 1
+
+            if is_correct and chosen:
+                # If the correct answer was chosen, add to the score.
+                no_of_correct_answers += 1
+                question_points_before_penalty += 1
+            elif is_correct and not chosen:
+                # Otherwise, if the correct answer was not chosen, add to the no of wrong (unchosen) answers.
+                no_of_wrong_answers += 1
+            elif not is_correct and chosen:
+                # However, if the wrong answer is chosen, penalize for choosing the wrong answer for checkbox type
+                #  questions to disincentivize clicking all the checkboxes.
+                if question_type == 'checkbox':
+                    penalty += 1
+        # Reset question score to 0 if it falls below 0.
+        question_points_scored = question_points_before_penalty - penalty \
+            if (question_points_before_penalty - penalty) >= 0 else 0
+
+        if normalize:
+            # The score to be added will be divided by the possible_question_points. E.g. if we have 2 out of 3
+            #  points, then we will divide by 3, so that the final score for this question is 0.66 out of 1 points.
+            # A question with none of its correct answers among its choices (possible after its answer key changed,
+            #  see quiz/regrading.py) scores 0 out of 1 point.
+            normalize_factor = possible_question_points or 1
+
+            # Update values with normalize_factor.
+            question_points_scored /= normalize_factor
+            possible_question_points = 1
+            question_points_before_penalty /= normalize_factor
+            penalty /= normalize_factor
+
+        # Add the possible question score to the possible quiz score.
+        possible_points += possible_question_points
+        # Add the question score to the total score
+        total_points_scored += question_points_scored
+
+        updated_dict_question.update({
+            'question_points_scored': question_points_scored,
+            'possible_question_points': possible_question_points,
+            'question_points_before_penalty': question_points_before_penalty,
+            'penalty': penalty
+        })
+        attempt_dict_questions_list.append(updated_dict_question)
+
+    # The final score (which can be multiplied by 100% for percentage) is the total score divided by the possible
+    #  quiz score.
+    score = total_points_scored / possible_points
+
+    quiz_attempt = {
+        "topic_id": quiz["topic"],
+        "topic_name": quiz["topic_name"],
+        "questions": attempt_dict_questions_list,
+        "no_of_correct_answers": no_of_correct_answers,
+        "no_of_wrong_answers": no_of_wrong_answers,
+        "score": score,
+        "total_points_scored": total_points_scored,
+        "possible_points": possible_points
+    }
+
+    return quiz_attempt
+
+
+def regrade_quiz_attempt(quiz_attempt, correct_answer_texts_by_question, normalize=True):
+    """
+    Grade the choices of a quiz attempt dict (see Quiz.check_quiz_answers) again, with the current correct answers.
+    The questions missing from correct_answer_texts_by_question (e.g. deleted since) keep the correct answers they were
+    graded with.
+
+    Returns the new quiz attempt dict, with the same uuid, id and other keys as the old one.
+    """
+    quiz = {
+        'topic': quiz_attempt['topic_id'],
+        'topic_name': quiz_attempt['topic_name'],
+        'questions': [],
+    }
+    chosen_answers = []
+    correct_answer_texts_by_question = dict(correct_answer_texts_by_question)
+    for question in quiz_attempt['questions']:
+        choices = question['choices']
+        quiz['questions'].append({
+            'question_text': question['question_text'],
+            'choices': [choice['choice_text'] for choice in choices],
+            'question_type': question['question_type'],
+        })
+        chosen_answers.append({choice['choice_text'] for choice in choices if choice['chosen']})
+        correct_answer_texts_by_question.setdefault(
+            question['question_text'], {choice['choice_text'] for choice in choices if choice['correct']})
+
+    return {**quiz_attempt, **grade_quiz_answers(quiz, chosen_answers, correct_answer_texts_by_question,
+                                                 normalize=normalize)}
@@ -0,0 +1,208 @@
+"""
+Per-request performance instrumentation.
+
+PerformanceMiddleware (see quiz/middleware.py) starts a RequestTimings for every request and keeps it in a context
+variable while the request is being handled. Anything that runs during the request can then add to it:
+
+    - Every SQL query is counted and timed by record_query, which is added to every new database connection.
+    - Code can time its phases with `with timed('serialize'):` (as the renderers do), or with a PhaseTimer for a
+      function that goes through several phases one after another (e.g. the load, sample and persist phases of
+      Topic.generate_quiz and the grade and persist phases of Quiz.check_quiz_answers).
+
+Outside of a request (e.g. in the shell or in management commands), timed() and record_query do nothing.
+
+The totals of every request are added to a rolling histogram per route, see route_histograms.
+"""
+import bisect
+import contextvars
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from django.conf import settings
+
+_current_timings = contextvars.ContextVar('request_timings', default=None)
+
+
+class RequestTimings:
+    """Timings collected while handling one request."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        # The name of the route of the request, once it is resolved (see PerformanceMiddleware.process_view).
+        self.route = None
+        self.query_count = 0
+        self.query_time = 0.0
+        # Maps the name of a phase to the total time (in seconds) spent in it, in the order the phases first ran.
+        self.phases = {}
+        # Compressed size / original size of the response, if it was compressed (see APICompressionMiddleware).
+        self.compression_ratio = None
+
+    def add_phase(self, name, duration):
+        self.phases[name] = self.phases.get(name, 0.0) + duration
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+
+def start_request_timings():
+    """Start collecting timings for the current request. Returns the timings and a token to pass to stop."""
+    timings = RequestTimings()
+    return timings, _current_timings.set(timings)
+
+
+def stop_request_timings(token):
+    _current_timings.reset(token)
+
+
+def current_timings():
+    """Returns the RequestTimings of the current request, or None outside of a request."""
+    return _current_timings.get()
+
+
+@contextmanager
+def timed(phase):
+    """Add the time spent in the block to the given phase of the current request."""
+    timings = _current_timings.get()
+    if timings is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add_phase(phase, time.perf_counter() - start)
+
+
+class PhaseTimer:
+    """
+    Times consecutive phases of a function without having to indent each phase in a `with timed(...)` block:
+
+        phases = PhaseTimer('generate_quiz')
+        ...
+        phases.lap('load')  # Time since the PhaseTimer was created is added to 'generate_quiz.load'.
+        ...
+        phases.lap('sample')  # Time since the last lap is added to 'generate_quiz.sample'.
+    """
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.timings = _current_timings.get()
+        self.last = time.perf_counter()
+
+    def lap(self, phase):
+        if self.timings is None:
+            return
+        now = time.perf_counter()
+        self.timings.add_phase(f'{self.prefix}.{phase}', now - self.last)
+        self.last = now
+
+
+def record_query(execute, sql, params, many, context):
+    """Execute wrapper (see connection.execute_wrapper) that counts and times the queries of the current request."""
+    timings = _current_timings.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.query_count += 1
+        timings.query_time += time.perf_counter() - start
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    """connection_created receiver. Record the queries made on every connection, in any thread."""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class RollingHistogram:
+    """
+    Histogram of the last `window` values (e.g. request durations in ms), with fixed bucket boundaries.
+
+    Keeps the raw values of the window as well, so that percentiles can be calculated.
+    """
+
+    def __init__(self, buckets, window):
+        self.buckets = tuple(buckets)
+        self.values = deque(maxlen=window)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.values.append(value)
+            self.count += 1
+            self.sum += value
+
+    def snapshot(self):
+        with self._lock:
+            values = sorted(self.values)
+            count, total = self.count, self.sum
+
+        bucket_counts = [0] * (len(self.buckets) + 1)
+        for value in values:
+            bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+        labels = [f'<={bucket}' for bucket in self.buckets] + [f'>{self.buckets[-1]}']
+
+        def percentile(fraction):
+            return values[min(len(values) - 1, int(fraction * len(values)))] if values else None
+
+        return {
+            'count': count,
+            'sum': total,
+            'window': len(values),
+            'p50': percentile(0.5),
+            'p95': percentile(0.95),
+            'p99': percentile(0.99),
+            'buckets': dict(zip(labels, bucket_counts)),
+        }
+
+
+class RouteHistograms:
+    """One RollingHistogram per route and metric, e.g. ('generate_quiz-detail', 'total_ms')."""
+
+    # Bucket boundaries in ms (or number of queries for query_count, compressed size / original size for
+    #  compression_ratio, bytes for peak_allocation).
+    BUCKETS = {
+        'total_ms': (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000),
+        'db_ms': (1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000),
+        'serialize_ms': (0.5, 1, 5, 10, 25, 50, 100, 500),
+        'query_count': (1, 2, 5, 10, 25, 50, 100, 250, 1000),
+        'compression_ratio': (0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1),
+        'peak_allocation': (2 ** 16, 2 ** 18, 2 ** 20, 2 ** 22, 2 ** 24, 2 ** 26),
+    }
+
+    def __init__(self, window):
+        self.window = window
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, route, metric, value):
+        key = (route, metric)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, RollingHistogram(self.BUCKETS[metric], self.window))
+        histogram.observe(value)
+
+    def snapshot(self):
+        """Returns {route: {metric: histogram snapshot}}."""
+        with self._lock:
+            items = list(self._histograms.items())
+        snapshot = {}
+        for (route, metric), histogram in sorted(items):
+            snapshot.setdefault(route, {})[metric] = histogram.snapshot()
+        return snapshot
+
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+
+
+route_histograms = RouteHistograms(window=settings.PERFORMANCE_HISTOGRAM_WINDOW)
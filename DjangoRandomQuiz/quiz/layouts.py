@@ -0,0 +1,54 @@
+"""
+Alternative layouts for the quiz and quiz attempt payloads.
+
+The default ("rows") layout is a list of dicts per question, which repeats key names like 'question_text',
+'choice_text', 'chosen' and 'correct' for every question and choice. The "columnar" layout turns every list of dicts
+into a dict of lists, so each key name is sent once per list:
+
+    {'questions': [{'question_text': 'Q1', 'question_type': 'radio', 'choices': ['A', 'B']},
+                   {'question_text': 'Q2', 'question_type': 'checkbox', 'choices': ['C', 'D']}]}
+
+becomes
+
+    {'layout': 'columnar',
+     'questions': {'question_text': ['Q1', 'Q2'], 'question_type': ['radio', 'checkbox'],
+                   'choices': [['A', 'B'], ['C', 'D']]}}
+
+Nested lists of dicts (e.g. the choices of a quiz attempt) are converted the same way, one columnar dict per question.
+"""
+
+ROWS = 'rows'
+COLUMNAR = 'columnar'
+
+LAYOUTS = (ROWS, COLUMNAR)
+
+
+def _is_list_of_dicts(value):
+    return isinstance(value, list) and bool(value) and all(isinstance(item, dict) for item in value)
+
+
+def rows_to_columns(rows):
+    """Convert a list of dicts into a dict of lists. Keys missing from a row are set to None."""
+    # Keep the order in which the keys first appear.
+    keys = dict.fromkeys(key for row in rows for key in row)
+
+    columns = {}
+    for key in keys:
+        column = [row.get(key) for row in rows]
+        if any(column) and all(value == [] or _is_list_of_dicts(value) for value in column):
+            # E.g. the list of choice dicts for every question of a quiz attempt.
+            column = [rows_to_columns(value) for value in column]
+        columns[key] = column
+
+    return columns
+
+
+def to_layout(payload, layout=ROWS):
+    """Returns the quiz or quiz attempt payload in the given layout. The stored payload is never modified."""
+    if layout != COLUMNAR:
+        return payload
+
+    columnar_payload = {'layout': COLUMNAR}
+    for key, value in payload.items():
+        columnar_payload[key] = rows_to_columns(value) if _is_list_of_dicts(value) else value
+    return columnar_payload
@@ -0,0 +1,76 @@
+"""
+Leaderboards: the best score of every user, over the attempts at one topic or over all attempts.
+
+The ranks are computed by the database with window functions (RANK and PERCENT_RANK over the best score per user),
+and the best scores with a GROUP BY that is answered from the (topic, user, score) and (user, score) indexes of
+QuizAttempt. The percentile of one attempt is a count over the (topic, score) or (score) index.
+
+Set LEADERBOARD_CACHE_TIMEOUT to cache the top of every leaderboard for that many seconds, so that it is computed at
+most once per interval (per cache, see CACHES) however often it is requested.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, F, Max, Q, Window
+from django.db.models.functions import PercentRank, Rank
+
+from quiz import metrics
+from quiz.models import QuizAttempt
+
+
+def attempts_for(topic=None):
+    """Returns the attempts ranked by a leaderboard: the attempts at the topic, or all attempts if topic is None."""
+    attempts = QuizAttempt.objects.filter(user__isnull=False)
+    if topic is not None:
+        attempts = attempts.filter(topic=topic)
+    return attempts
+
+
+def best_scores(attempts):
+    """Returns {'user': user_id, 'best_score': ..., 'attempts': ...} per user, in no particular order."""
+    return attempts.order_by().values('user').annotate(best_score=Max('score'), attempts=Count('id'))
+
+
+def compute_leaders(topic=None, limit=10):
+    """
+    Returns the users with the best scores, best first, with their rank (users with the same best score share it),
+    their percentile (the fraction of the other users with a lower best score) and their number of attempts.
+    """
+    leaders = best_scores(attempts_for(topic)).annotate(
+        username=F('user__username'),
+        rank=Window(Rank(), order_by=F('best_score').desc()),
+        percentile=Window(PercentRank(), order_by=F('best_score').asc()),
+    ).order_by('rank', 'user')[:limit]
+    return list(leaders)
+
+
+def leaders(topic=None, limit=10):
+    """compute_leaders, from the cache if LEADERBOARD_CACHE_TIMEOUT is set."""
+    timeout = settings.LEADERBOARD_CACHE_TIMEOUT
+    if not timeout:
+        return compute_leaders(topic, limit)
+    key = f"leaderboard:{'global' if topic is None else topic.id}:{limit}"
+    result = cache.get(key)
+    metrics.observe_cache_lookup('leaderboard', result is not None)
+    if result is None:
+        result = compute_leaders(topic, limit)
+        cache.set(key, result, timeout)
+    return result
+
+
+def user_standing(user, topic=None):
+    """Returns the rank and best score of the user, or None if the user has no attempts on this leaderboard."""
+    attempts = attempts_for(topic)
+    # Not .first(), which would order by (and so group by) the id of the attempts.
+    standing = next(iter(best_scores(attempts.filter(user=user))), None)
+    if standing is None:
+        return None
+    users_ahead = best_scores(attempts).filter(best_score__gt=standing['best_score']).count()
+    return {'rank': users_ahead + 1, 'best_score': standing['best_score'], 'attempts': standing['attempts']}
+
+
+def attempt_percentile(quiz_attempt, topic=None):
+    """Returns the fraction of the other attempts on this leaderboard that scored lower than the quiz attempt."""
+    counts = attempts_for(topic).aggregate(total=Count('id'), lower=Count('id', filter=Q(score__lt=quiz_attempt.score)))
+    if counts['total'] <= 1:
+        return 1.0
+    return counts['lower'] / (counts['total'] - 1)
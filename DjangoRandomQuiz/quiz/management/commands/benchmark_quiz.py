@@ -0,0 +1,186 @@
+import itertools
+import json
+import os
+import random
+import statistics
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from quiz.generate_quiz import generate_list_of_wrong_choices
+from quiz.synthetic import build_topic
+
+# How many correct answers the questions of a topic get, i.e. the mix of radio and checkbox questions.
+MIXES = {
+    'radio': (1, 1),
+    'checkbox': (2, 3),
+    'mixed': (1, 3),
+}
+
+FLAGS = {
+    'default': {},
+    'show_all_alternative_answers': {'show_all_alternative_answers': True},
+    'fixed_choices_only': {'fixed_choices_only': True},
+    'adaptive': {'adaptive': True},
+    'rotation': {'rotation': True},
+}
+
+
+def int_list(value):
+    return [int(item) for item in value.split(',')]
+
+
+def str_list(value):
+    return value.split(',')
+
+
+class Command(BaseCommand):
+    help = """
+    Micro-benchmarks for Topic.generate_quiz, generate_list_of_wrong_choices and Quiz.check_quiz_answers over a grid
+    of topic sizes, numbers of questions and choices, radio/checkbox mixes and generation flags.
+
+    The benchmarks run against a fresh test database (in memory with SQLite), so they do not touch your data. Every
+    case reports the median and minimum time over --repeat runs, the peak allocation (traced in a separate run) and
+    the number of queries.
+
+    Compare against a baseline to judge an optimisation on numbers: a case is a regression if its median time or peak
+    allocation grew by more than --threshold, or if it runs more queries.
+
+    python3 manage.py benchmark_quiz --save-baseline
+    python3 manage.py benchmark_quiz --fail-on-regression
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--topic-sizes', type=int_list, default=[10, 100, 1000])
+        parser.add_argument('--no-of-questions', type=int_list, default=[10, 50])
+        parser.add_argument('--no-of-choices', type=int_list, default=[4, 8])
+        parser.add_argument('--mixes', type=str_list, default=list(MIXES), help=f"Any of {', '.join(MIXES)}.")
+        parser.add_argument('--flags', type=str_list, default=list(FLAGS), help=f"Any of {', '.join(FLAGS)}.")
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--baseline', default=os.path.join(settings.BASE_DIR, 'benchmarks', 'quiz_baseline.json'))
+        parser.add_argument('--save-baseline', action='store_true', help="Save the results as the new baseline.")
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help="Relative growth in time or allocations that counts as a regression.")
+        parser.add_argument('--min-difference-ms', type=float, default=0.5,
+                            help="Ignore time differences below this, which are noise.")
+        parser.add_argument('--fail-on-regression', action='store_true', help="Exit with an error on regressions.")
+        parser.add_argument('--output', help="Also write the results as JSON to this file.")
+
+    def handle(self, *args, **options):
+        unknown = set(options['mixes']) - set(MIXES) | set(options['flags']) - set(FLAGS)
+        if unknown:
+            raise CommandError(f"Unknown mixes or flags: {', '.join(sorted(unknown))}")
+
+        self.repeat = options['repeat']
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            results = self.run_benchmarks(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        for name, result in results.items():
+            self.stdout.write(f"{name:<100} {result['median_ms']:>9.3f} ms {result['min_ms']:>9.3f} ms "
+                              f"{result['peak_allocation']:>10} B {result['queries']:>5} queries")
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2)
+
+        if options['save_baseline']:
+            os.makedirs(os.path.dirname(options['baseline']), exist_ok=True)
+            with open(options['baseline'], 'w') as baseline:
+                json.dump(results, baseline, indent=2, sort_keys=True)
+            self.stdout.write(f"Saved the baseline to {options['baseline']}")
+        elif os.path.exists(options['baseline']):
+            with open(options['baseline']) as baseline:
+                regressions = self.compare(results, json.load(baseline), options['threshold'],
+                                           options['min_difference_ms'])
+            for regression in regressions:
+                self.stderr.write(f"REGRESSION {regression}")
+            self.stdout.write(f"{len(regressions)} regressions against {options['baseline']}")
+            if regressions and options['fail_on_regression']:
+                raise CommandError(f"{len(regressions)} regressions")
+
+    def run_benchmarks(self, options):
+        random.seed(options['seed'])
+        user = User.objects.create_user(username='benchmark')
+        results = {}
+
+        for size, mix in itertools.product(options['topic_sizes'], options['mixes']):
+            topic = build_topic(user, f'topic {size} {mix}', size, answers_per_question=MIXES[mix],
+                                seed=options['seed'])
+            pool_of_choices = list(topic.pool_of_choices())
+
+            for no_of_questions, no_of_choices in itertools.product(options['no_of_questions'],
+                                                                     options['no_of_choices']):
+                if no_of_questions > size:
+                    continue
+                params = f'size={size},mix={mix},questions={no_of_questions},choices={no_of_choices}'
+
+                for flag in options['flags']:
+                    results[f'generate_quiz[{params},flag={flag}]'] = self.measure(
+                        topic.generate_quiz, no_of_questions=no_of_questions, no_of_choices=no_of_choices,
+                        **FLAGS[flag])
+
+                quiz = topic.generate_quiz(no_of_questions=no_of_questions, no_of_choices=no_of_choices)
+                chosen_answers = [question['choices'][:1] for question in quiz.quiz['questions']]
+                results[f'check_quiz_answers[{params}]'] = self.measure(quiz.check_quiz_answers, chosen_answers)
+
+            for no_of_choices in options['no_of_choices']:
+                results[f'generate_list_of_wrong_choices[pool={len(pool_of_choices)},mix={mix},'
+                        f'wrong_choices={no_of_choices - 1}]'] = self.measure(
+                    generate_list_of_wrong_choices, pool_of_choices, no_of_choices - 1)
+
+        return results
+
+    def measure(self, func, *args, **kwargs):
+        """Returns the median and minimum time, the peak allocation and the number of queries of func."""
+        # Warm up (e.g. the query compilation caches), and count the queries.
+        with CaptureQueriesContext(connection) as context:
+            func(*args, **kwargs)
+
+        times = []
+        for _ in range(self.repeat):
+            start = time.perf_counter()
+            func(*args, **kwargs)
+            times.append(time.perf_counter() - start)
+
+        # Trace the allocations in a separate run, as tracing slows everything down.
+        tracemalloc.start()
+        try:
+            func(*args, **kwargs)
+            _, peak_allocation = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        return {
+            'median_ms': statistics.median(times) * 1000,
+            'min_ms': min(times) * 1000,
+            'peak_allocation': peak_allocation,
+            'queries': len(context.captured_queries),
+        }
+
+    @staticmethod
+    def compare(results, baseline, threshold, min_difference_ms):
+        """Returns a description of every case that regressed against the baseline."""
+        regressions = []
+        for name, result in results.items():
+            if name not in baseline:
+                continue
+            base = baseline[name]
+            if result['queries'] > base['queries']:
+                regressions.append(f"{name}: {base['queries']} -> {result['queries']} queries")
+            for metric in ('median_ms', 'peak_allocation'):
+                if metric == 'median_ms' and result[metric] - base[metric] < min_difference_ms:
+                    continue
+                if base[metric] and result[metric] > base[metric] * (1 + threshold):
+                    regressions.append(f"{name}: {metric} {base[metric]:.3f} -> {result[metric]:.3f} "
+                                       f"(+{(result[metric] / base[metric] - 1) * 100:.0f}%)")
+        return regressions
@@ -0,0 +1,86 @@
+import random
+import string
+import time
+
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from quiz.layouts import ROWS, COLUMNAR, to_layout
+from quiz.renderers import ORJSONRenderer, MessagePackRenderer
+
+
+def random_text(length):
+    return ''.join(random.choice(string.ascii_lowercase + ' ') for _ in range(length))
+
+
+def build_quiz(no_of_questions, no_of_choices):
+    """Builds a quiz dict in the same format as Topic.generate_quiz."""
+    return {
+        'topic': 1,
+        'topic_name': 'Benchmark Topic',
+        'questions': [{
+            'question_text': random_text(80),
+            'choices': [random_text(30) for _ in range(no_of_choices)],
+            'question_type': random.choice(['radio', 'checkbox']),
+        } for _ in range(no_of_questions)],
+        'id': 1,
+    }
+
+
+def build_quiz_attempt(quiz):
+    """Builds a quiz attempt dict in the same format as Quiz.check_quiz_answers."""
+    return {
+        'topic_id': quiz['topic'],
+        'topic_name': quiz['topic_name'],
+        'questions': [{
+            'question_text': question['question_text'],
+            'question_type': question['question_type'],
+            'choices': [{'choice_text': choice, 'chosen': random.random() < 0.5, 'correct': random.random() < 0.3}
+                        for choice in question['choices']],
+            'question_points_scored': 0.5,
+            'possible_question_points': 1,
+            'question_points_before_penalty': 1.0,
+            'penalty': 0.5,
+        } for question in quiz['questions']],
+        'no_of_correct_answers': 3,
+        'no_of_wrong_answers': 2,
+        'score': 0.6,
+        'total_points_scored': 3.0,
+        'possible_points': 5,
+        'id': 1,
+    }
+
+
+class Command(BaseCommand):
+    help = "Compare the size and render time of the quiz and quiz attempt payloads for each renderer and layout."
+
+    renderers = {
+        'drf-json': JSONRenderer(),
+        'orjson': ORJSONRenderer(),
+        'msgpack': MessagePackRenderer(),
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument('--questions', type=int, default=100, help="Number of questions per quiz.")
+        parser.add_argument('--choices', type=int, default=4, help="Number of choices per question.")
+        parser.add_argument('--repeat', type=int, default=200, help="Number of renders to time per combination.")
+
+    def handle(self, *args, **options):
+        random.seed(0)
+        quiz = build_quiz(options['questions'], options['choices'])
+        payloads = {'quiz': quiz, 'attempt': build_quiz_attempt(quiz)}
+
+        self.stdout.write(f"{'payload':<10}{'layout':<10}{'renderer':<10}{'bytes':>10}{'median ms':>12}")
+        for payload_name, payload in payloads.items():
+            for layout in (ROWS, COLUMNAR):
+                for renderer_name, renderer in self.renderers.items():
+                    timings = []
+                    for _ in range(options['repeat']):
+                        start = time.perf_counter()
+                        # The layout is converted per request in the views, so it counts towards the render time.
+                        content = renderer.render(to_layout(payload, layout))
+                        timings.append(time.perf_counter() - start)
+                    timings.sort()
+                    median_ms = timings[len(timings) // 2] * 1000
+                    self.stdout.write(f"{payload_name:<10}{layout:<10}{renderer_name:<10}{len(content):>10}"
+                                      f"{median_ms:>12.3f}")
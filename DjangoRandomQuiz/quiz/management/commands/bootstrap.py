@@ -0,0 +1,110 @@
+import hashlib
+import os
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.staticfiles.finders import get_finders
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from oauth2_provider.models import get_application_model
+
+# Written to STATIC_ROOT after collectstatic, with the fingerprint of the static files that were collected.
+STATIC_FINGERPRINT_FILE = '.collectstatic-fingerprint'
+
+
+def static_files_fingerprint():
+    """Returns a hash of the path, size and modification time of every static file, and of the storage settings."""
+    digest = hashlib.sha256(f'{settings.STATICFILES_STORAGE}\n{settings.STATIC_URL}\n'.encode())
+    entries = []
+    for finder in get_finders():
+        for path, storage in finder.list(['CVS', '.*', '*~']):
+            stat = os.stat(storage.path(path))
+            entries.append(f'{path}\t{stat.st_size}\t{stat.st_mtime_ns}\n')
+    for entry in sorted(entries):
+        digest.update(entry.encode())
+    return digest.hexdigest()
+
+
+class Command(BaseCommand):
+    help = """
+    Prepare the database and the static files before the server starts, in one process (see run_django.sh):
+
+        1. Apply the migrations, if there are any unapplied ones.
+        2. Collect the static files, unless they have not changed since the last collectstatic.
+        3. Create the admin user, if it does not exist.
+        4. Create the OAuth application used by the frontend to log in, if it does not exist.
+
+    Every step is skipped if there is nothing to do, so running this on every container start is cheap. Prints how long
+    every step took.
+
+    The admin user is taken from the DJANGO_SUPERUSER_USERNAME, DJANGO_SUPERUSER_EMAIL and DJANGO_SUPERUSER_PASSWORD
+    environment variables (as with createsuperuser --noinput), if set.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--admin-username', default=os.environ.get('DJANGO_SUPERUSER_USERNAME', 'admin'))
+        parser.add_argument('--admin-email', default=os.environ.get('DJANGO_SUPERUSER_EMAIL', 'admin@avodaq.com'))
+        parser.add_argument('--admin-password', default=os.environ.get('DJANGO_SUPERUSER_PASSWORD', 'Cisco1234*'))
+        parser.add_argument('--client-id', default='QuizAppClientID',
+                            help="Client ID of the OAuth application used by the frontend to log in.")
+        parser.add_argument('--skip-static', action='store_true', help="Do not collect the static files.")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        self.step('migrate', self.migrate)
+        if not options['skip_static']:
+            self.step('collectstatic', self.collectstatic)
+        admin = self.step('admin user', self.create_admin, options['admin_username'], options['admin_email'],
+                          options['admin_password'])
+        self.step('oauth application', self.create_application, options['client_id'], admin)
+        self.stdout.write(f"{'total':<20} {time.perf_counter() - start:>8.3f}s")
+
+    def step(self, name, func, *args):
+        """Run func, which returns (outcome, result), and print how long it took and the outcome. Returns the result."""
+        start = time.perf_counter()
+        outcome, result = func(*args)
+        self.stdout.write(f"{name:<20} {time.perf_counter() - start:>8.3f}s  {outcome}")
+        return result
+
+    def migrate(self):
+        executor = MigrationExecutor(connection)
+        plan = executor.migration_plan(executor.loader.graph.leaf_nodes())
+        if not plan:
+            return 'up to date', None
+        call_command('migrate', interactive=False, verbosity=0)
+        return f'applied {len(plan)} migrations', None
+
+    def collectstatic(self):
+        fingerprint_path = os.path.join(settings.STATIC_ROOT, STATIC_FINGERPRINT_FILE)
+        fingerprint = static_files_fingerprint()
+        try:
+            with open(fingerprint_path) as fingerprint_file:
+                if fingerprint_file.read() == fingerprint:
+                    return 'up to date', None
+        except FileNotFoundError:
+            pass
+
+        call_command('collectstatic', interactive=False, verbosity=0)
+        with open(fingerprint_path, 'w') as fingerprint_file:
+            fingerprint_file.write(fingerprint)
+        return 'collected', None
+
+    def create_admin(self, username, email, password):
+        User = get_user_model()
+        admin = User.objects.filter(username=username).first()
+        if admin is not None:
+            return 'exists', admin
+        return 'created', User.objects.create_superuser(username, email, password)
+
+    def create_application(self, client_id, admin):
+        Application = get_application_model()
+        _, created = Application.objects.get_or_create(client_id=client_id, defaults={
+            'user': admin,
+            'name': 'QuizApp',
+            'client_type': Application.CLIENT_PUBLIC,
+            'authorization_grant_type': Application.GRANT_PASSWORD,
+        })
+        return 'created' if created else 'exists', None
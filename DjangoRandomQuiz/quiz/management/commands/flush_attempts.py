@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from quiz import attempt_buffer
+
+
+class Command(BaseCommand):
+    help = """
+    Insert the quiz attempts left in the spool files (see quiz/attempt_buffer.py) by the processes that are not running
+    anymore, e.g. after a crash. The attempts that were inserted already are skipped. The buffers of the running
+    processes do this as well when they are created.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--spool-dir', default=None,
+                            help="The directory of the spool files (ATTEMPT_SPOOL_DIR by default).")
+
+    def handle(self, *args, **options):
+        spool_dir = options['spool_dir'] or settings.ATTEMPT_SPOOL_DIR
+        recovered = attempt_buffer.recover(spool_dir)
+        self.stdout.write(f"Inserted {recovered} quiz attempts from the spool files in {spool_dir}")
@@ -0,0 +1,92 @@
+import json
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from oauth2_provider.models import get_application_model
+
+from quiz.models import Quiz, QuizAttempt
+from quiz.synthetic import build_users, build_topic, build_quizzes, IdAllocator
+
+
+class Command(BaseCommand):
+    help = """
+    Generate synthetic users, topics, questions, answers (shared between the questions of a topic), wrong answers,
+    quizzes and quiz attempts with bulk inserts, e.g. to reproduce production scale locally or to load test (see the
+    loadtest command).
+
+    The users are called <prefix>user0, <prefix>user1, ... and all have the same --password. The OAuth application
+    with the --client-id is created if it does not exist yet, so that the users can log in with the password grant.
+
+    Do not run this while the server is creating quizzes, as the ids of the quizzes and quiz attempts are allocated
+    up front.
+
+    python3 manage.py generate_synthetic_data --users 100 --topics-per-user 10 --questions-per-topic 1000
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prefix', default='synthetic_', help="Prefix of the usernames.")
+        parser.add_argument('--password', default='synthetic-password')
+        parser.add_argument('--client-id', default=settings.CLIENT_ID,
+                            help="Client ID of the OAuth application used to log in.")
+        parser.add_argument('--users', type=int, default=10)
+        parser.add_argument('--topics-per-user', type=int, default=5)
+        parser.add_argument('--questions-per-topic', type=int, default=100)
+        parser.add_argument('--answers-per-topic', type=int, default=None,
+                            help="Size of the pool of answers shared by the questions of a topic. Defaults to half "
+                                 "the number of questions.")
+        parser.add_argument('--quizzes-per-topic', type=int, default=10)
+        parser.add_argument('--questions-per-quiz', type=int, default=10)
+        parser.add_argument('--choices-per-question', type=int, default=4)
+        parser.add_argument('--attempts-per-quiz', type=int, default=2)
+        parser.add_argument('--batch-size', type=int, default=1000, help="Number of rows per INSERT.")
+        parser.add_argument('--seed', type=int, default=None, help="Seed, to generate the same data every time.")
+
+    def handle(self, *args, **options):
+        prefix = options['prefix']
+        if User.objects.filter(username__startswith=prefix).exists():
+            raise CommandError(f"There are already users starting with '{prefix}'. Pass in another --prefix.")
+
+        start = time.perf_counter()
+        batch_size = options['batch_size']
+        seed = options['seed']
+
+        users = build_users(prefix, options['users'], options['password'], batch_size=batch_size)
+        self.ensure_application(options['client_id'])
+
+        allocate_id = IdAllocator(Quiz, QuizAttempt)
+        counts = {'users': len(users), 'topics': 0, 'quizzes': 0, 'quiz_attempts': 0}
+        for user_index, user in enumerate(users):
+            # One transaction per user, so that SQLite does not sync to disk after every INSERT.
+            with transaction.atomic():
+                for topic_index in range(options['topics_per_user']):
+                    topic_seed = None if seed is None else hash((seed, user_index, topic_index))
+                    topic = build_topic(user, f'{prefix}topic {topic_index}', options['questions_per_topic'],
+                                        no_of_answers=options['answers_per_topic'], seed=topic_seed,
+                                        batch_size=batch_size)
+                    no_of_quizzes, no_of_quiz_attempts = build_quizzes(
+                        topic, options['quizzes_per_topic'], options['questions_per_quiz'],
+                        options['choices_per_question'], options['attempts_per_quiz'], allocate_id, seed=topic_seed,
+                        batch_size=batch_size,
+                    )
+                    counts['topics'] += 1
+                    counts['quizzes'] += no_of_quizzes
+                    counts['quiz_attempts'] += no_of_quiz_attempts
+            self.stderr.write(f"{user_index + 1}/{len(users)} users done "
+                              f"({time.perf_counter() - start:.1f}s)")
+        allocate_id.reset_sequences()
+
+        counts['questions'] = counts['topics'] * options['questions_per_topic']
+        counts['elapsed'] = time.perf_counter() - start
+        self.stdout.write(json.dumps(counts, indent=2))
+
+    def ensure_application(self, client_id):
+        """Create a public OAuth application for the password grant (as used by the frontend) if there is none."""
+        Application = get_application_model()
+        Application.objects.get_or_create(client_id=client_id, defaults={
+            'name': 'QuizAppClientID',
+            'client_type': Application.CLIENT_PUBLIC,
+            'authorization_grant_type': Application.GRANT_PASSWORD,
+        })
@@ -0,0 +1,199 @@
+import json
+import random
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+ENDPOINTS = ('login', 'list_topics', 'generate_quiz', 'retrieve_quiz', 'attempt_quiz')
+
+
+def percentile(sorted_values, fraction):
+    """Returns the value at the given fraction (0 to 1) of a sorted list, or None if the list is empty."""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class Command(BaseCommand):
+    help = """
+    Generate and attempt quizzes against a running server with many concurrent clients, then report the throughput
+    and p50/p95/p99 latencies per endpoint as JSON. Use --prefix api/async to test the async endpoints (when running
+    under ASGI) and --prefix api for the sync endpoints.
+
+    Either pass in an access token and a topic, or log in with the OAuth password grant as the frontend does. With
+    --users, the username is formatted with the number of the user, so that the flows are spread over many users (e.g.
+    the users from generate_synthetic_data). Without --topic, every flow lists the topics of its user and picks one.
+
+    python3 manage.py loadtest --token <access_token> --topic <topic_id> --concurrency 32 --requests 500
+    python3 manage.py loadtest --username 'synthetic_user{}' --users 10 --password synthetic-password --output run.json
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+        parser.add_argument('--prefix', default='api', help="'api' for the sync views or 'api/async' for the async "
+                                                            "views.")
+        parser.add_argument('--token', help="OAuth access token with the read and write scopes. If not given, every "
+                                            "flow logs in with --username and --password.")
+        parser.add_argument('--username', help="Username to log in with, e.g. 'synthetic_user{}' with --users.")
+        parser.add_argument('--password')
+        parser.add_argument('--users', type=int, default=None,
+                            help="Spread the flows over this many users by formatting --username with 0 to users - 1.")
+        parser.add_argument('--client-id', default=settings.CLIENT_ID,
+                            help="Client ID of the OAuth application to log in with.")
+        parser.add_argument('--topic', type=int, help="ID of the topic to generate quizzes for. If not given, every "
+                                                      "flow picks one of the topics of its user.")
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--requests', type=int, default=200, help="Number of quizzes to generate and attempt.")
+        parser.add_argument('--no-of-questions', type=int, default=10)
+        parser.add_argument('--no-of-choices', type=int, default=4)
+        parser.add_argument('--timeout', type=float, default=30.0, help="Seconds to wait for a response.")
+        parser.add_argument('--output', help="Also write the JSON report to this file, to compare runs over time.")
+
+    def request(self, method, path, payload=None, token=None, prefix=None):
+        """Send a JSON request and return the (status code, decoded response body, latency in seconds)."""
+        request = urllib.request.Request(
+            f"{self.base_url}/{prefix or self.prefix}/{path}",
+            data=json.dumps(payload).encode() if payload is not None else None,
+            method=method,
+            headers={'Content-Type': 'application/json', 'Authorization': f'Bearer {token}'},
+        )
+        return self.send(request)
+
+    def login(self, username):
+        """Log in with the OAuth password grant, as the frontend does. Returns the (status code, body, latency)."""
+        request = urllib.request.Request(
+            f"{self.base_url}/oauth/token/",
+            data=urllib.parse.urlencode({
+                'grant_type': 'password',
+                'username': username,
+                'password': self.password,
+                'client_id': self.client_id,
+            }).encode(),
+            method='POST',
+            headers={'Content-Type': 'application/x-www-form-urlencoded'},
+        )
+        return self.send(request)
+
+    def send(self, request):
+        """
+        Send the request and return the (status code, decoded response body, latency in seconds). The status code is 0
+        if there was no response (e.g. the connection was refused or reset, or timed out), which counts as an error.
+        """
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                body = response.read()
+                status_code = response.status
+        except urllib.error.HTTPError as e:
+            body = e.read()
+            status_code = e.code
+        except OSError:
+            # Including URLError and TimeoutError.
+            body = b''
+            status_code = 0
+        latency = time.perf_counter() - start
+        try:
+            body = json.loads(body)
+        except ValueError:
+            body = None
+        return status_code, body, latency
+
+    def generate_and_attempt(self, flow):
+        """
+        Log in (unless a token was given), pick a topic (unless one was given), generate a quiz, retrieve it again (as
+        when retrying a quiz) and attempt it by choosing the first choice of every question.
+
+        Retrieving a quiz is cheap, so its latency shows how long requests wait behind slow ones.
+        """
+        results = []
+        token = self.token
+        if token is None:
+            username = self.username.format(flow % self.users) if self.users else self.username
+            status_code, body, latency = self.login(username)
+            results.append(('login', status_code, latency))
+            if status_code != 200:
+                return results
+            token = body['access_token']
+
+        topic = self.topic
+        if topic is None:
+            # There is no async version of the topics endpoint.
+            status_code, topics, latency = self.request('GET', 'topics/', token=token, prefix='api')
+            results.append(('list_topics', status_code, latency))
+            if status_code != 200 or not topics:
+                return results
+            topic = random.choice(topics)['id']
+
+        status_code, quiz, latency = self.request('PUT', f'generate_quiz/{topic}/', {
+            'no_of_questions': self.no_of_questions,
+            'no_of_choices': self.no_of_choices,
+        }, token=token)
+        results.append(('generate_quiz', status_code, latency))
+        if status_code == 201:
+            status_code, _, latency = self.request('GET', f"generate_quiz/{quiz['id']}/", token=token)
+            results.append(('retrieve_quiz', status_code, latency))
+            answers = [question['choices'][:1] for question in quiz['questions']]
+            status_code, _, latency = self.request('PUT', f"attempt_quiz/{quiz['id']}/", {'answers': answers},
+                                                   token=token)
+            results.append(('attempt_quiz', status_code, latency))
+        return results
+
+    def handle(self, *args, **options):
+        self.base_url = options['base_url'].rstrip('/')
+        self.prefix = options['prefix'].strip('/')
+        self.token = options['token']
+        self.username = options['username']
+        self.password = options['password']
+        self.users = options['users']
+        self.client_id = options['client_id']
+        if self.token is None and (self.username is None or self.password is None):
+            raise CommandError("Pass in either --token or --username and --password.")
+        self.topic = options['topic']
+        self.no_of_questions = options['no_of_questions']
+        self.no_of_choices = options['no_of_choices']
+        self.timeout = options['timeout']
+
+        started_at = timezone.now()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            all_results = [result for results in executor.map(self.generate_and_attempt, range(options['requests']))
+                           for result in results]
+        elapsed = time.perf_counter() - start
+
+        report = {
+            'started_at': started_at.isoformat(),
+            'base_url': self.base_url,
+            'prefix': self.prefix,
+            'concurrency': options['concurrency'],
+            'requests': options['requests'],
+            'no_of_questions': self.no_of_questions,
+            'no_of_choices': self.no_of_choices,
+            'elapsed': elapsed,
+            'endpoints': {},
+        }
+        for endpoint in ENDPOINTS:
+            latencies = sorted(latency for name, _, latency in all_results if name == endpoint)
+            if not latencies:
+                continue
+            errors = sum(1 for name, status_code, _ in all_results
+                         if name == endpoint and (status_code == 0 or status_code >= 400))
+            report['endpoints'][endpoint] = {
+                'requests': len(latencies),
+                'errors': errors,
+                'throughput': len(latencies) / elapsed,
+                'p50': percentile(latencies, 0.5),
+                'p95': percentile(latencies, 0.95),
+                'p99': percentile(latencies, 0.99),
+                'max': percentile(latencies, 1),
+            }
+        self.stdout.write(json.dumps(report, indent=2))
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2)
@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from quiz import search
+
+
+class Command(BaseCommand):
+    help = """
+    Empty the search index (see quiz/search.py) and index every question and answer again.
+
+    The write paths of the API and of the admin keep the index up to date, so this is only needed after questions or
+    answers were written in another way, e.g. with bulk_create.
+    """
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        entries = search.rebuild()
+        self.stdout.write(f"Indexed {entries} questions and answers in {time.perf_counter() - start:.3f}s")
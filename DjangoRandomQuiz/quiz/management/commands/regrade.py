@@ -0,0 +1,49 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from quiz import regrading
+from quiz.models import Question, RegradeJob
+
+
+class Command(BaseCommand):
+    help = """
+    Run the regrade jobs (see quiz/regrading.py) that are not done, e.g. because the process running them in the
+    background was restarted. Every job resumes after the last batch of attempts it finished. Prints the progress of
+    every job after every batch.
+
+    With --question, first create a job to regrade the attempts with these questions, e.g. after their answers were
+    changed without going through the API.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--job', type=int, action='append', default=[], help="Only run the job with this id.")
+        parser.add_argument('--question', type=int, action='append', default=[],
+                            help="Create a job for the attempts with the question of this id, and run it.")
+        parser.add_argument('--workers', type=int, help="Threads per job (REGRADE_WORKERS by default).")
+        parser.add_argument('--batch-size', type=int, help="Attempts per batch (REGRADE_BATCH_SIZE by default).")
+
+    def handle(self, *args, **options):
+        job_ids = options['job']
+        if options['question']:
+            questions = list(Question.objects.filter(id__in=options['question']).select_related('creator'))
+            if len(questions) < len(set(options['question'])):
+                raise CommandError("Some of the questions do not exist.")
+            for creator in {question.creator for question in questions}:
+                job = regrading.schedule(creator, [question.id for question in questions
+                                                   if question.creator_id == creator.id], run=False)
+                if job is not None:
+                    job_ids.append(job.id)
+        elif not job_ids:
+            job_ids = list(RegradeJob.objects.exclude(status=RegradeJob.DONE).order_by('id')
+                           .values_list('id', flat=True))
+
+        for job_id in job_ids:
+            start = time.perf_counter()
+            job = regrading.run_job(job_id, workers=options['workers'], batch_size=options['batch_size'],
+                                    progress=self.print_progress)
+            self.stdout.write(f"Job {job.id}: {job.status}, regraded {job.regraded} of {job.processed} attempts in "
+                              f"{time.perf_counter() - start:.3f}s")
+
+    def print_progress(self, job):
+        self.stdout.write(f"Job {job.id}: {job.processed}/{job.total} attempts checked, {job.regraded} regraded")
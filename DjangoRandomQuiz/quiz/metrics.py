@@ -0,0 +1,76 @@
+"""
+Prometheus metrics of the API and of its hot paths, served in the Prometheus text format at /metrics (see
+metrics_view in quiz/views.py):
+
+    - quiz_requests_total and quiz_request_errors_total: the requests, and the ones that failed with a server error
+      (5xx), per route, method and status.
+    - quiz_request_duration_seconds, quiz_request_db_seconds and quiz_request_queries: the latency, SQL time and number
+      of SQL queries of the requests, per route (recorded by PerformanceMiddleware).
+    - quiz_generate_quiz_duration_seconds and quiz_check_quiz_answers_duration_seconds: the time spent generating
+      quizzes and grading attempts (saved or stateless), however they are requested.
+    - quiz_topic_questions: the number of questions of the topics that quizzes are generated from.
+    - quiz_cache_requests_total: the lookups in the leaderboard and access token caches, by result (hit or miss). The
+      hit ratio is rate(quiz_cache_requests_total{result="hit"}) / rate(quiz_cache_requests_total).
+
+Every gunicorn worker process records its own values. With PROMETHEUS_MULTIPROC_DIR set (as gunicorn.conf.py does),
+prometheus_client keeps them in memory-mapped files in that directory, one per process, and /metrics adds up the files
+of all the workers, whichever worker serves it. Without it (e.g. with runserver), /metrics serves the values of the
+process.
+"""
+import os
+
+from prometheus_client import CollectorRegistry, Counter, Histogram, REGISTRY, generate_latest, multiprocess
+
+from quiz.instrumentation import RouteHistograms
+
+REQUESTS = Counter('quiz_requests', "Requests, by route, method and status.", ['route', 'method', 'status'])
+REQUEST_ERRORS = Counter('quiz_request_errors', "Requests that failed with a server error (5xx), by route.",
+                         ['route', 'method', 'status'])
+REQUEST_DURATION = Histogram('quiz_request_duration_seconds', "Time spent handling the requests, by route.", ['route'])
+REQUEST_DB_DURATION = Histogram('quiz_request_db_seconds', "Time spent in SQL queries per request, by route.",
+                                ['route'], buckets=(.001, .005, .01, .025, .05, .1, .25, .5, 1, 5))
+REQUEST_QUERIES = Histogram('quiz_request_queries', "SQL queries per request, by route.", ['route'],
+                            buckets=RouteHistograms.BUCKETS['query_count'])
+
+GENERATE_QUIZ_DURATION = Histogram('quiz_generate_quiz_duration_seconds', "Time spent generating a quiz.")
+CHECK_QUIZ_ANSWERS_DURATION = Histogram('quiz_check_quiz_answers_duration_seconds',
+                                        "Time spent grading (and saving) a quiz attempt.")
+TOPIC_QUESTIONS = Histogram('quiz_topic_questions', "Questions of the topics that quizzes are generated from.",
+                            buckets=(5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 50000))
+
+CACHE_REQUESTS = Counter('quiz_cache_requests', "Lookups in the caches, by cache and result (hit or miss).",
+                         ['cache', 'result'])
+
+
+def observe_request(route, method, status, duration, db_duration, query_count):
+    """Record a request to one of the routes of urls.py (durations in seconds)."""
+    labels = (route, method, str(status))
+    REQUESTS.labels(*labels).inc()
+    if status >= 500:
+        REQUEST_ERRORS.labels(*labels).inc()
+    REQUEST_DURATION.labels(route).observe(duration)
+    REQUEST_DB_DURATION.labels(route).observe(db_duration)
+    REQUEST_QUERIES.labels(route).observe(query_count)
+
+
+def observe_cache_lookup(cache, hit):
+    CACHE_REQUESTS.labels(cache, 'hit' if hit else 'miss').inc()
+
+
+def multiprocess_dir():
+    """The directory of the metrics of all the processes, or None if they are kept in this process only."""
+    # The lowercase name is the one of older versions of prometheus_client.
+    return os.environ.get('PROMETHEUS_MULTIPROC_DIR') or os.environ.get('prometheus_multiproc_dir')
+
+
+def render(path=None):
+    """
+    Returns the metrics in the Prometheus text format: the ones of all the processes that write to path (by default
+    PROMETHEUS_MULTIPROC_DIR), or the ones of this process if there is no such directory.
+    """
+    path = path or multiprocess_dir()
+    if path is None:
+        return generate_latest(REGISTRY)
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry, path=path)
+    return generate_latest(registry)
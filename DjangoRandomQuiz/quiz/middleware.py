@@ -0,0 +1,368 @@
+import asyncio
+import gzip
+import json
+import logging
+import time
+import tracemalloc
+import zlib
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+from quiz import metrics, profiling, routers
+from quiz.async_views import run_in_quiz_executor
+from quiz.instrumentation import start_request_timings, stop_request_timings, route_histograms, current_timings, \
+    timed
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+performance_logger = logging.getLogger('quiz.performance')
+
+
+class AsyncWhiteNoiseMiddleware(WhiteNoiseMiddleware):
+    """
+    WhiteNoiseMiddleware that can also run in async mode.
+
+    Django adapts every view below a sync-only middleware to sync code, which runs in one shared thread. Under ASGI,
+    this would make every request wait for the others and undo the async views (see quiz/async_views.py). Serving a
+    static file does not touch the database, so it is fine to do this in the event loop.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, *args, **kwargs):
+        super().__init__(get_response, *args, **kwargs)
+        if asyncio.iscoroutinefunction(self.get_response):
+            # Mark the instance as a coroutine function so that Django awaits it. This is what Django's own
+            #  MiddlewareMixin does.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        response = self.process_request(request)
+        if response is None:
+            response = await self.get_response(request)
+        return response
+
+
+class PerformanceMiddleware:
+    """
+    Records the SQL query count, SQL time, serialization time, total time and (if PERFORMANCE_TRACE_ALLOCATIONS is
+    set) the peak memory allocation of every request, along with the phases timed with quiz.instrumentation.timed.
+
+    The compression ratio of the response is recorded as well, if APICompressionMiddleware compressed it.
+
+    These are sent back in a Server-Timing header (shown in the network tab of the browser's developer tools), logged
+    as a JSON line to the 'quiz.performance' logger and added to the rolling histograms of the route and to the
+    Prometheus metrics (see quiz/metrics.py).
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.trace_allocations = settings.PERFORMANCE_TRACE_ALLOCATIONS
+        if asyncio.iscoroutinefunction(self.get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        timings, token, allocation_baseline = self.start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            stop_request_timings(token)
+        return self.finish(request, response, timings, allocation_baseline)
+
+    async def __acall__(self, request):
+        timings, token, allocation_baseline = self.start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            stop_request_timings(token)
+        return self.finish(request, response, timings, allocation_baseline)
+
+    def start(self, request):
+        allocation_baseline = None
+        if self.trace_allocations:
+            # Note that tracemalloc traces the whole process, so concurrent requests in the same process (threads or
+            #  async) add to each other's peaks.
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            allocation_baseline = tracemalloc.get_traced_memory()[0]
+        timings, token = start_request_timings()
+        return timings, token, allocation_baseline
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # Lets the code that runs during the request know its route (e.g. the slow-query log, see
+        #  quiz/slow_queries.py).
+        timings = current_timings()
+        if timings is not None:
+            timings.route = request.resolver_match.view_name
+
+    def finish(self, request, response, timings, allocation_baseline):
+        total_ms = timings.elapsed() * 1000
+        db_ms = timings.query_time * 1000
+        serialize_ms = timings.phases.get('serialize', 0.0) * 1000
+        peak_allocation = None
+        if allocation_baseline is not None:
+            peak_allocation = max(0, tracemalloc.get_traced_memory()[1] - allocation_baseline)
+
+        server_timing = [
+            f'db;dur={db_ms:.2f};desc="{timings.query_count} queries"',
+            *(f'{phase};dur={duration * 1000:.2f}' for phase, duration in timings.phases.items()),
+            f'total;dur={total_ms:.2f}',
+        ]
+        if peak_allocation is not None:
+            server_timing.append(f'alloc;desc="peak {peak_allocation} B"')
+        response['Server-Timing'] = ', '.join(server_timing)
+
+        # Only record requests to the routes in urls.py (e.g. not the static files).
+        resolver_match = getattr(request, 'resolver_match', None)
+        if resolver_match is None:
+            return response
+
+        route = resolver_match.view_name
+        route_histograms.observe(route, 'total_ms', total_ms)
+        route_histograms.observe(route, 'db_ms', db_ms)
+        route_histograms.observe(route, 'serialize_ms', serialize_ms)
+        route_histograms.observe(route, 'query_count', timings.query_count)
+        if timings.compression_ratio is not None:
+            route_histograms.observe(route, 'compression_ratio', timings.compression_ratio)
+        if peak_allocation is not None:
+            route_histograms.observe(route, 'peak_allocation', peak_allocation)
+        metrics.observe_request(route, request.method, response.status_code, total_ms / 1000, db_ms / 1000,
+                                timings.query_count)
+
+        performance_logger.info(json.dumps({
+            'route': route,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'total_ms': round(total_ms, 3),
+            'db_ms': round(db_ms, 3),
+            'query_count': timings.query_count,
+            'serialize_ms': round(serialize_ms, 3),
+            'peak_allocation': peak_allocation,
+            'compression_ratio': timings.compression_ratio,
+            'phases': {phase: round(duration * 1000, 3) for phase, duration in timings.phases.items()},
+        }))
+        return response
+
+
+def accepted_encodings(accept_encoding):
+    """Returns the content codings accepted by an Accept-Encoding header, e.g. {'gzip', 'br'}."""
+    encodings = set()
+    for item in accept_encoding.split(','):
+        coding, _, params = item.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                pass
+        if coding and quality > 0:
+            encodings.add(coding.strip().lower())
+    return encodings
+
+
+class APICompressionMiddleware:
+    """
+    Compresses the responses of the API (the paths starting with one of API_COMPRESSION_PATHS) with brotli or gzip,
+    whichever the client accepts (brotli first, if it is installed).
+
+    Responses smaller than API_COMPRESSION_MIN_SIZE bytes are sent as they are, as compressing them saves next to
+    nothing. Streaming responses (e.g. exports) are compressed chunk by chunk, and every chunk is flushed so that the
+    client still gets the data as it is produced.
+
+    The time spent compressing is added to the 'compress' phase of the request, and the compression ratio (compressed
+    size / original size) of the non-streaming responses is recorded by PerformanceMiddleware. Under ASGI, the
+    non-streaming responses are compressed in the quiz executor (see quiz/async_views.py), not in the event loop.
+    """
+    sync_capable = True
+    async_capable = True
+
+    # Binary formats that are already compressed are not worth compressing again. MessagePack is binary, but full of
+    #  repeated strings (the keys and texts of the quizzes).
+    COMPRESSIBLE_CONTENT_TYPES = ('application/json', 'application/msgpack', 'application/javascript', 'text/')
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.paths = tuple(settings.API_COMPRESSION_PATHS)
+        self.min_size = settings.API_COMPRESSION_MIN_SIZE
+        self.gzip_level = settings.API_COMPRESSION_GZIP_LEVEL
+        self.brotli_quality = settings.API_COMPRESSION_BROTLI_QUALITY
+        if asyncio.iscoroutinefunction(self.get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        return self.process_response(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        if not response.streaming and self.choose_encoding(request, response) is not None:
+            # Compressing a large response would hold up every other request of the event loop. Like the rendering of
+            #  the async views, it is done in the quiz executor.
+            return await run_in_quiz_executor(self.process_response, request, response)
+        return self.process_response(request, response)
+
+    def choose_encoding(self, request, response):
+        """Returns the encoding to compress the response with, or None to send it as it is."""
+        if not request.path.startswith(self.paths) or response.has_header('Content-Encoding'):
+            return None
+        if not response.get('Content-Type', '').startswith(self.COMPRESSIBLE_CONTENT_TYPES):
+            return None
+        if not response.streaming and len(response.content) < self.min_size:
+            return None
+
+        encodings = accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if brotli is not None and 'br' in encodings:
+            return 'br'
+        if 'gzip' in encodings:
+            return 'gzip'
+        return None
+
+    def process_response(self, request, response):
+        if request.path.startswith(self.paths):
+            # Caches must not send a compressed response to a client that did not ask for one, or vice versa.
+            patch_vary_headers(response, ('Accept-Encoding',))
+
+        encoding = self.choose_encoding(request, response)
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            response.streaming_content = self.compress_stream(response.streaming_content, encoding)
+            del response['Content-Length']
+        else:
+            original_size = len(response.content)
+            with timed('compress'):
+                response.content = self.compress(response.content, encoding)
+            response['Content-Length'] = str(len(response.content))
+            timings = current_timings()
+            if timings is not None:
+                timings.compression_ratio = len(response.content) / original_size
+
+        # The ETag of the uncompressed content is no longer byte-for-byte accurate.
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = encoding
+        return response
+
+    def compress(self, content, encoding):
+        if encoding == 'br':
+            return brotli.compress(content, quality=self.brotli_quality)
+        return gzip.compress(content, compresslevel=self.gzip_level)
+
+    def compress_stream(self, chunks, encoding):
+        if encoding == 'br':
+            compressor = brotli.Compressor(quality=self.brotli_quality)
+            for chunk in chunks:
+                data = compressor.process(chunk) + compressor.flush()
+                if data:
+                    yield data
+            yield compressor.finish()
+        else:
+            compressor = zlib.compressobj(self.gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            for chunk in chunks:
+                data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+                if data:
+                    yield data
+            yield compressor.flush()
+
+
+class ReplicaStickinessMiddleware:
+    """
+    Sends the reads of a user to the primary database for REPLICA_STICKINESS seconds after each of their successful
+    writes (a POST, PUT, PATCH or DELETE request), so that they see their own writes even when the read replicas lag
+    behind. See quiz/routers.py.
+    """
+    sync_capable = True
+    async_capable = True
+    SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(self.get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        response = self.get_response(request)
+        if self.is_write(request, response):
+            routers.pin_to_primary(request.user)
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        if self.is_write(request, response):
+            # The cache may be on the network.
+            await sync_to_async(routers.pin_to_primary)(request.user)
+        return response
+
+    def is_write(self, request, response):
+        # The user is set by the API views as well (see rest_framework.request.Request.user).
+        return (settings.DATABASE_REPLICAS and request.method not in self.SAFE_METHODS
+                and response.status_code < 400 and hasattr(request, 'user'))
+
+
+class ProfilingMiddleware:
+    """
+    Profiles the requests of staff users with an 'X-Profile: 1' header or a profile=1 query parameter, and sends back
+    the id of the profile in an X-Profile-Id header (see quiz/profiling.py). Comes after CachedOAuth2TokenMiddleware,
+    which sets the user of the API requests.
+
+    Only the sync requests are profiled: under ASGI, the profilers would record every request of the event loop.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(self.get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            # A coroutine, which Django awaits.
+            return self.get_response(request)
+        if not self.wants_profile(request):
+            return self.get_response(request)
+
+        start = time.perf_counter()
+        response, profiler, sampler = profiling.profile(self.get_response, request)
+        resolver_match = getattr(request, 'resolver_match', None)
+        profile = profiling.save(
+            profiler, sampler,
+            route=resolver_match.view_name if resolver_match is not None else None,
+            user=request.user.username,
+            user_id=request.user.id,
+            method=request.method,
+            path=request.get_full_path(),
+            status=response.status_code,
+            duration_ms=round((time.perf_counter() - start) * 1000, 3),
+        )
+        response['X-Profile-Id'] = profile['id']
+        return response
+
+    @staticmethod
+    def wants_profile(request):
+        flag = request.META.get('HTTP_X_PROFILE') or request.GET.get('profile')
+        return (flag not in (None, '', '0') and hasattr(request, 'user') and request.user.is_active
+                and request.user.is_staff)
@@ -0,0 +1,67 @@
+# Generated by Django 3.1 on 2026-10-19 14:57
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+
+
+def copy_user_and_topic_from_quiz(apps, schema_editor):
+    """Copy the creator and topic of the quiz of every existing attempt."""
+    Quiz = apps.get_model('quiz', 'Quiz')
+    QuizAttempt = apps.get_model('quiz', 'QuizAttempt')
+    Topic = apps.get_model('quiz', 'Topic')
+
+    # Topic.generate_quiz did not set the topic of the quizzes, only the topic id in the pickled quiz.
+    topic_ids = set(Topic.objects.values_list('id', flat=True))
+    quizzes = []
+    for quiz in Quiz.objects.filter(topic__isnull=True).only('id', 'quiz').iterator(chunk_size=1000):
+        if quiz.quiz.get('topic') in topic_ids:
+            quiz.topic_id = quiz.quiz['topic']
+            quizzes.append(quiz)
+    Quiz.objects.bulk_update(quizzes, ['topic'], batch_size=1000)
+
+    quiz = Quiz.objects.filter(id=OuterRef('quiz_id'))
+    QuizAttempt.objects.filter(quiz__isnull=False).update(
+        user_id=Subquery(quiz.values('creator_id')[:1]),
+        topic_id=Subquery(quiz.values('topic_id')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('quiz', '0006_auto_20210505_1317'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='quizattempt',
+            name='topic',
+            field=models.ForeignKey(blank=True, db_index=False, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='quiz_attempts', to='quiz.topic', verbose_name='Topic'),
+        ),
+        migrations.AddField(
+            model_name='quizattempt',
+            name='user',
+            field=models.ForeignKey(blank=True, db_index=False, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='quiz_attempts', to=settings.AUTH_USER_MODEL, verbose_name='User'),
+        ),
+        # Fill in the new columns before creating the indexes, which is faster than updating them along the way.
+        migrations.RunPython(copy_user_and_topic_from_quiz, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='quizattempt',
+            index=models.Index(fields=['topic', 'user', 'score'], name='quizattempt_topic_user_score'),
+        ),
+        migrations.AddIndex(
+            model_name='quizattempt',
+            index=models.Index(fields=['user', 'score'], name='quizattempt_user_score'),
+        ),
+        migrations.AddIndex(
+            model_name='quizattempt',
+            index=models.Index(fields=['topic', 'score'], name='quizattempt_topic_score'),
+        ),
+        migrations.AddIndex(
+            model_name='quizattempt',
+            index=models.Index(fields=['score'], name='quizattempt_score'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 3.1 on 2026-10-19 15:01
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import picklefield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('quiz', '0007_quizattempt_user_topic_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuestionWeight',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('weight', models.FloatField(default=1.0, verbose_name='Weight')),
+                ('answered_at', models.DateTimeField(verbose_name='Last Answered At')),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='question_weights', to='quiz.question', verbose_name='Question')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='question_weights', to=settings.AUTH_USER_MODEL, verbose_name='User')),
+            ],
+            options={
+                'verbose_name': 'Question Weight',
+                'verbose_name_plural': 'Question Weights',
+                'default_related_name': 'question_weights',
+                'unique_together': {('user', 'question')},
+            },
+        ),
+        migrations.CreateModel(
+            name='QuestionSampler',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('question_ids', picklefield.fields.PickledObjectField(editable=False, verbose_name='Question IDs')),
+                ('weights', picklefield.fields.PickledObjectField(editable=False, verbose_name='Weights')),
+                ('probabilities', picklefield.fields.PickledObjectField(editable=False, verbose_name='Probabilities')),
+                ('aliases', picklefield.fields.PickledObjectField(editable=False, verbose_name='Aliases')),
+                ('stale', models.BooleanField(default=False, verbose_name='Stale')),
+                ('built_at', models.DateTimeField(verbose_name='Built At')),
+                ('topic', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='question_samplers', to='quiz.topic', verbose_name='Topic')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='question_samplers', to=settings.AUTH_USER_MODEL, verbose_name='User')),
+            ],
+            options={
+                'verbose_name': 'Question Sampler',
+                'verbose_name_plural': 'Question Samplers',
+                'default_related_name': 'question_samplers',
+                'unique_together': {('user', 'topic')},
+            },
+        ),
+    ]
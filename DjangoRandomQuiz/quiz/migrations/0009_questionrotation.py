@@ -0,0 +1,34 @@
+# Generated by Django 3.1 on 2026-10-19 15:04
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import picklefield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('quiz', '0008_questionweight_questionsampler'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuestionRotation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('question_ids', picklefield.fields.PickledObjectField(editable=False, verbose_name='Question IDs')),
+                ('seen', models.BinaryField(default=b'', verbose_name='Seen Questions')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated At')),
+                ('topic', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='question_rotations', to='quiz.topic', verbose_name='Topic')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='question_rotations', to=settings.AUTH_USER_MODEL, verbose_name='User')),
+            ],
+            options={
+                'verbose_name': 'Question Rotation',
+                'verbose_name_plural': 'Question Rotations',
+                'default_related_name': 'question_rotations',
+                'unique_together': {('user', 'topic')},
+            },
+        ),
+    ]
@@ -0,0 +1,45 @@
+from django.db import migrations
+
+# The search index of quiz/search.py, filled with the existing questions and answers. The table is not a model, as it
+#  is a virtual table on SQLite.
+CREATE_SQL = {
+    'sqlite': [
+        "CREATE VIRTUAL TABLE quiz_search USING fts5(creator, text, tokenize = 'unicode61')",
+        # Rank on the text only: every entry of a user has the same creator.
+        "INSERT INTO quiz_search(quiz_search, rank) VALUES ('rank', 'bm25(0.0, 1.0)')",
+        "INSERT INTO quiz_search(rowid, creator, text) SELECT id * 2, 'u' || creator_id, text FROM quiz_question",
+        "INSERT INTO quiz_search(rowid, creator, text) SELECT id * 2 + 1, 'u' || creator_id, text FROM quiz_answer",
+    ],
+    'postgresql': [
+        "CREATE TABLE quiz_search (id bigint PRIMARY KEY, creator_id integer NOT NULL, text text NOT NULL, "
+        "document tsvector NOT NULL)",
+        "INSERT INTO quiz_search (id, creator_id, text, document) "
+        "SELECT id * 2, creator_id, text, to_tsvector('simple', text) FROM quiz_question",
+        "INSERT INTO quiz_search (id, creator_id, text, document) "
+        "SELECT id * 2 + 1, creator_id, text, to_tsvector('simple', text) FROM quiz_answer",
+        # Creating the indexes after filling the table is faster than updating them along the way.
+        "CREATE INDEX quiz_search_document ON quiz_search USING gin (document)",
+        "CREATE INDEX quiz_search_creator_id ON quiz_search (creator_id)",
+    ],
+}
+
+
+def create_search_index(apps, schema_editor):
+    for sql in CREATE_SQL.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor in CREATE_SQL:
+        schema_editor.execute("DROP TABLE IF EXISTS quiz_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quiz', '0009_questionrotation'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
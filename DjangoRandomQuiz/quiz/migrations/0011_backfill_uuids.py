@@ -0,0 +1,54 @@
+import uuid
+
+from django.db import migrations, transaction
+from django.db.models import Count
+
+MODELS = ['Topic', 'Answer', 'Question', 'Quiz', 'QuizAttempt']
+CHUNK_SIZE = 1000
+
+
+def backfill_uuids(apps, schema_editor):
+    """
+    Give a UUID to every row without one (e.g. from bulk_create), and a new one to all but one of the rows that share a
+    UUID, so that the unique index can be created in the next migration. Every chunk is committed on its own, so that
+    large tables are not locked for the whole migration.
+    """
+    for model_name in MODELS:
+        model = apps.get_model('quiz', model_name)
+        duplicates = (model.objects.filter(uuid__isnull=False).values('uuid').annotate(rows=Count('id'))
+                      .filter(rows__gt=1).values_list('uuid', flat=True))
+        duplicate_ids = []
+        for duplicate in duplicates:
+            duplicate_ids.extend(model.objects.filter(uuid=duplicate).order_by('id').values_list('id', flat=True)[1:])
+
+        last_id = 0
+        while True:
+            with transaction.atomic(using=schema_editor.connection.alias):
+                rows = list(model.objects.filter(uuid__isnull=True, id__gt=last_id).order_by('id')
+                            .only('id')[:CHUNK_SIZE])
+                if not rows:
+                    break
+                for row in rows:
+                    row.uuid = uuid.uuid4()
+                model.objects.bulk_update(rows, ['uuid'])
+            last_id = rows[-1].id
+
+        for start in range(0, len(duplicate_ids), CHUNK_SIZE):
+            with transaction.atomic(using=schema_editor.connection.alias):
+                rows = list(model.objects.filter(id__in=duplicate_ids[start:start + CHUNK_SIZE]).only('id'))
+                for row in rows:
+                    row.uuid = uuid.uuid4()
+                model.objects.bulk_update(rows, ['uuid'])
+
+
+class Migration(migrations.Migration):
+    # Commit every chunk of the backfill on its own.
+    atomic = False
+
+    dependencies = [
+        ('quiz', '0010_search_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_uuids, migrations.RunPython.noop),
+    ]
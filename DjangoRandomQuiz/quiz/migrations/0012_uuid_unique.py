@@ -0,0 +1,39 @@
+# Generated by Django 3.1 on 2026-10-19 15:10
+
+from django.db import migrations, models
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quiz', '0011_backfill_uuids'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='answer',
+            name='uuid',
+            field=models.UUIDField(default=uuid.uuid4, editable=False, unique=True, verbose_name='UUID'),
+        ),
+        migrations.AlterField(
+            model_name='question',
+            name='uuid',
+            field=models.UUIDField(default=uuid.uuid4, editable=False, unique=True, verbose_name='UUID'),
+        ),
+        migrations.AlterField(
+            model_name='quiz',
+            name='uuid',
+            field=models.UUIDField(default=uuid.uuid4, editable=False, unique=True, verbose_name='UUID'),
+        ),
+        migrations.AlterField(
+            model_name='quizattempt',
+            name='uuid',
+            field=models.UUIDField(default=uuid.uuid4, editable=False, unique=True, verbose_name='UUID'),
+        ),
+        migrations.AlterField(
+            model_name='topic',
+            name='uuid',
+            field=models.UUIDField(default=uuid.uuid4, editable=False, unique=True, verbose_name='UUID'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 3.1 on 2026-10-19 15:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quiz', '0012_uuid_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='quiz',
+            name='no_of_questions',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Number of Questions'),
+        ),
+        migrations.AddField(
+            model_name='quiz',
+            name='topic_name',
+            field=models.CharField(blank=True, default='', editable=False, max_length=256, verbose_name='Topic Name'),
+        ),
+        migrations.AddField(
+            model_name='quizattempt',
+            name='no_of_questions',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Number of Questions'),
+        ),
+        migrations.AddField(
+            model_name='quizattempt',
+            name='topic_name',
+            field=models.CharField(blank=True, default='', editable=False, max_length=256, verbose_name='Topic Name'),
+        ),
+        migrations.AddIndex(
+            model_name='quiz',
+            index=models.Index(fields=['creator', 'id'], name='quiz_creator_id'),
+        ),
+        migrations.AddIndex(
+            model_name='quizattempt',
+            index=models.Index(fields=['user', 'id'], name='quizattempt_user_id'),
+        ),
+    ]
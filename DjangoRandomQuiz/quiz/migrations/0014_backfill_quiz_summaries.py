@@ -0,0 +1,42 @@
+from django.db import migrations, transaction
+
+CHUNK_SIZE = 1000
+# The models and their pickled payloads.
+PAYLOADS = {'Quiz': 'quiz', 'QuizAttempt': 'quiz_attempt'}
+
+
+def backfill_summaries(apps, schema_editor):
+    """
+    Copy the topic name and number of questions out of the payload of every quiz and quiz attempt (as their save
+    methods do). This is the only time the payloads are all unpickled. Every chunk is committed on its own, so that
+    large tables are not locked for the whole migration.
+    """
+    for model_name, payload_field in PAYLOADS.items():
+        model = apps.get_model('quiz', model_name)
+        last_id = 0
+        while True:
+            with transaction.atomic(using=schema_editor.connection.alias):
+                rows = list(model.objects.filter(id__gt=last_id).order_by('id').select_related('topic')
+                            .only('id', payload_field, 'topic__name')[:CHUNK_SIZE])
+                if not rows:
+                    break
+                for row in rows:
+                    payload = getattr(row, payload_field) or {}
+                    # The oldest payloads have no topic name.
+                    row.topic_name = payload.get('topic_name') or (row.topic.name if row.topic is not None else '')
+                    row.no_of_questions = len(payload.get('questions', ()))
+                model.objects.bulk_update(rows, ['topic_name', 'no_of_questions'])
+            last_id = rows[-1].id
+
+
+class Migration(migrations.Migration):
+    # Commit every chunk of the backfill on its own.
+    atomic = False
+
+    dependencies = [
+        ('quiz', '0013_quiz_summary_columns'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_summaries, migrations.RunPython.noop),
+    ]
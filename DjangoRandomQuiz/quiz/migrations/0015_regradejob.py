@@ -0,0 +1,45 @@
+# Generated by Django 3.1 on 2026-10-19 15:40
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import picklefield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('quiz', '0014_backfill_quiz_summaries'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RegradeJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('question_ids', picklefield.fields.PickledObjectField(editable=False, verbose_name='Question IDs')),
+                ('topic_ids', picklefield.fields.PickledObjectField(editable=False, verbose_name='Topic IDs')),
+                ('max_attempt_id', models.PositiveIntegerField(verbose_name='Last Attempt ID')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=16, verbose_name='Status')),
+                ('last_attempt_id', models.PositiveIntegerField(default=0, verbose_name='Last Regraded Attempt ID')),
+                ('total', models.PositiveIntegerField(default=0, verbose_name='Attempts To Check')),
+                ('processed', models.PositiveIntegerField(default=0, verbose_name='Attempts Checked')),
+                ('regraded', models.PositiveIntegerField(default=0, verbose_name='Attempts Regraded')),
+                ('error', models.TextField(blank=True, default='', verbose_name='Error')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated At')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Finished At')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='regrade_jobs', to=settings.AUTH_USER_MODEL, verbose_name='User')),
+            ],
+            options={
+                'verbose_name': 'Regrade Job',
+                'verbose_name_plural': 'Regrade Jobs',
+                'default_related_name': 'regrade_jobs',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='regradejob',
+            index=models.Index(fields=['status'], name='regradejob_status'),
+        ),
+    ]
@@ -1,4 +1,12 @@
+from django.db.models import Q
+from rest_framework import HTTP_HEADER_ENCODING, status
 from rest_framework.exceptions import PermissionDenied
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.utils.mediatypes import _MediaType
+
+from quiz import regrading, routers, search
+from quiz.layouts import LAYOUTS, ROWS, to_layout
+from quiz.models import Question
 
 
 class NoUpdateCreatorMixin:
@@ -27,3 +35,90 @@ class UserDataBasedOnRequestMixin:
     def update(self, request, *args, **kwargs):
         request.data.update({'creator': self.request.user.id})
         return super().update(request, *args, **kwargs)
+
+
+class SearchIndexMixin:
+    """
+    Keep the search index (see quiz/search.py) up to date when the viewset creates, updates or destroys a question or
+    an answer. Objects created or deleted directly in the views must be indexed or unindexed there.
+    """
+
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        search.index([serializer.instance])
+
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        search.index([serializer.instance])
+
+    def perform_destroy(self, instance):
+        search.unindex([instance])
+        super().perform_destroy(instance)
+
+
+class RegradeMixin:
+    """
+    Regrade the user's quiz attempts (see quiz/regrading.py) after a successful request that may have changed the
+    answer keys of questions: the questions of the answer (as a correct or a wrong answer) before the request, and the
+    ones passed in the request ('questions' or 'question_id').
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.regrade_question_ids = []
+        if request.method in SAFE_METHODS:
+            return
+
+        requested = request.data.get('questions') or []
+        if not isinstance(requested, list):
+            requested = [requested]
+        requested = [*requested, request.data.get('question_id')]
+        condition = Q(id__in=[int(question_id) for question_id in requested if str(question_id).isdigit()])
+        answer_id = self.kwargs.get(self.lookup_url_kwarg or self.lookup_field)
+        if answer_id is not None and str(answer_id).isdigit():
+            condition |= Q(answers=answer_id) | Q(wrong_answers=answer_id)
+        # Before the request changes them.
+        self.regrade_question_ids = list(Question.objects.filter(condition, creator=request.user)
+                                         .values_list('id', flat=True).distinct())
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        if status.is_success(response.status_code) and getattr(self, 'regrade_question_ids', None):
+            regrading.schedule(request.user, self.regrade_question_ids)
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+class PayloadLayoutMixin:
+    """
+    Lets clients ask for the quiz and quiz attempt payloads in the columnar layout (see quiz.layouts), either with the
+    query parameter '?layout=columnar' or with a media type parameter, e.g. 'Accept: application/json; layout=columnar'.
+
+    Anything else will return the default row layout.
+    """
+
+    def get_layout(self):
+        layout = self.request.query_params.get('layout')
+        if not layout:
+            accepted_media_type = _MediaType(getattr(self.request, 'accepted_media_type', None) or '')
+            layout = accepted_media_type.params.get('layout', b'').decode(HTTP_HEADER_ENCODING)
+        return layout if layout in LAYOUTS else ROWS
+
+    def to_layout(self, payload):
+        return to_layout(payload, self.get_layout())
+
+
+class ReplicaReadMixin:
+    """
+    Read from a replica of the database during the safe requests of the view (see quiz/routers.py), once the user is
+    authenticated. For the views that can show data a moment older than the primary's, other than the user's own writes.
+    """
+    replica = None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method in SAFE_METHODS:
+            self.replica = routers.start_replica_reads(request.user)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        routers.end_replica_reads(self.replica)
+        self.replica = None
+        return super().finalize_response(request, response, *args, **kwargs)
@@ -1,33 +1,46 @@
+import functools
+import operator
 import random
 import uuid
+from collections import defaultdict
 
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
-from django.db import models
-
-from functools import reduce
+from django.db import models, transaction
+from django.utils import timezone
 
 from picklefield import PickledObjectField
 
+from quiz import attempt_buffer, metrics, sampling
 from quiz.generate_quiz import generate_list_of_wrong_choices
+from quiz.grading import grade_quiz_answers
+from quiz.instrumentation import PhaseTimer
+
+
+class UUIDQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        # Objects built with uuid=None (e.g. copies of other objects) still get a UUID.
+        objs = list(objs)
+        for obj in objs:
+            if obj.uuid is None:
+                obj.uuid = uuid.uuid4()
+        return super().bulk_create(objs, *args, **kwargs)
 
 
 class GenerateUUIDAbstract(models.Model):
     """
     Used to generate a unique UUID that does not serve as a primary key.
+
+    The UUID is set when the model is created (so bulk_create gets it as well), and the unique index on it makes the
+    database reject the (astronomically unlikely) duplicates, instead of checking for them with a query on every save.
     """
-    # Set the UUID when saving.
-    uuid = models.UUIDField(blank=True, null=True, editable=False, verbose_name="UUID")
+    uuid = models.UUIDField(default=uuid.uuid4, unique=True, editable=False, verbose_name="UUID")
+
+    objects = UUIDQuerySet.as_manager()
 
     def save(self, *args, **kwargs):
-        if not self.uuid:
+        if self.uuid is None:
             self.uuid = uuid.uuid4()
-            # Check if uuid is unique and regenerate UUID
-            # self.__class__ refers to the model class as you cannot access the "objects" manager directly through the
-            #  instance of the descendant class. self.__class__ refers to, for example, "DashboardConfig" or
-            #  "DashboardSnapshot".
-            while self.__class__.objects.filter(uuid=self.uuid):
-                self.uuid = uuid.uuid4()
         return super().save(*args, **kwargs)
 
     class Meta:
@@ -64,12 +77,40 @@ class Topic(UUIDAndTimeStampAbstract):
 
     def max_choices(self):
         """Returns the max number of choices for a given topic and user."""
-        return reduce(lambda cumulative_total, answer_count_per_question: cumulative_total + answer_count_per_question,
-               [question.answers.count() for question in self.questions.all()])
+        # The total number of correct answers over all the questions of the topic, counted in one query.
+        return Question.answers.through.objects.filter(question__topic=self).count()
 
     def pool_of_choices(self):
         """Returns all choices for a given topic and user."""
-        return Answer.objects.filter(creator=self.creator, questions__topic=self)
+        # Without distinct(), an answer shared by several questions of the topic would be in the pool once per
+        #  question, and could be picked more than once as a wrong choice for the same question.
+        return Answer.objects.filter(creator=self.creator, questions__topic=self).distinct()
+
+    def adaptive_question_ids(self, no_of_questions, max_questions):
+        """
+        Returns the ids of no_of_questions distinct questions of the topic, picked according to the creator's
+        question weights with the alias table of the topic, which is rebuilt first if it is out of date.
+        """
+        now = timezone.now()
+        sampler = QuestionSampler.objects.filter(user_id=self.creator_id, topic=self).first()
+        if sampler is None or sampler.needs_rebuild(max_questions, now):
+            sampler = QuestionSampler.build(self, now, sampler)
+        indexes = sampling.sample_distinct(sampler.alias_table(), sampler.weights, no_of_questions)
+        return [sampler.question_ids[index] for index in indexes]
+
+    def rotation_question_ids(self, no_of_questions, max_questions):
+        """
+        Returns the ids of no_of_questions distinct questions of the topic, the ones the creator has not been served in
+        the current round first (see QuestionRotation), and marks them as served.
+        """
+        rotation = QuestionRotation.objects.filter(user_id=self.creator_id, topic=self).first()
+        if rotation is None:
+            rotation = QuestionRotation(user_id=self.creator_id, topic=self, question_ids=[], seen=b'')
+        if len(rotation.question_ids) != max_questions:
+            rotation.reindex(self.questions.order_by('id').values_list('id', flat=True))
+        indexes, rotation.seen = sampling.pick_unseen(bytes(rotation.seen), len(rotation.question_ids), no_of_questions)
+        rotation.save()
+        return [rotation.question_ids[index] for index in indexes]
 
     def __str__(self):
         return self.name
@@ -80,9 +121,13 @@ class Topic(UUIDAndTimeStampAbstract):
         default_related_name = "topics"
         unique_together = [["creator", "name"]]
 
+    @metrics.GENERATE_QUIZ_DURATION.time()
     def generate_quiz(self, no_of_questions=4, no_of_choices=4,
                       show_all_alternative_answers=False,
-                      fixed_choices_only=False
+                      fixed_choices_only=False,
+                      adaptive=False,
+                      rotation=False,
+                      save=True,
                       ):
         """
         Generate a list of questions based on a topic text, number of questions per topic and number of choices per
@@ -98,6 +143,7 @@ class Topic(UUIDAndTimeStampAbstract):
 
         {
             "topic": topic_id,
+            "uuid": quiz_model_uuid,
             "questions": [
                 {'question_text': question_text_1, 'choices': [choice_text_1, choice_text_2, ... choice_text_n], 'question_type': 'checkbox'},
                 {'question_text': question_text_2, 'choices': [choice_text_1, choice_text_2, ... choice_text_n], 'question_type': 'radio'},
@@ -118,15 +164,32 @@ class Topic(UUIDAndTimeStampAbstract):
 
         For each question, if the max number of answers is more than one, the question will be a checkbox (multiple choices)
         instead of a radio button (one choice).
+
+        If adaptive is True (False by default), the questions are not picked uniformly, but more often the ones the
+        creator got wrong or has not answered for a while (see quiz/sampling.py).
+
+        If rotation is True (False by default), the questions the creator has not been served yet in the current round
+        are picked first, and a new round starts once every question of the topic has been served (see
+        QuestionRotation). adaptive takes precedence over rotation.
+
+        If save is False (True by default), the Quiz model is returned without being saved, and the quiz has no id.
+        Its answer_key attribute maps the text of every question to the texts of its correct choices, and its
+        question_ids attribute maps it to the id of the question, for the stateless quizzes (see quiz/quiz_tokens.py).
         """
         # TODO - Handle the case where the topic has no questions.
+        # Adds the time spent in each phase to the Server-Timing header (see quiz/instrumentation.py).
+        phases = PhaseTimer('generate_quiz')
 
         # Get quiz topic
         quiz_topic = self
 
+        quiz_object = Quiz(creator=self.creator, topic=self)
         quiz = {"topic": quiz_topic.id,
                 "topic_name": quiz_topic.name,
+                "uuid": str(quiz_object.uuid),
                 "questions": []}
+        answer_key = {}
+        question_ids_by_text = {}
 
         # Automatically set default values if invalid values are set (this should be caught in the frontend):
         no_of_questions = no_of_questions if no_of_questions > 0 else 4
@@ -134,17 +197,40 @@ class Topic(UUIDAndTimeStampAbstract):
 
         # Limit number of questions and number of choices
         max_questions = quiz_topic.max_questions()
+        metrics.TOPIC_QUESTIONS.observe(max_questions)
         no_of_questions = no_of_questions if no_of_questions <= max_questions else max_questions
 
         max_choices = quiz_topic.max_choices()
         no_of_choices = min(no_of_choices, max_choices)
 
-        # Get the required number of questions in the right order.
-        # Order by ('?') allows us to scramble the data randomly.
-        quiz_questions = quiz_topic.questions.order_by('?')[:no_of_questions]
+        # Get the required number of questions in the right order, with their answers and wrong answers (so that
+        #  we do not need any more queries per question).
+        if adaptive or rotation:
+            if adaptive:
+                question_ids = quiz_topic.adaptive_question_ids(no_of_questions, max_questions)
+            else:
+                question_ids = quiz_topic.rotation_question_ids(no_of_questions, max_questions)
+            questions_by_id = {question.id: question for question in quiz_topic.questions.filter(
+                id__in=question_ids).prefetch_related('answers', 'wrong_answers')}
+            quiz_questions = [questions_by_id[question_id] for question_id in question_ids
+                              if question_id in questions_by_id]
+            if len(quiz_questions) < len(question_ids):
+                # A question was removed from the topic (and another one added) since the alias table or the
+                #  question index of the rotation was built.
+                if adaptive:
+                    QuestionSampler.objects.filter(user_id=self.creator_id, topic=self).update(stale=True)
+                else:
+                    rotation = QuestionRotation.objects.get(user_id=self.creator_id, topic=self)
+                    rotation.reindex(quiz_topic.questions.order_by('id').values_list('id', flat=True))
+                    rotation.save()
+        else:
+            # Order by ('?') allows us to scramble the data randomly.
+            quiz_questions = list(quiz_topic.questions.order_by('?').prefetch_related('answers', 'wrong_answers')
+                                  [:no_of_questions])
 
-        # Get a queryset of choices available to the topic.
-        quiz_choices = quiz_topic.pool_of_choices()
+        # Get a list of choices available to the topic.
+        quiz_choices = list(quiz_topic.pool_of_choices())
+        phases.lap('load')
 
         for question in quiz_questions:
             question_text = question.text
@@ -169,11 +255,11 @@ class Topic(UUIDAndTimeStampAbstract):
                 else:
                     # Set random wrong answers
                     no_of_random_wrong_choices = max(0, no_of_wrong_choices - no_of_fixed_wrong_choices)
-                    possible_random_wrong_choices = quiz_choices.exclude(id=correct_answer.id)
-
-                    # Chain .exclude() to exclude all fixed wrong choices answers from the set of random_wrong_choices.
-                    for fixed_wrong_answer in fixed_wrong_answers:
-                        possible_random_wrong_choices = possible_random_wrong_choices.exclude(id=fixed_wrong_answer.id)
+                    # Exclude the correct answer and all fixed wrong choices answers from the set of
+                    #  random_wrong_choices.
+                    excluded_ids = {correct_answer.id, *(fixed_wrong_answer.id for fixed_wrong_answer in
+                                                         fixed_wrong_answers)}
+                    possible_random_wrong_choices = [choice for choice in quiz_choices if choice.id not in excluded_ids]
 
                     random_wrong_choices = generate_list_of_wrong_choices(possible_random_wrong_choices,
                                                                           no_of_random_wrong_choices)
@@ -201,13 +287,11 @@ class Topic(UUIDAndTimeStampAbstract):
                     fixed_wrong_choices = generate_list_of_wrong_choices(fixed_wrong_answers, no_of_fixed_wrong_choices)
 
                 else:
-                    possible_random_wrong_choices = quiz_choices
-                    # Chain .exclude() to exclude all correct answers from the set of wrong_choices.
-                    for correct_answer in correct_answers:
-                        possible_random_wrong_choices = possible_random_wrong_choices.exclude(id=correct_answer.id)
-                    # Chain .exclude() to exclude all fixed wrong choices answers from the set of random_wrong_choices.
-                    for fixed_wrong_answer in fixed_wrong_answers:
-                        possible_random_wrong_choices = possible_random_wrong_choices.exclude(id=fixed_wrong_answer.id)
+                    # Exclude all correct answers and all fixed wrong choices answers from the set of
+                    #  random_wrong_choices.
+                    excluded_ids = {*(correct_answer.id for correct_answer in correct_answers),
+                                    *(fixed_wrong_answer.id for fixed_wrong_answer in fixed_wrong_answers)}
+                    possible_random_wrong_choices = [choice for choice in quiz_choices if choice.id not in excluded_ids]
 
                     # We have to calibrate the number of correct answers based on the max number of wrong choices. If
                     # we have too few possible wrong choices, we cannot have too few correct answers.
@@ -251,13 +335,18 @@ class Topic(UUIDAndTimeStampAbstract):
                 'choices': all_choices,
                 'question_type': question_type
             })
-
-        quiz_object = Quiz.objects.create(
-            creator=self.creator,
-            quiz=quiz,
-        )
-        quiz_object.quiz.update({'id': quiz_object.id})
-        quiz_object.save()
+            answer_key[question_text] = set(question.list_of_answer_text).intersection(all_choices)
+            question_ids_by_text[question_text] = question.id
+        phases.lap('sample')
+
+        quiz_object.quiz = quiz
+        quiz_object.answer_key = answer_key
+        quiz_object.question_ids = question_ids_by_text
+        if save:
+            quiz_object.save()
+            quiz_object.quiz.update({'id': quiz_object.id})
+            quiz_object.save()
+            phases.lap('persist')
         return quiz_object
 
 
@@ -294,7 +383,8 @@ class Question(UUIDAndTimeStampAbstract):
         return super().clean()
 
     def has_one_answer(self):
-        return self.answers.count() == 1
+        # len() instead of count() so that answers prefetched with prefetch_related('answers') are used.
+        return len(self.answers.all()) == 1
 
     @property
     def answer(self):
@@ -318,16 +408,13 @@ class Question(UUIDAndTimeStampAbstract):
         return [answer.text for answer in self.answers.all()]
 
     def is_right_answer(self, answer_text):
-        """Check if an answer is right"""
-        if not Answer.objects.filter(creator=self.creator, text=answer_text):
-            # If no such answer exists in the database, return False.
-            return False
-        if self.has_one_answer():
-            # If the answer is the one correct answer, return True. Otherwise return False.
-            return self.answer_text == answer_text
-        else:
-            # If there are multiple answers, check if the answer_text is in any of the correct answers.
-            return answer_text in self.list_of_answer_text
+        """
+        Check if an answer is right, i.e. if the answer_text is the text of one of the correct answers. An answer text
+        that does not exist in the database cannot be the text of a correct answer.
+
+        Uses the prefetched answers if the question was fetched with prefetch_related('answers').
+        """
+        return answer_text in self.list_of_answer_text
 
     def __str__(self):
         return self.text
@@ -347,6 +434,7 @@ class Quiz(UUIDAndTimeStampAbstract):
     Quiz will be in this format:
      {
         "topic": topic_text,
+        "uuid": quiz_model_uuid,
         "questions": [
             {'question_text': question_text_1, 'choices': [choice_text_1, choice_text_2, ... choice_text_n], 'question_type': 'checkbox'},
             {'question_text': question_text_2, 'choices': [choice_text_1, choice_text_2, ... choice_text_n], 'question_type': 'radio'},
@@ -355,7 +443,11 @@ class Quiz(UUIDAndTimeStampAbstract):
         ],
         "id": quiz_model_id,
     }
-    The id field allows us to get the same quiz back when we check answers.
+    The id field allows us to get the same quiz back when we check answers. The uuid field gets it back as well (see
+    QuizByUUIDAPIView), without exposing how many quizzes there are.
+
+    The topic name and number of questions are copied out of the quiz when it is saved, so that the history of the
+    user's quizzes (see QuizHistoryAPIView) is read from these columns without unpickling the quizzes.
     """
     creator = models.ForeignKey(User, verbose_name="Creator", related_name="quizzes", on_delete=models.CASCADE)
 
@@ -365,10 +457,26 @@ class Quiz(UUIDAndTimeStampAbstract):
     # This will take in the quiz in generate_quiz.
     quiz = PickledObjectField(verbose_name="Quiz", editable=False)
 
+    # Summary of the quiz, kept even if the topic is renamed or deleted.
+    topic_name = models.CharField(max_length=256, verbose_name="Topic Name", blank=True, default="", editable=False)
+    no_of_questions = models.PositiveIntegerField(verbose_name="Number of Questions", default=0, editable=False)
+
+    def summarize(self):
+        """Copy the summary columns out of the quiz. Called by save, but not by bulk_create."""
+        self.topic_name = self.quiz.get('topic_name', '')
+        self.no_of_questions = len(self.quiz.get('questions', ()))
+
+    def save(self, *args, **kwargs):
+        # Not when the payload was deferred, which would load it.
+        if 'quiz' not in self.get_deferred_fields() and self.quiz is not None:
+            self.summarize()
+        return super().save(*args, **kwargs)
+
     def get_quiz_with_uuid(self):
         """Passes a dict with the quiz and the UUID of this model."""
         return {'uuid': self.uuid, **self.quiz}
 
+    @metrics.CHECK_QUIZ_ANSWERS_DURATION.time()
     def check_quiz_answers(self, chosen_answers, normalize=True):
         """TODO - See what the format of receiving the answers is.
         For each chosen answer per a given question, check if the answer is correct.
@@ -391,142 +499,343 @@ class Quiz(UUIDAndTimeStampAbstract):
         "no_of_correct_answers": 3,
         "no_of_wrong_answers": 2,
         "score": 0.6,
+        "uuid": <quiz_attempt_uuid>,
         "id": <quiz_attempt_id>
         }
 
+        With ATTEMPT_BUFFER_SIZE set, the attempt is inserted later, and has no id until then (see QuizAttempt.record).
+
         If normalize=True, each question will be worth 1 point. The points and penalty for each question will be
         normalized accordingly. This is the method that Dynatrace uses to score its quizzes.
         """
+        # Adds the time spent in each phase to the Server-Timing header (see quiz/instrumentation.py).
+        phases = PhaseTimer('check_quiz_answers')
         questions = self.quiz['questions']
-        no_of_correct_answers = 0
-        no_of_wrong_answers = 0
-
-        # The total possible score will be the total of all the number of correct answers.
-        possible_points = 0
-
-        # The total score for the quiz.
-        # Answering a radio question correctly gives 1 / 1 points. Answering wrongly gives 0 points.
-        # Choosing a wrong checkbox question answer will subtract 1 from the points that were scored for that question
-        #  with a minimum of 0 points.
-        total_points_scored = 0
-
-        # For "questions": [{...}, {...}]... (See docstring)
-        attempt_dict_questions_list = []
-        for question, chosen_answer_set in zip(questions, chosen_answers):
-            question_text = question['question_text']
-            question_type = question['question_type']
-            question_model = Question.objects.get(creator=self.creator, text=question_text)
-            original_choice_list = question['choices']
-
-            # To be passed as a dict into the attempt_dict_questions_list.
-            updated_dict_question = {'question_text': question_text,
-                                     'question_type': question_type,
-                                     'choices': [],
-                                     }
-
-            # Start the score counter at 0.
-
-            # The total question points without deduction
-            question_points_before_penalty = 0
-
-            # The total penalty.
-            penalty = 0
-
-            # The score will be the question_points - penalty with a minimum of 0.
-            question_points_scored = 0
-            possible_question_points = 0
-            for choice in original_choice_list:
-                choice_text = choice
-                chosen = choice_text in chosen_answer_set
-                is_correct = question_model.is_right_answer(choice_text)
-                updated_dict_question['choices'].append({
-                    'choice_text': choice_text,
-                    'chosen': chosen,
-                    'correct': is_correct,
-                    # We will also add the number of points scored per question and the possible number of points per
-                    #  question
-                })
-                if is_correct:
-                    # The possible score will increase per answer that is correct (though not necessarily chosen).
-                    possible_question_points += 1
-
-                if is_correct and chosen:
-                    # If the correct answer was chosen, add to the score.
-                    no_of_correct_answers += 1
-                    question_points_before_penalty += 1
-                elif is_correct and not chosen:
-                    # Otherwise, if the correct answer was not chosen, add to the no of wrong (unchosen) answers.
-                    no_of_wrong_answers += 1
-                elif not is_correct and chosen:
-                    # However, if the wrong answer is chosen, penalize for choosing the wrong answer for checkbox type
-                    #  questions to disincentivize clicking all the checkboxes.
-                    if question_type == 'checkbox':
-                        penalty += 1
-            # Reset question score to 0 if it falls below 0.
-            question_points_scored = question_points_before_penalty - penalty \
-                if (question_points_before_penalty - penalty) >= 0 else 0
-
-            if normalize:
-                # The score to be added will be divided by the possible_question_points. E.g. if we have 2 out of 3
-                #  points, then we will divide by 3, so that the final score for this question is 0.66 out of 1 points.
-                normalize_factor = possible_question_points
-
-                # Update values with normalize_factor.
-                question_points_scored /= normalize_factor
-                possible_question_points = 1
-                question_points_before_penalty /= normalize_factor
-                penalty /= normalize_factor
-
-            # Add the possible question score to the possible quiz score.
-            possible_points += possible_question_points
-            # Add the question score to the total score
-            total_points_scored += question_points_scored
-
-            updated_dict_question.update({
-                'question_points_scored': question_points_scored,
-                'possible_question_points': possible_question_points,
-                'question_points_before_penalty': question_points_before_penalty,
-                'penalty': penalty
-            })
-            attempt_dict_questions_list.append(updated_dict_question)
-
-        # The final score (which can be multiplied by 100% for percentage) is the total score divided by the possible
-        #  quiz score.
-        score = total_points_scored / possible_points
-
-        quiz_attempt = {
-            "topic_id": self.quiz["topic"],
-            "topic_name": self.quiz["topic_name"],
-            "questions": attempt_dict_questions_list,
-            "no_of_correct_answers": no_of_correct_answers,
-            "no_of_wrong_answers": no_of_wrong_answers,
-            "score": score,
-            "total_points_scored": total_points_scored,
-            "possible_points": possible_points
-        }
 
-        quiz_attempt_object = QuizAttempt.objects.create(quiz=self, quiz_attempt=quiz_attempt, score=score)
-        # Add in the quiz_attempt id to the quiz_attempt dictionary.
-        quiz_attempt_object.quiz_attempt['id'] = quiz_attempt_object.id
-        quiz_attempt_object.save()
+        # Get all the questions of the quiz with their correct answers at once, instead of once per question and
+        #  once per choice.
+        question_models = {
+            question_model.text: question_model for question_model in Question.objects.filter(
+                creator=self.creator, text__in=[question['question_text'] for question in questions]
+            ).prefetch_related('answers')
+        }
+        correct_answer_texts_by_question = {}
+        for question in questions:
+            try:
+                question_model = question_models[question['question_text']]
+            except KeyError:
+                # The question was deleted or renamed after the quiz was generated.
+                raise Question.DoesNotExist(f"Question matching '{question['question_text']}' does not exist.")
+            correct_answer_texts_by_question[question_model.text] = set(question_model.list_of_answer_text)
+        phases.lap('load')
+
+        quiz_attempt = grade_quiz_answers(self.quiz, chosen_answers, correct_answer_texts_by_question,
+                                          normalize=normalize)
+        score = quiz_attempt['score']
+        phases.lap('grade')
+
+        quiz_attempt_object = QuizAttempt(quiz=self, user_id=self.creator_id, topic_id=self.topic_id,
+                                          quiz_attempt=quiz_attempt, score=score)
+        quiz_attempt['uuid'] = str(quiz_attempt_object.uuid)
+        quiz_attempt_object.record({text: question_model.id for text, question_model in question_models.items()})
+        phases.lap('persist')
         return quiz_attempt_object
 
     class Meta:
         verbose_name = "Quiz"
         verbose_name_plural = "Quizzes"
         default_related_name = "quizzes"
+        indexes = [
+            # The history of the user's quizzes, newest first.
+            models.Index(fields=['creator', 'id'], name='quiz_creator_id'),
+        ]
 
 
 class QuizAttempt(UUIDAndTimeStampAbstract):
-    """Saves the attempts at a quiz."""
+    """
+    Saves the attempts at a quiz.
+
+    The user and topic are copies of the creator and topic of the quiz, so that the leaderboards (see
+    quiz/leaderboards.py) can rank the attempts with the indexes below instead of joining the quizzes. Like those of
+    Quiz, the topic name and number of questions are copied out of the quiz attempt when it is saved, for the history
+    of the user's attempts (see QuizAttemptHistoryAPIView).
+    """
     quiz = models.ForeignKey(Quiz, verbose_name="Quiz", on_delete=models.SET_NULL, related_name="quiz_attempts", blank=True,
                              null=True)
+    # Not indexed on their own, as the indexes in Meta start with them.
+    user = models.ForeignKey(User, verbose_name="User", related_name="quiz_attempts", on_delete=models.CASCADE,
+                             null=True, blank=True, editable=False, db_index=False)
+    topic = models.ForeignKey(Topic, verbose_name="Topic", related_name="quiz_attempts", on_delete=models.SET_NULL,
+                              null=True, blank=True, editable=False, db_index=False)
     quiz_attempt = PickledObjectField(verbose_name="Quiz Attempt", editable=False)
     score = models.FloatField(verbose_name="Score")
 
+    # Summary of the quiz attempt, kept even if the topic is renamed or deleted.
+    topic_name = models.CharField(max_length=256, verbose_name="Topic Name", blank=True, default="", editable=False)
+    no_of_questions = models.PositiveIntegerField(verbose_name="Number of Questions", default=0, editable=False)
+
+    # Not saved: maps the question texts to the ids of the questions, for the question weights (see record).
+    question_ids = None
+
+    def summarize(self):
+        """Copy the summary columns out of the quiz attempt. Called by save, but not by bulk_create."""
+        self.topic_name = self.quiz_attempt.get('topic_name', '')
+        self.no_of_questions = len(self.quiz_attempt.get('questions', ()))
+
+    def save(self, *args, **kwargs):
+        # Not when the payload was deferred, which would load it.
+        if 'quiz_attempt' not in self.get_deferred_fields() and self.quiz_attempt is not None:
+            self.summarize()
+        return super().save(*args, **kwargs)
+
+    def record(self, question_ids=None):
+        """
+        Save a new attempt with its id in its payload, and update the question weights (see
+        QuestionWeight.update_from_attempts) of the questions in question_ids, which maps the question texts to the ids
+        of the questions. With ATTEMPT_BUFFER_SIZE set, add it to the write-behind buffer instead, which inserts it and
+        updates the weights with other attempts shortly after (see quiz/attempt_buffer.py).
+        """
+        self.question_ids = question_ids
+        buffer = attempt_buffer.get_buffer()
+        if buffer is not None:
+            self.summarize()
+            buffer.add(self)
+            return
+        self.save()
+        # Add in the quiz_attempt id to the quiz_attempt dictionary.
+        self.quiz_attempt['id'] = self.id
+        self.save()
+        QuestionWeight.update_from_attempts([self.graded()])
+
+    def graded(self):
+        """Returns the (user id, question ids, quiz attempt) of the attempt, for QuestionWeight.update_from_attempts."""
+        return self.user_id, self.question_ids or {}, self.quiz_attempt
+
     class Meta:
         verbose_name = "Quiz Attempt"
         verbose_name_plural = "Quiz Attempts"
         default_related_name = "quiz_attempts"
+        indexes = [
+            # Best score per user of a topic, and of all topics (answered from the indexes alone).
+            models.Index(fields=['topic', 'user', 'score'], name='quizattempt_topic_user_score'),
+            models.Index(fields=['user', 'score'], name='quizattempt_user_score'),
+            # Percentile of a score among the attempts of a topic, and among all attempts.
+            models.Index(fields=['topic', 'score'], name='quizattempt_topic_score'),
+            models.Index(fields=['score'], name='quizattempt_score'),
+            # The history of the user's attempts, newest first.
+            models.Index(fields=['user', 'id'], name='quizattempt_user_id'),
+        ]
+
+
+
+
+class QuestionWeight(models.Model):
+    """
+    How often the adaptive quizzes should ask a user a question, relative to the other questions (see
+    quiz/sampling.py). There is no row for the questions the user has never answered, which have the default weight.
+    """
+    user = models.ForeignKey(User, verbose_name="User", on_delete=models.CASCADE)
+    question = models.ForeignKey(Question, verbose_name="Question", on_delete=models.CASCADE)
+    weight = models.FloatField(verbose_name="Weight", default=sampling.DEFAULT_WEIGHT)
+    answered_at = models.DateTimeField(verbose_name="Last Answered At")
+
+    @classmethod
+    def update_from_attempts(cls, graded_attempts):
+        """
+        Update the weights of the questions of graded quiz attempts (see Quiz.check_quiz_answers), in order, and mark
+        the alias tables of the topics of these questions as out of date. graded_attempts is a list of (user id,
+        question ids, quiz attempt), where the question ids map the question texts to the ids of the questions.
+
+        Only the weights of the questions of the topics that the user has adaptive quizzes of (the topics with a
+        QuestionSampler) are kept, so that grading the attempts of the other users costs one query. The weights of the
+        questions of a topic start from the default when its first adaptive quiz is generated. The questions deleted
+        since the attempt was graded are left out.
+        """
+        fractions_correct = []
+        question_ids_by_user = defaultdict(set)
+        for user_id, question_ids, quiz_attempt in graded_attempts:
+            for question in quiz_attempt['questions']:
+                question_id = question_ids.get(question['question_text'])
+                if question_id is None:
+                    continue
+                possible_points = question['possible_question_points']
+                fractions_correct.append((user_id, question_id, (
+                    question['question_points_scored'] / possible_points if possible_points else 0.0)))
+                question_ids_by_user[user_id].add(question_id)
+        if not fractions_correct:
+            return
+
+        samplers = list(QuestionSampler.objects.filter(functools.reduce(operator.or_, (
+            models.Q(user_id=user_id, topic__questions__in=question_ids)
+            for user_id, question_ids in question_ids_by_user.items()
+        ))).values_list('id', 'user_id', 'topic__questions'))
+        if not samplers:
+            return
+        sampled_question_ids_by_user = defaultdict(set)
+        for _, user_id, question_id in samplers:
+            sampled_question_ids_by_user[user_id].add(question_id)
+
+        now = timezone.now()
+        with transaction.atomic():
+            # The questions answered for the first time, unless a concurrent attempt inserted their weights first.
+            cls.objects.bulk_create((
+                cls(user_id=user_id, question_id=question_id, answered_at=now)
+                for user_id, question_ids in sampled_question_ids_by_user.items() for question_id in question_ids
+            ), ignore_conflicts=True)
+            weights = cls.objects.select_for_update().filter(functools.reduce(operator.or_, (
+                models.Q(user_id=user_id, question_id__in=question_ids)
+                for user_id, question_ids in sampled_question_ids_by_user.items()
+            ))).order_by('id')
+            weights = {(weight.user_id, weight.question_id): weight for weight in weights}
+            for user_id, question_id, fraction_correct in fractions_correct:
+                weight = weights.get((user_id, question_id))
+                if weight is None:
+                    # Not in a sampled topic.
+                    continue
+                current = sampling.effective_weight(weight.weight, weight.answered_at, now)
+                weight.weight = sampling.next_weight(current, fraction_correct)
+                weight.answered_at = now
+            cls.objects.bulk_update(weights.values(), ['weight', 'answered_at'])
+            QuestionSampler.objects.filter(id__in={sampler_id for sampler_id, _, _ in samplers}).update(stale=True)
+
+    class Meta:
+        verbose_name = "Question Weight"
+        verbose_name_plural = "Question Weights"
+        default_related_name = "question_weights"
+        unique_together = [["user", "question"]]
+
 
+class QuestionSampler(models.Model):
+    """
+    The alias table (see quiz.sampling.AliasTable) over the questions of a topic for a user, built from the user's
+    question weights. It is rebuilt when it is used after the weights changed (stale), when questions were added to or
+    removed from the topic, or after SAMPLER_MAX_AGE (so that the weights recover over time).
+    """
+    SAMPLER_MAX_AGE = sampling.RECOVERY_PERIOD / 7
+
+    user = models.ForeignKey(User, verbose_name="User", on_delete=models.CASCADE)
+    topic = models.ForeignKey(Topic, verbose_name="Topic", on_delete=models.CASCADE)
+    # The question ids, weights, probabilities and aliases are lists in the same order.
+    question_ids = PickledObjectField(verbose_name="Question IDs", editable=False)
+    weights = PickledObjectField(verbose_name="Weights", editable=False)
+    probabilities = PickledObjectField(verbose_name="Probabilities", editable=False)
+    aliases = PickledObjectField(verbose_name="Aliases", editable=False)
+    stale = models.BooleanField(verbose_name="Stale", default=False)
+    built_at = models.DateTimeField(verbose_name="Built At")
+
+    @classmethod
+    def build(cls, topic, now, sampler=None):
+        """
+        Build the alias table of the topic for its creator from their question weights, and save it (in sampler, if
+        the topic already has one).
+        """
+        question_ids = list(topic.questions.order_by('id').values_list('id', flat=True))
+        weights_by_question = {
+            question_id: sampling.effective_weight(weight, answered_at, now)
+            for question_id, weight, answered_at in QuestionWeight.objects.filter(
+                user_id=topic.creator_id, question_id__in=question_ids,
+            ).values_list('question_id', 'weight', 'answered_at')
+        }
+        weights = [weights_by_question.get(question_id, sampling.DEFAULT_WEIGHT) for question_id in question_ids]
+        table = sampling.AliasTable.build(weights)
+        sampler = sampler or cls(user_id=topic.creator_id, topic=topic)
+        sampler.question_ids = question_ids
+        sampler.weights = weights
+        sampler.probabilities = table.probabilities
+        sampler.aliases = table.aliases
+        sampler.stale = False
+        sampler.built_at = now
+        sampler.save()
+        return sampler
+
+    def needs_rebuild(self, no_of_questions, now):
+        return self.stale or len(self.question_ids) != no_of_questions or now - self.built_at > self.SAMPLER_MAX_AGE
+
+    def alias_table(self):
+        return sampling.AliasTable(self.probabilities, self.aliases)
+
+    class Meta:
+        verbose_name = "Question Sampler"
+        verbose_name_plural = "Question Samplers"
+        default_related_name = "question_samplers"
+        unique_together = [["user", "topic"]]
+
+
+class QuestionRotation(models.Model):
+    """
+    The questions of a topic that a user has been served in the current round of the rotation quizzes, as a bitset
+    over the index of the questions of the topic (bit i is set once question_ids[i] has been served, see
+    quiz/sampling.py). When every bit is set, the bitset is cleared and a new round starts.
 
+    The index is rebuilt when questions were added to or removed from the topic, keeping the bits of the questions
+    that are still in it.
+    """
+    user = models.ForeignKey(User, verbose_name="User", on_delete=models.CASCADE)
+    topic = models.ForeignKey(Topic, verbose_name="Topic", on_delete=models.CASCADE)
+    question_ids = PickledObjectField(verbose_name="Question IDs", editable=False)
+    seen = models.BinaryField(verbose_name="Seen Questions", default=b'')
+    updated_at = models.DateTimeField(verbose_name="Updated At", auto_now=True)
+
+    def reindex(self, question_ids):
+        """Replace the index with the given question ids, keeping the bits of the questions that are still in it."""
+        question_ids = list(question_ids)
+        old_seen = bytes(self.seen)
+        old_indexes = {question_id: index for index, question_id in enumerate(self.question_ids)}
+        seen_indexes = [index for index, question_id in enumerate(question_ids)
+                        if question_id in old_indexes and sampling.is_seen(old_seen, old_indexes[question_id])]
+        self.question_ids = question_ids
+        self.seen = sampling.mark_seen(b'', seen_indexes, len(question_ids))
+
+    def seen_count(self):
+        return sampling.count_seen(bytes(self.seen))
+
+    class Meta:
+        verbose_name = "Question Rotation"
+        verbose_name_plural = "Question Rotations"
+        default_related_name = "question_rotations"
+        unique_together = [["user", "topic"]]
+
+
+class RegradeJob(models.Model):
+    """
+    Grades the attempts of a user again after the answer keys of some of their questions changed (see
+    quiz/regrading.py). Only the attempts at the topics of these questions, up to the last one at the time the job was
+    created, are regraded: the later ones were graded with the new answer keys.
+
+    The attempts are regraded in batches in order of their ids, and last_attempt_id is saved after every batch, so
+    that an interrupted job resumes after the last batch it finished.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = [(PENDING, "Pending"), (RUNNING, "Running"), (DONE, "Done"), (FAILED, "Failed")]
+
+    user = models.ForeignKey(User, verbose_name="User", on_delete=models.CASCADE)
+    question_ids = PickledObjectField(verbose_name="Question IDs", editable=False)
+    topic_ids = PickledObjectField(verbose_name="Topic IDs", editable=False)
+    max_attempt_id = models.PositiveIntegerField(verbose_name="Last Attempt ID")
+    status = models.CharField(verbose_name="Status", max_length=16, choices=STATUSES, default=PENDING)
+    # Progress: the attempts up to last_attempt_id are done.
+    last_attempt_id = models.PositiveIntegerField(verbose_name="Last Regraded Attempt ID", default=0)
+    total = models.PositiveIntegerField(verbose_name="Attempts To Check", default=0)
+    processed = models.PositiveIntegerField(verbose_name="Attempts Checked", default=0)
+    regraded = models.PositiveIntegerField(verbose_name="Attempts Regraded", default=0)
+    error = models.TextField(verbose_name="Error", blank=True, default="")
+    created_at = models.DateTimeField(verbose_name="Created At", auto_now_add=True)
+    updated_at = models.DateTimeField(verbose_name="Updated At", auto_now=True)
+    finished_at = models.DateTimeField(verbose_name="Finished At", null=True, blank=True)
+
+    def attempts(self):
+        """Returns the attempts that the job checks, including the ones already done."""
+        return QuizAttempt.objects.filter(user_id=self.user_id, topic_id__in=self.topic_ids,
+                                          id__lte=self.max_attempt_id)
+
+    class Meta:
+        verbose_name = "Regrade Job"
+        verbose_name_plural = "Regrade Jobs"
+        default_related_name = "regrade_jobs"
+        indexes = [
+            # The unfinished jobs, to resume them.
+            models.Index(fields=['status'], name='regradejob_status'),
+        ]
@@ -0,0 +1,148 @@
+"""
+On-demand profiling of single requests.
+
+ProfilingMiddleware (see quiz/middleware.py) runs the requests of staff users that ask for it (with an 'X-Profile: 1'
+header or a profile=1 query parameter) under two profilers at once:
+
+    - cProfile, which records every function call: saved as a .pstats file, to open with pstats, snakeviz, etc.
+    - a StackSampler, which samples the stack of the request's thread every PROFILE_SAMPLE_INTERVAL seconds: saved as
+      collapsed stacks (one 'outer;...;inner count' line per stack), to open with flamegraph.pl, speedscope, etc.
+
+Both files are saved in PROFILE_DIR, along with the route, user, method, path, status and duration of the request, and
+the id of the profile is sent back in an X-Profile-Id header. They can be listed and downloaded at
+/api/performance/profiles/ (staff only). Only the last PROFILE_KEEP profiles are kept. PROFILE_DIR is shared by the
+worker processes if they run on the same machine.
+
+The other requests are not profiled at all: they only pay for checking the header and query parameter.
+"""
+import cProfile
+import json
+import re
+import sys
+import threading
+import uuid
+from collections import Counter
+from pathlib import Path
+
+from django.conf import settings
+from django.utils import timezone
+
+# The files saved for every profile, by the name of their kind.
+ARTIFACTS = {
+    'pstats': '.pstats',
+    'collapsed': '.collapsed',
+}
+_PROFILE_ID = re.compile(r'^[0-9a-f]{32}$')
+
+
+def _stack(frame):
+    """Returns the stack of the frame in the collapsed format, outermost function first: 'module:function;...'."""
+    functions = []
+    while frame is not None:
+        functions.append(f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_name}")
+        frame = frame.f_back
+    return ';'.join(reversed(functions))
+
+
+class StackSampler:
+    """Counts the stacks of a thread, sampled every `interval` seconds by a background thread."""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[_stack(frame)] += 1
+            # Not kept alive until the next sample.
+            del frame
+
+    def collapsed(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+
+def profile(func, *args):
+    """Call func under cProfile and a StackSampler of this thread. Returns its result, the profiler and the sampler."""
+    profiler = cProfile.Profile()
+    sampler = StackSampler(threading.get_ident(), settings.PROFILE_SAMPLE_INTERVAL)
+    sampler.start()
+    profiler.enable()
+    try:
+        result = func(*args)
+    finally:
+        profiler.disable()
+        sampler.stop()
+    return result, profiler, sampler
+
+
+def save(profiler, sampler, **info):
+    """
+    Save the profile and the sampled stacks in PROFILE_DIR, along with the info given (e.g. route and user), and delete
+    the oldest profiles beyond PROFILE_KEEP. Returns the info of the profile, with its id.
+    """
+    directory = Path(settings.PROFILE_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    profile_id = uuid.uuid4().hex
+    profiler.dump_stats(directory / f'{profile_id}.pstats')
+    (directory / f'{profile_id}.collapsed').write_text(sampler.collapsed())
+    info = {
+        'id': profile_id,
+        **info,
+        'samples': sum(sampler.stacks.values()),
+        'created_at': timezone.now().isoformat(),
+    }
+    # Written last, as the profiles are listed by their info.
+    (directory / f'{profile_id}.json').write_text(json.dumps(info))
+    prune(directory, settings.PROFILE_KEEP)
+    return info
+
+
+def _info_paths(directory):
+    """The info files of the profiles in the directory, oldest first."""
+    paths = []
+    for path in Path(directory).glob('*.json'):
+        try:
+            paths.append((path.stat().st_mtime_ns, path))
+        except FileNotFoundError:
+            # Deleted by another process in the meantime.
+            continue
+    return [path for _, path in sorted(paths)]
+
+
+def prune(directory, keep):
+    """Delete the files of the oldest profiles, so that only `keep` are left."""
+    paths = _info_paths(directory)
+    for path in paths[:max(0, len(paths) - keep)]:
+        for suffix in ('.json', *ARTIFACTS.values()):
+            path.with_suffix(suffix).unlink(missing_ok=True)
+
+
+def list_profiles():
+    """Returns the info of the profiles in PROFILE_DIR, newest first."""
+    profiles = []
+    for path in reversed(_info_paths(settings.PROFILE_DIR)):
+        try:
+            profiles.append(json.loads(path.read_text()))
+        except (FileNotFoundError, ValueError):
+            continue
+    return profiles
+
+
+def artifact_path(profile_id, kind):
+    """Returns the path of the file of the given kind (see ARTIFACTS) of the profile, or None if there is none."""
+    if kind not in ARTIFACTS or not _PROFILE_ID.match(profile_id):
+        return None
+    path = Path(settings.PROFILE_DIR, profile_id + ARTIFACTS[kind])
+    return path if path.is_file() else None
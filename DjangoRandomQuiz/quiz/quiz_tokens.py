@@ -0,0 +1,97 @@
+"""
+Stateless quizzes: instead of saving the generated quiz, the quiz and its answer key are sent to the client in a token,
+which the client sends back with its answers. Generating a stateless quiz writes nothing to the database (apart from
+the state of the adaptive and rotation quizzes), and only the attempts are saved.
+
+A token is the quiz, the texts of the correct choices of every question, the ids of the questions and the id of the
+user, as compressed JSON, encrypted (so that the client cannot read the answer key) and then signed with a timestamp
+with django.core.signing (so that the client cannot change it, and it expires after QUIZ_TOKEN_MAX_AGE seconds). The
+cipher is a SHAKE-256 keystream over a key derived from SECRET_KEY and a random nonce, as the standard library has no
+block cipher. Changing SECRET_KEY invalidates every token, so it must be set when there are several worker processes
+(each process would otherwise pick its own random one).
+
+An attempt at a stateless quiz is graded with the answer key of the token, i.e. with the correct answers at the time
+the quiz was generated, not when it was attempted.
+"""
+import base64
+import hashlib
+import os
+import zlib
+
+import orjson
+from django.conf import settings
+from django.core import signing
+from django.utils.crypto import salted_hmac
+
+from quiz import metrics
+from quiz.grading import grade_quiz_answers
+from quiz.models import QuizAttempt, Topic
+
+SALT = 'quiz.quiz_tokens'
+NONCE_SIZE = 16
+
+
+def _keystream(nonce, length):
+    key = salted_hmac(SALT + '.encryption', 'key', algorithm='sha256').digest()
+    return hashlib.shake_256(key + nonce).digest(length)
+
+
+def _xor(data, keystream):
+    return (int.from_bytes(data, 'big') ^ int.from_bytes(keystream, 'big')).to_bytes(len(data), 'big')
+
+
+def _signer():
+    return signing.TimestampSigner(salt=SALT, algorithm='sha256')
+
+
+def dumps(quiz_object, user):
+    """Returns the token of a quiz generated with Topic.generate_quiz(save=False) for the user."""
+    quiz = quiz_object.quiz
+    payload = {
+        'user': user.id,
+        'quiz': quiz,
+        'answer_key': [sorted(quiz_object.answer_key[question['question_text']]) for question in quiz['questions']],
+        'question_ids': [quiz_object.question_ids[question['question_text']] for question in quiz['questions']],
+    }
+    data = zlib.compress(orjson.dumps(payload))
+    nonce = os.urandom(NONCE_SIZE)
+    value = base64.urlsafe_b64encode(nonce + _xor(data, _keystream(nonce, len(data)))).rstrip(b'=').decode()
+    return _signer().sign(value)
+
+
+def loads(token, user):
+    """
+    Returns the payload of a token of the user (see dumps). Raises signing.BadSignature if the token was changed or is
+    of another user, and signing.SignatureExpired (a BadSignature) if it is older than QUIZ_TOKEN_MAX_AGE.
+    """
+    value = _signer().unsign(token, max_age=settings.QUIZ_TOKEN_MAX_AGE)
+    encrypted = base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+    nonce, data = encrypted[:NONCE_SIZE], encrypted[NONCE_SIZE:]
+    payload = orjson.loads(zlib.decompress(_xor(data, _keystream(nonce, len(data)))))
+    if payload['user'] != user.id:
+        raise signing.BadSignature("The quiz token is of another user.")
+    return payload
+
+
+@metrics.CHECK_QUIZ_ANSWERS_DURATION.time()
+def check_answers(token, chosen_answers, user, normalize=True):
+    """
+    Grade the chosen answers to the quiz of the token (see Quiz.check_quiz_answers for the format) and save the quiz
+    attempt, without a quiz. Raises signing.BadSignature if the token is not valid (see loads).
+    """
+    payload = loads(token, user)
+    quiz = payload['quiz']
+    correct_answer_texts_by_question = {question['question_text']: set(answer_key)
+                                        for question, answer_key in zip(quiz['questions'], payload['answer_key'])}
+    quiz_attempt = grade_quiz_answers(quiz, chosen_answers, correct_answer_texts_by_question, normalize=normalize)
+
+    # The topic may have been deleted since the quiz was generated. So may the questions, whose weights are then left
+    #  out (see QuestionWeight.update_from_attempts).
+    topic_id = quiz['topic'] if Topic.objects.filter(id=quiz['topic'], creator=user).exists() else None
+
+    quiz_attempt_object = QuizAttempt(user=user, topic_id=topic_id, quiz_attempt=quiz_attempt,
+                                      score=quiz_attempt['score'])
+    quiz_attempt['uuid'] = str(quiz_attempt_object.uuid)
+    quiz_attempt_object.record({question['question_text']: question_id
+                                for question, question_id in zip(quiz['questions'], payload['question_ids'])})
+    return quiz_attempt_object
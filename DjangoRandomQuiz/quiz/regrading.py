@@ -0,0 +1,168 @@
+"""
+Regrading of the quiz attempts after the answer keys of questions changed (e.g. a wrong answer made correct through
+AnswerAPIView).
+
+schedule creates a RegradeJob for the attempts of the user at the topics of the changed questions, and runs it in the
+background once the change is committed. run_job goes through these attempts in batches of REGRADE_BATCH_SIZE, in
+order of their ids, with REGRADE_WORKERS threads: every batch loads its attempts, regrades the ones that asked one of
+the changed questions from the choices they keep (see grading.regrade_quiz_attempt), and saves the new payloads and
+scores with one bulk update. The job saves its progress after every batch, in order, so an interrupted job (e.g. by a
+restart) resumes after the last batch it finished: see the regrade command. Regrading an attempt twice gives the same
+result, so batches that were done but not recorded yet are simply done again.
+
+The leaderboards read the scores of the attempts, so they show the new scores as well (after
+LEADERBOARD_CACHE_TIMEOUT, if they are cached).
+"""
+import logging
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Count, Max
+from django.utils import timezone
+
+from quiz.grading import regrade_quiz_attempt
+from quiz.models import Question, QuizAttempt, RegradeJob
+
+logger = logging.getLogger(__name__)
+
+# Runs the jobs scheduled by the API, one at a time (every job has its own pool of REGRADE_WORKERS threads).
+job_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='regrade-job')
+
+
+def schedule(user, question_ids, run=True):
+    """
+    Create a job to regrade the user's attempts at the topics of the questions, and, if run, run it in the background
+    after the current transaction is committed. Returns the job, or None if there are no attempts to regrade.
+    """
+    question_ids = sorted(set(question_ids))
+    if not question_ids:
+        return None
+    topic_ids = sorted(set(Question.topic.through.objects.filter(question_id__in=question_ids)
+                           .values_list('topic_id', flat=True)))
+    attempts = QuizAttempt.objects.filter(user=user, topic_id__in=topic_ids).aggregate(max_id=Max('id'),
+                                                                                        total=Count('id'))
+    if not attempts['total']:
+        return None
+    job = RegradeJob.objects.create(user=user, question_ids=question_ids, topic_ids=topic_ids,
+                                    max_attempt_id=attempts['max_id'], total=attempts['total'])
+    if run:
+        transaction.on_commit(lambda: job_executor.submit(_run_in_background, job.id))
+    return job
+
+
+def _run_in_background(job_id):
+    close_old_connections()
+    try:
+        run_job(job_id)
+    except Exception:
+        logger.exception("Regrade job %s failed", job_id)
+    finally:
+        close_old_connections()
+
+
+def regrade_batch(user_id, question_texts, attempt_ids):
+    """
+    Regrade the attempts with one of the questions, among the attempts with the given ids, and save the ones whose
+    grading changed. Returns the number of attempts saved.
+    """
+    attempts = [attempt for attempt in QuizAttempt.objects.filter(id__in=attempt_ids).only('id', 'quiz_attempt', 'score')
+                if any(question['question_text'] in question_texts
+                       for question in attempt.quiz_attempt.get('questions', ()))]
+    if not attempts:
+        return 0
+
+    texts = {question['question_text'] for attempt in attempts for question in attempt.quiz_attempt['questions']}
+    correct_answer_texts_by_question = {
+        question.text: set(question.list_of_answer_text)
+        for question in Question.objects.filter(creator_id=user_id, text__in=texts).prefetch_related('answers')
+    }
+    changed = []
+    for attempt in attempts:
+        quiz_attempt = regrade_quiz_attempt(attempt.quiz_attempt, correct_answer_texts_by_question)
+        if quiz_attempt != attempt.quiz_attempt:
+            attempt.quiz_attempt = quiz_attempt
+            attempt.score = quiz_attempt['score']
+            changed.append(attempt)
+    QuizAttempt.objects.bulk_update(changed, ['quiz_attempt', 'score'])
+    return len(changed)
+
+
+def _regrade_batch_in_worker(*args):
+    """Runs in a thread of the pool of a job. Close the thread's connection afterwards."""
+    try:
+        return regrade_batch(*args)
+    finally:
+        close_old_connections()
+
+
+def _run_now(func, *args):
+    """Run func in this thread, for jobs without workers. Returns a Future with the result, as an executor would."""
+    future = Future()
+    try:
+        future.set_result(func(*args))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+def run_job(job_id, workers=None, batch_size=None, progress=None):
+    """
+    Run (or resume) the regrade job, with workers threads (REGRADE_WORKERS by default, 0 to regrade in this thread)
+    and batch_size attempts per batch (REGRADE_BATCH_SIZE by default). progress is called with the job after every
+    batch. Returns the job.
+    """
+    workers = settings.REGRADE_WORKERS if workers is None else workers
+    batch_size = batch_size or settings.REGRADE_BATCH_SIZE
+    job = RegradeJob.objects.get(id=job_id)
+    if job.status == RegradeJob.DONE:
+        return job
+    job.status = RegradeJob.RUNNING
+    job.error = ""
+    job.save(update_fields=['status', 'error', 'updated_at'])
+
+    question_texts = set(Question.objects.filter(id__in=job.question_ids).values_list('text', flat=True))
+    attempts = job.attempts().order_by('id').values_list('id', flat=True)
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='regrade') if workers else None
+    # The batches being regraded, oldest first: (last attempt id, number of attempts, future).
+    in_flight = deque()
+
+    def finish_oldest_batch():
+        last_attempt_id, no_of_attempts, future = in_flight.popleft()
+        job.regraded += future.result()
+        job.processed += no_of_attempts
+        job.last_attempt_id = last_attempt_id
+        job.save(update_fields=['regraded', 'processed', 'last_attempt_id', 'updated_at'])
+        if progress is not None:
+            progress(job)
+
+    try:
+        last_attempt_id = job.last_attempt_id
+        while True:
+            # Keyset pagination over the index on (user, id), so every batch costs the same.
+            attempt_ids = list(attempts.filter(id__gt=last_attempt_id)[:batch_size])
+            if not attempt_ids:
+                break
+            last_attempt_id = attempt_ids[-1]
+            args = (job.user_id, question_texts, attempt_ids)
+            future = executor.submit(_regrade_batch_in_worker, *args) if executor else _run_now(regrade_batch, *args)
+            in_flight.append((last_attempt_id, len(attempt_ids), future))
+            # Keep every worker busy, without loading the ids of every attempt up front.
+            while len(in_flight) > workers:
+                finish_oldest_batch()
+        while in_flight:
+            finish_oldest_batch()
+    except Exception as e:
+        job.status = RegradeJob.FAILED
+        job.error = repr(e)
+        job.save(update_fields=['status', 'error', 'updated_at'])
+        raise
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    job.status = RegradeJob.DONE
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'finished_at', 'updated_at'])
+    return job
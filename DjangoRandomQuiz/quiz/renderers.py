@@ -0,0 +1,86 @@
+"""
+Renderers and parsers used for content negotiation on the API.
+
+DRF's own JSONRenderer goes through the standard library json module, which is slow for the large quiz and attempt
+payloads. The ORJSONRenderer produces the same JSON (media type application/json) using orjson, and the MessagePack
+renderer and parser allow clients to send and receive a binary encoding instead by setting the Accept and
+Content-Type headers to application/msgpack.
+
+See https://www.django-rest-framework.org/api-guide/renderers/#custom-renderers
+"""
+import msgpack
+import orjson
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+from quiz.instrumentation import timed
+
+
+# DRF's encoder knows how to turn lazy strings, querysets, decimals, etc. into something that can be serialized. We
+#  only fall back to it for types that orjson and msgpack do not support natively.
+_drf_encoder = JSONEncoder()
+
+
+def _default(obj):
+    return _drf_encoder.default(obj)
+
+
+class ORJSONRenderer(BaseRenderer):
+    """Renders JSON with orjson. Drop-in replacement for rest_framework.renderers.JSONRenderer."""
+    media_type = 'application/json'
+    format = 'json'
+    # orjson always returns utf-8 encoded bytes.
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        renderer_context = renderer_context or {}
+        option = 0
+        # The browsable API asks for indented JSON by passing in an indent in the renderer context. orjson only
+        #  supports an indent of 2, which is close enough.
+        if renderer_context.get('indent') or 'indent=' in (accepted_media_type or ''):
+            option |= orjson.OPT_INDENT_2
+        with timed('serialize'):
+            return orjson.dumps(data, default=_default, option=option)
+
+
+class ORJSONParser(BaseParser):
+    """Parses JSON request bodies with orjson. Drop-in replacement for rest_framework.parsers.JSONParser."""
+    media_type = 'application/json'
+    renderer_class = ORJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
+
+
+class MessagePackRenderer(BaseRenderer):
+    """Renders the response as MessagePack. Clients must send 'Accept: application/msgpack' to get this renderer."""
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    # Tells the browsable API not to try to display the content as text.
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        with timed('serialize'):
+            return msgpack.packb(data, default=_default, use_bin_type=True)
+
+
+class MessagePackParser(BaseParser):
+    """Parses request bodies sent with 'Content-Type: application/msgpack'."""
+    media_type = 'application/msgpack'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read(), raw=False)
+        except (ValueError, msgpack.ExtraData, msgpack.FormatError, msgpack.StackError) as exc:
+            raise ParseError('MessagePack parse error - %s' % str(exc))
@@ -0,0 +1,98 @@
+"""
+Routing of the reads of safe requests to the read replicas of the database (DATABASE_REPLICAS, see settings.py).
+
+The views with ReplicaReadMixin (see quiz/mixins.py) read from a replica during their GET, HEAD and OPTIONS requests,
+after the user is authenticated (so the access tokens are always read from the primary). Every other read, and every
+write, goes to the primary ('default'), and so do:
+
+    - the reads of a user who wrote to the database in the last REPLICA_STICKINESS seconds (with a successful POST, PUT,
+      PATCH or DELETE request, see ReplicaStickinessMiddleware), so that users see their own writes even if the
+      replica lags behind;
+    - the reads in a transaction on the primary.
+
+The replica is picked at random once per request, so that all of its reads see the same snapshot. The users whose
+reads go to the primary are kept in the default cache: with several worker processes, it must be a shared cache (e.g.
+a redis CACHE_URL), or a write is only seen by the process that handled it. So a per-process cache is rejected at
+startup (see check_stickiness_cache).
+"""
+import contextvars
+import random
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# The replica that the reads of the current request go to, if any.
+_replica = contextvars.ContextVar('quiz.routers.replica', default=None)
+
+
+def _pinned_key(user_id):
+    return f'quiz.routers.pinned.{user_id}'
+
+
+def pin_to_primary(user):
+    """Send the reads of the user to the primary for the next REPLICA_STICKINESS seconds."""
+    if settings.DATABASE_REPLICAS and settings.REPLICA_STICKINESS > 0 and user.is_authenticated:
+        cache.set(_pinned_key(user.id), True, settings.REPLICA_STICKINESS)
+
+
+def is_pinned_to_primary(user):
+    return user.is_authenticated and cache.get(_pinned_key(user.id)) is not None
+
+
+@checks.register(checks.Tags.caches, checks.Tags.database)
+def check_stickiness_cache(app_configs, **kwargs):
+    """With replicas, the default cache must be shared by every worker process, or the users miss their own writes."""
+    if not settings.DATABASE_REPLICAS or settings.REPLICA_STICKINESS <= 0:
+        return []
+    if isinstance(caches[DEFAULT_CACHE_ALIAS], (LocMemCache, DummyCache)):
+        return [checks.Error(
+            "DATABASE_REPLICAS are set, but the default cache, which pins the users who wrote to the primary, is not "
+            "shared between processes.",
+            hint="Use a cache shared by every worker process, e.g. a redis CACHE_URL, or set REPLICA_STICKINESS to 0.",
+            id='quiz.E003',
+        )]
+    return []
+
+
+def start_replica_reads(user):
+    """
+    Send the reads of the current thread (or task) to a replica, unless the user wrote recently. Returns the replica,
+    or None if the reads still go to the primary.
+    """
+    if not settings.DATABASE_REPLICAS or is_pinned_to_primary(user):
+        return None
+    replica = random.choice(settings.DATABASE_REPLICAS)
+    _replica.set(replica)
+    return replica
+
+
+def end_replica_reads(replica):
+    """Send the reads of the current thread (or task) back to the primary, if start_replica_reads returned a replica."""
+    # Not ContextVar.reset, as the async views start in a sync thread (with a copy of the context) and end in the
+    #  event loop, where a token of the copy cannot be used.
+    if replica is not None:
+        _replica.set(None)
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        replica = _replica.get()
+        if replica is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return replica
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replicas have the same rows as the primary.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replicas get their schema from the primary.
+        return db not in settings.DATABASE_REPLICAS
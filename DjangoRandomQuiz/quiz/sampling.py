@@ -0,0 +1,159 @@
+"""
+Weighted sampling of questions for the adaptive quizzes (see Topic.generate_quiz).
+
+Every user has a weight per question (QuestionWeight), which goes up when the user gets the question wrong and down
+when the user gets it right, and drifts back to DEFAULT_WEIGHT while the question is not seen. Questions with higher
+weights are asked more often, so the questions a user struggles with or has not seen for a while come up again. The
+weights are only kept for the topics the user has generated adaptive quizzes of (see
+QuestionWeight.update_from_attempts).
+
+The weights of the questions of a topic are turned into an alias table (Walker's alias method), which picks a
+question in O(1) whatever the size of the topic. The table is saved per user and topic (QuestionSampler) and only
+rebuilt, in O(number of questions), when the weights have changed since.
+
+The rotation quizzes instead ask the questions the user has not been served since the last time they went through
+all the questions of the topic. The questions served are a bitset over the questions of the topic (QuestionRotation),
+so picking the unseen ones is a scan over a few bytes per hundred questions.
+
+Like quiz/grading.py, nothing here touches the database.
+"""
+import heapq
+import math
+import random
+from datetime import timedelta
+
+# The weight of a question the user has never answered.
+DEFAULT_WEIGHT = 1.0
+MIN_WEIGHT = 0.05
+MAX_WEIGHT = 16.0
+# Answering a question right multiplies its weight by RIGHT_FACTOR, answering it wrong by WRONG_FACTOR (and partly
+#  right, by something in between).
+RIGHT_FACTOR = 0.5
+WRONG_FACTOR = 2.0
+# A weight drifts back to DEFAULT_WEIGHT over this long without the question being answered.
+RECOVERY_PERIOD = timedelta(days=7)
+
+
+def next_weight(weight, fraction_correct):
+    """Returns the new weight of a question after the user scored fraction_correct (0 to 1) of its points."""
+    weight *= RIGHT_FACTOR ** fraction_correct * WRONG_FACTOR ** (1 - fraction_correct)
+    return min(MAX_WEIGHT, max(MIN_WEIGHT, weight))
+
+
+def effective_weight(weight, answered_at, now):
+    """Returns the weight of a question answered at answered_at, moved towards DEFAULT_WEIGHT by the time since."""
+    recovered = min(1.0, (now - answered_at) / RECOVERY_PERIOD)
+    return weight + (DEFAULT_WEIGHT - weight) * recovered
+
+
+class AliasTable:
+    """
+    Walker's alias method: after an O(n) build, picks index i with probability weights[i] / sum(weights) in O(1)
+    with one random number.
+
+    Slot i is kept with probability probabilities[i], otherwise its alias is picked instead.
+    """
+
+    def __init__(self, probabilities, aliases):
+        self.probabilities = probabilities
+        self.aliases = aliases
+
+    @classmethod
+    def build(cls, weights):
+        n = len(weights)
+        total = sum(weights)
+        if not n or total <= 0:
+            raise ValueError("An alias table needs at least one positive weight.")
+
+        # Scale the weights so that they average 1, then fill every slot below 1 with the excess of a slot above 1.
+        scaled = [weight * n / total for weight in weights]
+        probabilities = [1.0] * n
+        aliases = list(range(n))
+        small = [i for i, weight in enumerate(scaled) if weight < 1.0]
+        large = [i for i, weight in enumerate(scaled) if weight >= 1.0]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            probabilities[less] = scaled[less]
+            aliases[less] = more
+            scaled[more] -= 1.0 - scaled[less]
+            (small if scaled[more] < 1.0 else large).append(more)
+        # Whatever is left is 1 up to rounding errors, and keeps probability 1.
+        return cls(probabilities, aliases)
+
+    def __len__(self):
+        return len(self.probabilities)
+
+    def sample(self, rng=random):
+        """Returns a random index, in O(1)."""
+        value = rng.random() * len(self.probabilities)
+        slot = int(value)
+        return slot if value - slot < self.probabilities[slot] else self.aliases[slot]
+
+
+def sample_distinct(table, weights, k, rng=random):
+    """
+    Returns k distinct indexes, picked with the alias table and redrawn if already picked. This takes O(k) draws as
+    long as k is small next to the number of items. Otherwise (or after too many redraws, e.g. when a few heavy items
+    keep coming up), falls back to weighted sampling without replacement over all the weights, in O(n log k).
+    """
+    n = len(table)
+    k = min(k, n)
+    if k * 2 <= n:
+        picked = {}
+        for _ in range(k * 4):
+            index = table.sample(rng)
+            picked.setdefault(index, None)
+            if len(picked) == k:
+                return list(picked)
+
+    # Efraimidis and Spirakis: the k items with the largest random keys u ** (1 / weight).
+    return heapq.nlargest(k, range(n), key=lambda i: math.log(1.0 - rng.random()) / weights[i])
+
+
+def count_seen(bitset):
+    """Returns the number of bits set."""
+    return bin(int.from_bytes(bitset, 'little')).count('1')
+
+
+def is_seen(bitset, index):
+    """Returns whether the bit of the index is set."""
+    return index // 8 < len(bitset) and bool(bitset[index // 8] >> (index % 8) & 1)
+
+
+def unseen_indexes(bitset, n):
+    """Returns the indexes below n whose bit is not set, skipping the bytes that are all set."""
+    indexes = []
+    for byte_index in range((n + 7) // 8):
+        byte = bitset[byte_index] if byte_index < len(bitset) else 0
+        if byte == 0xFF:
+            continue
+        for bit in range(8):
+            index = byte_index * 8 + bit
+            if index < n and not byte >> bit & 1:
+                indexes.append(index)
+    return indexes
+
+
+def mark_seen(bitset, indexes, n):
+    """Returns a copy of the bitset (of n bits) with the bits of the indexes set."""
+    marked = bytearray(bitset.ljust((n + 7) // 8, b'\0'))
+    for index in indexes:
+        marked[index // 8] |= 1 << (index % 8)
+    return bytes(marked)
+
+
+def pick_unseen(bitset, n, k, rng=random):
+    """
+    Returns k distinct indexes below n, the ones not seen yet first, and the new bitset. Once every index has been
+    seen, the bitset starts over, and the indexes picked to make up k are the first ones seen in the new round.
+    """
+    k = min(k, n)
+    unseen = unseen_indexes(bitset, n)
+    if len(unseen) >= k:
+        picked = rng.sample(unseen, k)
+        return picked, mark_seen(bitset, picked, n)
+
+    # Every question has been seen after this quiz, so start a new round with the questions picked to make up k.
+    unseen_set = set(unseen)
+    rest = rng.sample([index for index in range(n) if index not in unseen_set], k - len(unseen))
+    return unseen + rest, mark_seen(b'', rest, n)
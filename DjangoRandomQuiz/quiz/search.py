@@ -0,0 +1,186 @@
+"""
+Full-text search over the text of the questions and answers of a user.
+
+The questions and answers are kept in an inverted index, the quiz_search table (see migration 0010):
+
+    - On SQLite, an FTS5 virtual table. The creator is an indexed column as well ('u<user id>'), so that the index only
+      returns the entries of the user, and the entries are ranked with bm25 on the text.
+    - On PostgreSQL, a table with a tsvector of the text and a GIN index on it, ranked with ts_rank.
+
+Both use the 'simple' tokenization (lowercased words, no stemming), so that the same query finds the same entries on
+both. Every word of the query must match the start of a word of the text.
+
+An entry's id is id * 2 for a question and id * 2 + 1 for an answer, so that an entry is found and replaced by its
+primary key (the rowid on SQLite). The write paths of quiz/views.py and quiz/admin.py update the index with index and
+unindex. Objects written in any other way (e.g. with bulk_create) are only found after index is called on them, or
+after manage.py rebuild_search_index.
+"""
+import re
+
+from django.db import connections, router, transaction, NotSupportedError
+
+from quiz.models import Answer, Question
+
+QUESTION = 'question'
+ANSWER = 'answer'
+KINDS = {QUESTION: 0, ANSWER: 1}
+MODELS = {Question: QUESTION, Answer: ANSWER}
+
+TABLE = 'quiz_search'
+
+
+def entry_id(kind, object_id):
+    return object_id * 2 + KINDS[kind]
+
+
+def split_entry_id(entry):
+    """Returns the kind and the object id of an entry."""
+    return (ANSWER if entry % 2 else QUESTION), entry // 2
+
+
+def query_words(query):
+    """Returns the words of a search query, lowercased."""
+    return re.findall(r'\w+', query.lower())
+
+
+class SQLiteIndex:
+    pk = 'rowid'
+    # Index every question and answer (see rebuild).
+    fill_sql = [
+        f"INSERT INTO {TABLE}(rowid, creator, text) SELECT id * 2, 'u' || creator_id, text FROM quiz_question",
+        f"INSERT INTO {TABLE}(rowid, creator, text) SELECT id * 2 + 1, 'u' || creator_id, text FROM quiz_answer",
+    ]
+    clear_sql = f"DELETE FROM {TABLE}"
+    upsert_sql = f"INSERT OR REPLACE INTO {TABLE}(rowid, creator, text) VALUES (%s, %s, %s)"
+    delete_sql = f"DELETE FROM {TABLE} WHERE rowid = %s"
+
+    def upsert_params(self, entry, creator_id, text):
+        return entry, f'u{creator_id}', text
+
+    def search(self, cursor, user_id, words, kind, limit, offset):
+        match = f"text : ({' '.join(f'{word}*' for word in words)})"
+        if user_id is not None:
+            match = f"creator : u{user_id} AND {match}"
+        kind_filter = f"AND rowid %% 2 = {KINDS[kind]}" if kind else ""
+        cursor.execute(
+            f"SELECT rowid, text, rank FROM {TABLE} WHERE {TABLE} MATCH %s {kind_filter} "
+            f"ORDER BY rank LIMIT %s OFFSET %s",
+            [match, limit, offset],
+        )
+        # bm25 is lower for better matches.
+        return [(entry, text, -rank) for entry, text, rank in cursor.fetchall()]
+
+
+class PostgresIndex:
+    pk = 'id'
+    fill_sql = [
+        f"INSERT INTO {TABLE} (id, creator_id, text, document) "
+        f"SELECT id * 2, creator_id, text, to_tsvector('simple', text) FROM quiz_question",
+        f"INSERT INTO {TABLE} (id, creator_id, text, document) "
+        f"SELECT id * 2 + 1, creator_id, text, to_tsvector('simple', text) FROM quiz_answer",
+    ]
+    clear_sql = f"TRUNCATE {TABLE}"
+    upsert_sql = (
+        f"INSERT INTO {TABLE} (id, creator_id, text, document) VALUES (%s, %s, %s, to_tsvector('simple', %s)) "
+        f"ON CONFLICT (id) DO UPDATE SET creator_id = EXCLUDED.creator_id, text = EXCLUDED.text, "
+        f"document = EXCLUDED.document"
+    )
+    delete_sql = f"DELETE FROM {TABLE} WHERE id = %s"
+
+    def upsert_params(self, entry, creator_id, text):
+        return entry, creator_id, text, text
+
+    def search(self, cursor, user_id, words, kind, limit, offset):
+        # The words are made of letters, digits and underscores only, so they need no escaping in a tsquery.
+        tsquery = ' & '.join(f'{word}:*' for word in words)
+        kind_filter = f"AND id %% 2 = {KINDS[kind]}" if kind else ""
+        creator_filter = "AND creator_id = %s" if user_id is not None else ""
+        cursor.execute(
+            f"SELECT id, text, ts_rank(document, query) AS rank FROM {TABLE}, to_tsquery('simple', %s) query "
+            f"WHERE document @@ query {creator_filter} {kind_filter} "
+            f"ORDER BY rank DESC, id LIMIT %s OFFSET %s",
+            [tsquery, *([user_id] if user_id is not None else []), limit, offset],
+        )
+        return cursor.fetchall()
+
+
+INDEXES = {
+    'sqlite': SQLiteIndex(),
+    'postgresql': PostgresIndex(),
+}
+
+
+def index_for(connection):
+    try:
+        return INDEXES[connection.vendor]
+    except KeyError:
+        raise NotSupportedError(f"Full-text search is not supported on {connection.vendor}.") from None
+
+
+def index(objects):
+    """Add the questions and answers to the index, or update their entries."""
+    index_entries((MODELS[type(obj)], obj.id, obj.creator_id, obj.text) for obj in objects)
+
+
+def index_entries(entries):
+    """Add (kind, object id, creator id, text) entries to the index, or update them."""
+    connection = connections[router.db_for_write(Question)]
+    search_index = index_for(connection)
+    params = [search_index.upsert_params(entry_id(kind, object_id), creator_id, text)
+              for kind, object_id, creator_id, text in entries]
+    if params:
+        with connection.cursor() as cursor:
+            cursor.executemany(search_index.upsert_sql, params)
+
+
+def unindex(objects):
+    """Remove the questions and answers from the index. Call it before deleting them, while they still have an id."""
+    connection = connections[router.db_for_write(Question)]
+    params = [(entry_id(MODELS[type(obj)], obj.id),) for obj in objects]
+    if params:
+        with connection.cursor() as cursor:
+            cursor.executemany(index_for(connection).delete_sql, params)
+
+
+def unindex_subquery(kind, sql, params):
+    """
+    Remove the entries of the questions or answers whose ids are returned by the SQL query (in a column named id), in
+    one statement.
+    """
+    connection = connections[router.db_for_write(Question)]
+    search_index = index_for(connection)
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABLE} WHERE {search_index.pk} IN "
+                       f"(SELECT id * 2 + {KINDS[kind]} FROM ({sql}) unindexed)", params)
+
+
+def rebuild():
+    """Empty the index and index every question and answer again. Returns the number of entries."""
+    connection = connections[router.db_for_write(Question)]
+    search_index = index_for(connection)
+    # Searches keep finding the old entries until the new ones are committed.
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.execute(search_index.clear_sql)
+        for sql in search_index.fill_sql:
+            cursor.execute(sql)
+        cursor.execute(f"SELECT COUNT(*) FROM {TABLE}")
+        return cursor.fetchone()[0]
+
+
+def search(user, query, kind=None, limit=20, offset=0):
+    """
+    Returns the user's questions and answers (only the ones of kind, if given) that match every word of the query, or
+    the ones of all users if user is None, best first: [{'type': 'question' or 'answer', 'id': ..., 'text': ..., 'rank': ...}, ...]. Higher ranks are
+    better, but the ranks of SQLite and PostgreSQL are on different scales.
+    """
+    words = query_words(query)
+    if not words:
+        return []
+    connection = connections[router.db_for_read(Question)]
+    with connection.cursor() as cursor:
+        rows = index_for(connection).search(cursor, user.id if user is not None else None, words, kind, limit, offset)
+    results = []
+    for entry, text, rank in rows:
+        entry_kind, object_id = split_entry_id(entry)
+        results.append({'type': entry_kind, 'id': object_id, 'text': text, 'rank': rank})
+    return results
@@ -57,6 +57,20 @@ class QuizSerializer(serializers.Serializer):
     #  one.
     fixed_choices_only = serializers.BooleanField(default=False)
 
+    # Ask the questions the user got wrong or has not answered for a while more often (see quiz/sampling.py).
+    adaptive = serializers.BooleanField(default=False)
+
+    # Ask the questions the user has not been served yet first, until they have seen them all (see QuestionRotation).
+    rotation = serializers.BooleanField(default=False)
+
+    # Do not save the quiz, but return it with a token to send back with the answers (see quiz/quiz_tokens.py).
+    stateless = serializers.BooleanField(default=False)
+
+    def validate(self, data):
+        if data['adaptive'] and data['rotation']:
+            raise serializers.ValidationError("Choose either adaptive or rotation.")
+        return data
+
 
 class QuizAnswerSerializer(serializers.Serializer):
     """
@@ -72,6 +86,41 @@ class QuizAnswerSerializer(serializers.Serializer):
     )
 
 
+class QuizTokenAnswerSerializer(QuizAnswerSerializer):
+    """The answers to a stateless quiz, with the token of the quiz (see quiz/quiz_tokens.py)."""
+    token = serializers.CharField(max_length=None)
+
+
+class LeaderboardSerializer(serializers.Serializer):
+    """
+    Query parameters of the leaderboards: the number of users to return, and optionally the id of one of the user's
+    quiz attempts to get the percentile of.
+    """
+    limit = serializers.IntegerField(default=10, min_value=1, max_value=100)
+    attempt = serializers.IntegerField(required=False)
+
+
+class SearchSerializer(serializers.Serializer):
+    """
+    Query parameters of the search: the words to search for, optionally only questions or only answers, and the page
+    of results to return.
+    """
+    q = serializers.CharField(max_length=256)
+    type = serializers.ChoiceField(choices=['question', 'answer'], required=False)
+    limit = serializers.IntegerField(default=20, min_value=1, max_value=100)
+    offset = serializers.IntegerField(default=0, min_value=0)
+
+
+class HistorySerializer(serializers.Serializer):
+    """
+    Query parameters of the quiz and quiz attempt histories: the number of items to return, the id of the last item of
+    the previous page (to get the ones before it), and optionally the id of a topic to only get the items of.
+    """
+    limit = serializers.IntegerField(default=20, min_value=1, max_value=100)
+    before = serializers.IntegerField(required=False, min_value=1)
+    topic = serializers.IntegerField(required=False)
+
+
 class UserSerializer(serializers.ModelSerializer):
     """
     Used to register users.
@@ -0,0 +1,197 @@
+"""
+Slow-query log.
+
+With SLOW_QUERY_LOG set, log_slow_query is added to every new database connection (see QuizConfig.ready). It times
+every SQL query, and the ones that take at least SLOW_QUERY_THRESHOLD_MS ms are:
+
+    - logged as a JSON line to the 'quiz.slow_queries' logger, with the route of the request that made them (None
+      outside of a request, e.g. in management commands), their fingerprint and their duration;
+    - added to the stats of their fingerprint in slow_queries, which keeps the SLOW_QUERY_TOP fingerprints with the most
+      time in slow queries (shown at /api/performance/slow_queries/, staff only).
+
+The fingerprint of a query is its SQL with the literals and parameters replaced by '?' and the lists of them by '...',
+so that e.g. the lookups of every topic by id add up to one fingerprint.
+
+With SLOW_QUERY_EXPLAIN set as well, the plan of a SELECT is captured when it is the slowest of its fingerprint so far
+(so the stats keep the plan of the slowest one, and a query that is always slow is not explained every time): EXPLAIN
+ANALYZE on PostgreSQL, which runs the query again, EXPLAIN QUERY PLAN on SQLite and EXPLAIN on MySQL. Failed queries are
+not logged.
+
+The stats are kept per worker process, like the histograms of quiz/instrumentation.py.
+"""
+import contextvars
+import json
+import logging
+import re
+import threading
+import time
+
+from django.conf import settings
+
+from quiz.instrumentation import current_timings
+
+logger = logging.getLogger(__name__)
+
+# The route of the stats of the queries made outside a resolved route.
+NO_ROUTE = '<no route>'
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER = re.compile(r'%s|\?')
+_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+# The rows of a bulk insert, once each of them is '(...)'.
+_LISTS = re.compile(r'\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+')
+_WHITESPACE = re.compile(r'\s+')
+
+EXPLAIN = {
+    'postgresql': 'EXPLAIN ANALYZE ',
+    'sqlite': 'EXPLAIN QUERY PLAN ',
+    'mysql': 'EXPLAIN ',
+}
+
+# Set while the plan of a query is captured, so that its own queries (e.g. savepoints) are not logged.
+_explaining = contextvars.ContextVar('quiz.slow_queries.explaining', default=False)
+
+
+def fingerprint(sql):
+    """Returns the SQL without its literals and parameters, e.g. 'SELECT ... WHERE "id" IN (...) LIMIT ?'."""
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _PLACEHOLDER.sub('?', sql)
+    sql = _LIST.sub('(...)', sql)
+    sql = _LISTS.sub('(...)', sql)
+    return _WHITESPACE.sub(' ', sql).strip()
+
+
+def explain(connection, sql, params):
+    """
+    Returns the lines of the plan of the query, or None if it is not a SELECT or the database has no EXPLAIN. The plan
+    is captured in a savepoint inside a transaction, so that a failure (e.g. a statement timeout) does not break it.
+    """
+    prefix = EXPLAIN.get(connection.vendor)
+    if prefix is None or not sql.lstrip()[:6].upper() == 'SELECT':
+        return None
+
+    token = _explaining.set(True)
+    try:
+        savepoint = connection.savepoint() if connection.in_atomic_block else None
+        try:
+            # A cursor of the backend, without the execute wrappers, so that the EXPLAIN is not counted as a query of
+            #  the request.
+            cursor = connection.create_cursor()
+            try:
+                cursor.execute(prefix + sql, params)
+                rows = cursor.fetchall()
+            finally:
+                cursor.close()
+        except Exception:
+            if savepoint:
+                connection.savepoint_rollback(savepoint)
+            logger.debug("Could not explain %s", sql, exc_info=True)
+            return None
+        if savepoint:
+            connection.savepoint_commit(savepoint)
+    finally:
+        _explaining.reset(token)
+
+    # The last column of EXPLAIN QUERY PLAN is the step of the plan; the other databases only have one column.
+    if connection.vendor == 'sqlite':
+        return [str(row[-1]) for row in rows]
+    return [' | '.join(str(column) for column in row) for row in rows]
+
+
+class SlowQueryStats:
+    """
+    The count, total time and slowest query (with its plan) of the slow queries, by fingerprint. Keeps the `size`
+    fingerprints with the most time: a new fingerprint takes the place of the one with the least time, and starts from
+    its total time (error_ms), so that a fingerprint that keeps coming back is not evicted by every new one.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._queries = {}
+        self._lock = threading.Lock()
+
+    def is_slowest(self, fingerprint, duration_ms):
+        """Whether the query would be the slowest of its fingerprint."""
+        entry = self._queries.get(fingerprint)
+        return entry is None or duration_ms > entry['max_ms']
+
+    def add(self, fingerprint, route, duration_ms, sql, plan=None):
+        # The queries made before the URL is resolved (e.g. the access token lookup of the middleware) or outside a
+        #  request (e.g. in the background threads) have no route, and the routes must be strings to be rendered.
+        route = route or NO_ROUTE
+        with self._lock:
+            entry = self._queries.get(fingerprint)
+            if entry is None:
+                error_ms = 0.0
+                if len(self._queries) >= self.size:
+                    evicted = min(self._queries, key=lambda key: self._queries[key]['total_ms'])
+                    error_ms = self._queries.pop(evicted)['total_ms']
+                entry = self._queries[fingerprint] = {
+                    'fingerprint': fingerprint,
+                    'count': 0,
+                    'total_ms': error_ms,
+                    'error_ms': error_ms,
+                    'max_ms': 0.0,
+                    'routes': {},
+                    'sql': sql,
+                    'plan': None,
+                }
+            entry['count'] += 1
+            entry['total_ms'] += duration_ms
+            entry['routes'][route] = entry['routes'].get(route, 0) + 1
+            if duration_ms > entry['max_ms']:
+                entry['max_ms'] = duration_ms
+                entry['sql'] = sql
+                entry['plan'] = plan
+
+    def snapshot(self):
+        """Returns the stats of the fingerprints, the ones with the most time first."""
+        with self._lock:
+            entries = [{**entry, 'routes': dict(entry['routes'])} for entry in self._queries.values()]
+        return sorted(entries, key=lambda entry: entry['total_ms'], reverse=True)
+
+    def clear(self):
+        with self._lock:
+            self._queries.clear()
+
+
+slow_queries = SlowQueryStats(size=settings.SLOW_QUERY_TOP)
+
+
+def log_slow_query(execute, sql, params, many, context):
+    """Execute wrapper (see connection.execute_wrapper) that logs the queries over SLOW_QUERY_THRESHOLD_MS ms."""
+    if _explaining.get():
+        return execute(sql, params, many, context)
+
+    start = time.perf_counter()
+    result = execute(sql, params, many, context)
+    duration_ms = (time.perf_counter() - start) * 1000
+    if duration_ms >= settings.SLOW_QUERY_THRESHOLD_MS:
+        record_slow_query(context['connection'], sql, params, many, duration_ms)
+    return result
+
+
+def record_slow_query(connection, sql, params, many, duration_ms):
+    timings = current_timings()
+    route = timings.route if timings is not None else None
+    query_fingerprint = fingerprint(sql)
+    plan = None
+    if settings.SLOW_QUERY_EXPLAIN and not many and slow_queries.is_slowest(query_fingerprint, duration_ms):
+        plan = explain(connection, sql, params)
+    slow_queries.add(query_fingerprint, route, duration_ms, sql, plan)
+
+    logger.warning(json.dumps({
+        'route': route,
+        'database': connection.alias,
+        'duration_ms': round(duration_ms, 3),
+        'fingerprint': query_fingerprint,
+        'plan': plan,
+    }))
+
+
+def install_slow_query_log(sender, connection, **kwargs):
+    """connection_created receiver. Log the slow queries made on every connection, in any thread."""
+    if log_slow_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(log_slow_query)
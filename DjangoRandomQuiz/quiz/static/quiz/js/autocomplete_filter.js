@@ -0,0 +1,13 @@
+'use strict';
+{
+    // Reload the change list filtered on the object picked in an autocomplete filter (see AutocompleteFilter in
+    // quiz/admin.py), keeping the other filters.
+    const $ = django.jQuery;
+    $(document).on('change', 'select.quiz-autocomplete-filter', function() {
+        const params = new URLSearchParams(this.dataset.queryString);
+        if (this.value) {
+            params.set(this.dataset.lookup, this.value);
+        }
+        window.location.search = params.toString();
+    });
+}
@@ -0,0 +1,197 @@
+"""
+Builds synthetic users, topics, questions, answers, quizzes and quiz attempts, for the query budget tests (see
+quiz/tests.py) and for load testing (see the generate_synthetic_data and loadtest commands).
+
+Everything is inserted with bulk_create, so building a topic with thousands of questions takes a handful of queries.
+"""
+import random
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.color import no_style
+from django.db import connection
+from django.db.models import Max
+
+from quiz import search
+from quiz.grading import grade_quiz_answers
+from quiz.models import Topic, Question, Answer, Quiz, QuizAttempt
+
+
+def build_users(prefix, no_of_users, password, batch_size=1000):
+    """
+    Create the users '<prefix>user0' to '<prefix>user<no_of_users - 1>', all with the same password. Returns the users.
+    """
+    # Hashing a password is slow on purpose, so hash it once for all the users.
+    hashed_password = make_password(password)
+    usernames = [f'{prefix}user{i}' for i in range(no_of_users)]
+    User.objects.bulk_create((User(username=username, password=hashed_password) for username in usernames),
+                             batch_size=batch_size)
+    return list(User.objects.filter(username__in=usernames).order_by('id'))
+
+
+def build_topic(creator, name, no_of_questions, no_of_answers=None, answers_per_question=(1, 3),
+                wrong_answers_per_question=(0, 2), seed=None, batch_size=1000):
+    """
+    Create a topic with no_of_questions questions for the creator.
+
+    The questions share a pool of no_of_answers answers (by default, half as many answers as questions, with a minimum
+    of 10), so most answers are the correct or wrong answer of several questions, as in a real topic. Each question
+    gets between answers_per_question[0] and answers_per_question[1] correct answers and between
+    wrong_answers_per_question[0] and wrong_answers_per_question[1] fixed wrong answers, picked from the pool at random.
+
+    Answers and questions are per creator, so the texts are prefixed with the name of the topic to allow several
+    synthetic topics for the same creator. Pass in a seed to always build the same topic.
+
+    Returns the topic.
+    """
+    rng = random.Random(seed)
+    no_of_answers = no_of_answers or max(10, no_of_questions // 2)
+
+    topic = Topic.objects.create(creator=creator, name=name)
+
+    Answer.objects.bulk_create(
+        (Answer(creator=creator, text=f'{name} answer {i}') for i in range(no_of_answers)),
+        batch_size=batch_size,
+    )
+    Question.objects.bulk_create(
+        (Question(creator=creator, text=f'{name} question {i}') for i in range(no_of_questions)),
+        batch_size=batch_size,
+    )
+    # bulk_create does not set the primary keys on every database (e.g. SQLite), so get them back with one query each.
+    answers = list(Answer.objects.filter(creator=creator, text__startswith=f'{name} answer ')
+                   .values_list('id', 'text'))
+    questions = list(Question.objects.filter(creator=creator, text__startswith=f'{name} question ')
+                     .values_list('id', 'text'))
+    answer_ids = [answer_id for answer_id, _ in answers]
+    question_ids = [question_id for question_id, _ in questions]
+
+    topic_links = []
+    answer_links = []
+    wrong_answer_links = []
+    for question_id in question_ids:
+        topic_links.append(Question.topic.through(question_id=question_id, topic_id=topic.id))
+
+        no_of_correct = rng.randint(*answers_per_question)
+        no_of_wrong = rng.randint(*wrong_answers_per_question)
+        picked_answer_ids = rng.sample(answer_ids, min(len(answer_ids), no_of_correct + no_of_wrong))
+        answer_links.extend(Question.answers.through(question_id=question_id, answer_id=answer_id)
+                            for answer_id in picked_answer_ids[:no_of_correct])
+        wrong_answer_links.extend(Question.wrong_answers.through(question_id=question_id, answer_id=answer_id)
+                                  for answer_id in picked_answer_ids[no_of_correct:])
+
+    Question.topic.through.objects.bulk_create(topic_links, batch_size=batch_size)
+    Question.answers.through.objects.bulk_create(answer_links, batch_size=batch_size)
+    Question.wrong_answers.through.objects.bulk_create(wrong_answer_links, batch_size=batch_size)
+
+    # bulk_create does not go through the write paths that keep the search index up to date.
+    search.index_entries(
+        [(search.QUESTION, question_id, creator.id, text) for question_id, text in questions] +
+        [(search.ANSWER, answer_id, creator.id, text) for answer_id, text in answers]
+    )
+    return topic
+
+
+class IdAllocator:
+    """
+    Hands out primary keys for the quizzes and quiz attempts, which must know their own id (it is part of the pickled
+    quiz and quiz attempt dicts) before they are inserted with bulk_create.
+
+    Only use this while nothing else inserts quizzes or quiz attempts, and call reset_sequences() at the end so that
+    the database carries on after the highest id that was handed out.
+    """
+
+    def __init__(self, *models):
+        self.models = models
+        self.next_ids = {model: (model.objects.aggregate(max_id=Max('id'))['max_id'] or 0) + 1 for model in models}
+
+    def __call__(self, model):
+        next_id = self.next_ids[model]
+        self.next_ids[model] += 1
+        return next_id
+
+    def reset_sequences(self):
+        # e.g. setval() of the id sequences on PostgreSQL. SQLite keeps track of the highest id by itself.
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), self.models):
+                cursor.execute(sql)
+
+
+def _random_quiz_question(question, pool_of_choices, no_of_choices, rng):
+    """Returns a quiz question dict (see Quiz) for the question, with its answers and wrong answers prefetched."""
+    correct_answers = [answer.text for answer in question.answers.all()]
+    fixed_wrong_answers = [answer.text for answer in question.wrong_answers.all()]
+
+    no_of_correct_answers = 1 if len(correct_answers) == 1 else rng.randint(1, min(len(correct_answers),
+                                                                                  no_of_choices))
+    correct_choices = rng.sample(correct_answers, no_of_correct_answers)
+    wrong_choices = fixed_wrong_answers[:no_of_choices - no_of_correct_answers]
+
+    excluded = {*correct_answers, *wrong_choices}
+    no_of_random_wrong_choices = no_of_choices - no_of_correct_answers - len(wrong_choices)
+    # Picking a few more than needed is enough to skip the excluded answers in all but tiny pools.
+    for text in rng.sample(pool_of_choices, min(len(pool_of_choices), no_of_random_wrong_choices + len(excluded))):
+        if len(wrong_choices) >= no_of_choices - no_of_correct_answers:
+            break
+        if text not in excluded:
+            wrong_choices.append(text)
+
+    choices = [*correct_choices, *wrong_choices]
+    rng.shuffle(choices)
+    return {
+        'question_text': question.text,
+        'choices': choices,
+        'question_type': 'radio' if len(correct_answers) == 1 else 'checkbox',
+    }
+
+
+def build_quizzes(topic, no_of_quizzes, no_of_questions, no_of_choices, attempts_per_quiz, allocate_id, seed=None,
+                  batch_size=1000):
+    """
+    Create no_of_quizzes random quizzes for the topic, each attempted attempts_per_quiz times with random choices.
+
+    The quizzes are in the same format as the ones from Topic.generate_quiz (with simpler sampling) and the attempts
+    are graded with grade_quiz_answers, as in Quiz.check_quiz_answers, but without going through the database for every
+    quiz. allocate_id is an IdAllocator for Quiz and QuizAttempt.
+
+    Returns the number of quizzes and quiz attempts created.
+    """
+    rng = random.Random(seed)
+    questions = list(topic.questions.prefetch_related('answers', 'wrong_answers'))
+    if not questions:
+        return 0, 0
+    pool_of_choices = list(topic.pool_of_choices().values_list('text', flat=True))
+    correct_answer_texts_by_question = {question.text: set(question.list_of_answer_text) for question in questions}
+
+    quizzes = []
+    quiz_attempts = []
+    for _ in range(no_of_quizzes):
+        quiz_object = Quiz(id=allocate_id(Quiz), creator=topic.creator, topic=topic)
+        quiz_id = quiz_object.id
+        quiz = quiz_object.quiz = {
+            'topic': topic.id,
+            'topic_name': topic.name,
+            'uuid': str(quiz_object.uuid),
+            'questions': [_random_quiz_question(question, pool_of_choices, no_of_choices, rng)
+                          for question in rng.sample(questions, min(len(questions), no_of_questions))],
+            'id': quiz_id,
+        }
+        quiz_object.summarize()
+        quizzes.append(quiz_object)
+
+        for _ in range(attempts_per_quiz):
+            chosen_answers = [
+                rng.sample(question['choices'], 1) if question['question_type'] == 'radio'
+                else rng.sample(question['choices'], rng.randint(1, len(question['choices'])))
+                for question in quiz['questions']
+            ]
+            quiz_attempt = grade_quiz_answers(quiz, chosen_answers, correct_answer_texts_by_question)
+            quiz_attempt_object = QuizAttempt(id=allocate_id(QuizAttempt), quiz_id=quiz_id, user_id=topic.creator_id,
+                                              topic=topic, quiz_attempt=quiz_attempt, score=quiz_attempt['score'])
+            quiz_attempt['uuid'] = str(quiz_attempt_object.uuid)
+            quiz_attempt['id'] = quiz_attempt_object.id
+            quiz_attempt_object.summarize()
+            quiz_attempts.append(quiz_attempt_object)
+
+    Quiz.objects.bulk_create(quizzes, batch_size=batch_size)
+    QuizAttempt.objects.bulk_create(quiz_attempts, batch_size=batch_size)
+    return len(quizzes), len(quiz_attempts)
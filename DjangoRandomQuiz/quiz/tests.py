@@ -1,3 +1,2058 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import json
+import logging
+import math
+import os
+import pstats
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management import CommandError, call_command
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.core.cache import cache
+from django.db import connection, connections, router, transaction, IntegrityError, OperationalError
+from django.test import AsyncClient, Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from oauth2_provider.models import get_access_token_model, get_application_model
+import msgpack
+import prometheus_client
+from prometheus_client.parser import text_string_to_metric_families
+from rest_framework.exceptions import ParseError
+from rest_framework.test import APIClient
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from quiz import attempt_buffer, bulk_edits, leaderboards, metrics, profiling, regrading, routers, sampling, \
+    search, slow_queries
+from quiz.admin import EstimatedCountPaginator
+from quiz.async_views import database_sync_to_async
+from quiz.authentication import AccessTokenCache, check_token_cache, token_cache, verify_request
+from quiz.backends.pooling import close_pool, pool_stats
+from quiz.instrumentation import PhaseTimer, RollingHistogram, current_timings, route_histograms, \
+    start_request_timings, stop_request_timings, timed
+from quiz.layouts import COLUMNAR, rows_to_columns, to_layout
+from quiz.middleware import APICompressionMiddleware
+from quiz.models import Answer, Question, QuestionRotation, QuestionSampler, QuestionWeight, Quiz, QuizAttempt, \
+    RegradeJob, Topic
+from quiz.renderers import MessagePackParser, MessagePackRenderer, ORJSONParser, ORJSONRenderer
+from quiz.synthetic import IdAllocator, build_topic
+
+# The sizes of the synthetic topics. Every query budget must hold for all of them.
+TOPIC_SIZES = (10, 100, 1000)
+
+
+class QueryBudgetTestCase(TestCase):
+    """
+    Checks that the number of queries of every endpoint stays within a fixed budget, however many questions and
+    answers a topic has. A test fails with the list of queries that were run if an endpoint goes over its budget,
+    which is usually an N+1 query in a loop (e.g. a missing prefetch_related).
+
+    The budgets do not include authentication, as the client is authenticated with force_authenticate. Neither do they
+    include the async endpoints, which run the same queries as the sync ones but in other threads (and so outside of
+    the transaction of the test case).
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='budget', password='budget')
+        application = get_application_model().objects.create(
+            user=cls.user, name='budget', client_type='public', authorization_grant_type='password')
+        cls.access_token = get_access_token_model().objects.create(
+            user=cls.user, application=application, token='budget', scope='read write',
+            expires=timezone.now() + timedelta(days=1))
+        cls.topics = {size: build_topic(cls.user, f'topic {size}', size, seed=size) for size in TOPIC_SIZES}
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user, token=self.access_token)
+
+        # Do not print a performance log line for every request (see PerformanceMiddleware).
+        performance_logger = logging.getLogger('quiz.performance')
+        self.addCleanup(performance_logger.setLevel, performance_logger.level)
+        performance_logger.setLevel(logging.WARNING)
+
+    def assertQueryBudget(self, budget, func, *args, **kwargs):
+        """Call func and fail with the queries that were run if there were more than budget. Returns the result."""
+        with CaptureQueriesContext(connection) as context:
+            result = func(*args, **kwargs)
+        if len(context.captured_queries) > budget:
+            queries = '\n'.join(f"{i}. {query['sql']}" for i, query in enumerate(context.captured_queries, start=1))
+            self.fail(f"{len(context.captured_queries)} queries run, but the budget is {budget}:\n{queries}")
+        return result
+
+    def assertStatus(self, response, status_code):
+        self.assertEqual(response.status_code, status_code, response.content[:500])
+
+    def generate_quiz(self, topic, no_of_questions=10, **data):
+        response = self.client.put(f'/api/generate_quiz/{topic.id}/',
+                                   {'no_of_questions': no_of_questions, 'no_of_choices': 4, **data}, format='json')
+        self.assertStatus(response, 201)
+        return response.json()
+
+    def test_topic_endpoints(self):
+        for size, topic in self.topics.items():
+            with self.subTest(size=size):
+                self.assertStatus(self.assertQueryBudget(1, self.client.get, '/api/topics/'), 200)
+                self.assertStatus(self.assertQueryBudget(1, self.client.get, f'/api/topics/{topic.id}/'), 200)
+
+        response = self.assertQueryBudget(3, self.client.post, '/api/topics/', {'name': 'new topic'}, format='json')
+        self.assertStatus(response, 201)
+        topic_id = response.json()['id']
+        response = self.assertQueryBudget(6, self.client.put, f'/api/topics/{topic_id}/',
+                                          {'name': 'renamed topic', 'creator': self.user.id}, format='json')
+        self.assertStatus(response, 200)
+        # Django loads the quiz attempts of the topic to set their topic to NULL, and deletes its question samplers.
+        self.assertStatus(self.assertQueryBudget(7, self.client.delete, f'/api/topics/{topic_id}/'), 204)
+
+    def test_question_and_answer_endpoints(self):
+        for size, topic in self.topics.items():
+            with self.subTest(size=size):
+                self.assertStatus(self.assertQueryBudget(3, self.client.get, '/api/questions/'), 200)
+                self.assertStatus(self.assertQueryBudget(2, self.client.get, '/api/answers/'), 200)
+
+                question = topic.questions.first()
+                answer = question.answers.first()
+                self.assertStatus(self.assertQueryBudget(3, self.client.get, f'/api/questions/{question.id}/'), 200)
+                self.assertStatus(self.assertQueryBudget(2, self.client.get, f'/api/answers/{answer.id}/'), 200)
+
+    def test_qna_endpoints(self):
+        for size, topic in self.topics.items():
+            with self.subTest(size=size):
+                response = self.assertQueryBudget(4, self.client.get, f'/api/qna/{topic.id}/')
+                self.assertStatus(response, 200)
+                self.assertEqual(len(response.json()['qna']), size)
+
+                # Reuses two shared answers and creates a new one. Each answer costs a few queries, whatever the size
+                #  of the topic, plus one query to add the new question and answer to the search index.
+                response = self.assertQueryBudget(16, self.client.post, '/api/qna/', {
+                    'topic': topic.id,
+                    'question': f'new question {size}',
+                    'answers': [f'topic {size} answer 0', f'new answer {size}'],
+                    'wrong_answers': [f'topic {size} answer 1'],
+                }, format='json')
+                self.assertStatus(response, 201)
+
+    def test_generate_quiz(self):
+        for size, topic in self.topics.items():
+            for options in ({}, {'show_all_alternative_answers': True}, {'fixed_choices_only': True}):
+                with self.subTest(size=size, **options):
+                    quiz = self.assertQueryBudget(11, self.generate_quiz, topic, no_of_questions=size, **options)
+                    self.assertEqual(len(quiz['questions']), size)
+
+                    response = self.assertQueryBudget(1, self.client.get, f"/api/generate_quiz/{quiz['id']}/")
+                    self.assertStatus(response, 200)
+
+    def test_generate_adaptive_quiz(self):
+        for size, topic in self.topics.items():
+            with self.subTest(size=size):
+                # Builds the alias table the first time (3 more queries), and reuses it after.
+                for budget in (15, 12):
+                    quiz = self.assertQueryBudget(budget, self.generate_quiz, topic, no_of_questions=size // 2,
+                                                  adaptive=True)
+                    self.assertEqual(len({question['question_text'] for question in quiz['questions']}), size // 2)
+
+    def test_generate_rotation_quiz(self):
+        for size, topic in self.topics.items():
+            with self.subTest(size=size):
+                # Builds the question index the first time (1 more query), and only saves the bitset after.
+                for budget in (14, 13):
+                    quiz = self.assertQueryBudget(budget, self.generate_quiz, topic, no_of_questions=size // 2,
+                                                  rotation=True)
+                    self.assertEqual(len({question['question_text'] for question in quiz['questions']}), size // 2)
+
+    def test_check_quiz_answers(self):
+        for size, topic in self.topics.items():
+            with self.subTest(size=size):
+                quiz = self.generate_quiz(topic, no_of_questions=size)
+                answers = [question['choices'][:1] for question in quiz['questions']]
+                # Including the lookup of the adaptive quizzes of the topic, of which there are none, so the question
+                #  weights are not updated (see QuestionWeight.update_from_attempts).
+                response = self.assertQueryBudget(7, self.client.put, f"/api/attempt_quiz/{quiz['id']}/",
+                                                  {'answers': answers}, format='json')
+                self.assertStatus(response, 201)
+                self.assertEqual(len(response.json()['questions']), size)
+
+    def test_check_adaptive_quiz_answers(self):
+        for size, topic in self.topics.items():
+            with self.subTest(size=size):
+                quiz = self.generate_quiz(topic, no_of_questions=size, adaptive=True)
+                answers = [question['choices'][:1] for question in quiz['questions']]
+                # Including the updates of the question weights, in a savepoint: they are inserted (unless they are
+                #  there already), locked and updated, in batches of as many rows as the database allows in one query,
+                #  and the alias table is marked as out of date.
+                fields = QuestionWeight._meta.concrete_fields
+                budget = 11 + math.ceil(size / connection.ops.bulk_batch_size(fields[1:], range(size))) + \
+                    math.ceil(size / connection.ops.bulk_batch_size(['pk', 'pk', *fields[-2:]], range(size)))
+                response = self.assertQueryBudget(budget, self.client.put, f"/api/attempt_quiz/{quiz['id']}/",
+                                                  {'answers': answers}, format='json')
+                self.assertStatus(response, 201)
+                self.assertEqual(QuestionWeight.objects.filter(user=self.user, question__topic=topic).count(), size)
+
+    def test_leaderboards(self):
+        for size, topic in self.topics.items():
+            quiz = self.generate_quiz(topic, no_of_questions=size)
+            answers = [question['choices'][:1] for question in quiz['questions']]
+            attempt = self.client.put(f"/api/attempt_quiz/{quiz['id']}/", {'answers': answers}, format='json').json()
+
+            for path in ('/api/leaderboard/', f'/api/leaderboard/{topic.id}/'):
+                with self.subTest(size=size, path=path):
+                    response = self.assertQueryBudget(6, self.client.get, path, {'attempt': attempt['id']})
+                    self.assertStatus(response, 200)
+                    self.assertEqual(response.json()['current_user']['rank'], 1)
+
+    def test_uuid_routes(self):
+        quiz = self.generate_quiz(self.topics[TOPIC_SIZES[0]])
+        response = self.assertQueryBudget(1, self.client.get, f"/api/quizzes/{quiz['uuid']}/")
+        self.assertStatus(response, 200)
+        self.assertEqual(response.json(), quiz)
+
+        answers = [question['choices'][:1] for question in quiz['questions']]
+        attempt = self.client.put(f"/api/attempt_quiz/{quiz['id']}/", {'answers': answers}, format='json').json()
+        response = self.assertQueryBudget(1, self.client.get, f"/api/quiz_attempts/{attempt['uuid']}/")
+        self.assertStatus(response, 200)
+        self.assertEqual(response.json(), attempt)
+
+        self.assertStatus(self.client.get(f"/api/quizzes/{attempt['uuid']}/"), 400)
+        self.assertStatus(self.client.get(f"/api/quizzes/{quiz['id']}/"), 404)
+
+    def test_history(self):
+        for size, topic in self.topics.items():
+            quiz = self.generate_quiz(topic, no_of_questions=size)
+            answers = [question['choices'][:1] for question in quiz['questions']]
+            self.client.put(f"/api/attempt_quiz/{quiz['id']}/", {'answers': answers}, format='json')
+
+        for path, payload_column in (('/api/history/quizzes/', '"quiz"'),
+                                     ('/api/history/quiz_attempts/', '"quiz_attempt"')):
+            with self.subTest(path=path):
+                with CaptureQueriesContext(connection) as context:
+                    first_page = self.client.get(path, {'limit': 2}).json()
+                # One query, which does not read the payloads.
+                self.assertEqual(len(context.captured_queries), 1)
+                self.assertNotIn(payload_column, context.captured_queries[0]['sql'].split(' FROM ')[0])
+                self.assertEqual([item['no_of_questions'] for item in first_page['results']], list(TOPIC_SIZES[:-3:-1]))
+                self.assertEqual(first_page['results'][0]['topic_name'], f'topic {TOPIC_SIZES[-1]}')
+
+                second_page = self.assertQueryBudget(1, self.client.get, path, {'before': first_page['next_before']})
+                self.assertEqual([item['no_of_questions'] for item in second_page.json()['results']],
+                                 list(TOPIC_SIZES[-3::-1]))
+                self.assertIsNone(second_page.json()['next_before'])
+
+                topic = self.topics[TOPIC_SIZES[0]]
+                response = self.client.get(path, {'topic': topic.id}).json()
+                self.assertEqual([item['topic'] for item in response['results']], [topic.id])
+
+                item = first_page['results'][0]
+                response = self.assertQueryBudget(1, self.client.get, f"{path}{item['id']}/")
+                self.assertStatus(response, 200)
+                self.assertEqual(response.json()['uuid'], item['uuid'])
+
+    def test_search(self):
+        for size, topic in self.topics.items():
+            with self.subTest(size=size):
+                response = self.assertQueryBudget(1, self.client.get, '/api/search/', {'q': f'topic {size} quest'})
+                self.assertStatus(response, 200)
+                self.assertEqual(len(response.json()['results']), 20)
+
+    def test_register(self):
+        response = self.assertQueryBudget(2, self.client.post, '/register/',
+                                          {'username': 'new_user', 'password': 'new password'}, format='json')
+        self.assertStatus(response, 201)
+
+    def test_check_quiz_answers_grades_with_prefetched_answers(self):
+        """Grading with the prefetched answers gives the same result as looking up every answer."""
+        topic = self.topics[TOPIC_SIZES[0]]
+        quiz = self.generate_quiz(topic, no_of_questions=TOPIC_SIZES[0])
+        answers = [question['choices'][:2] for question in quiz['questions']]
+        attempt = self.client.put(f"/api/attempt_quiz/{quiz['id']}/", {'answers': answers}, format='json').json()
+
+        for question in attempt['questions']:
+            question_model = Question.objects.get(creator=self.user, text=question['question_text'])
+            correct_answers = set(question_model.answers.values_list('text', flat=True))
+            for choice in question['choices']:
+                self.assertEqual(choice['correct'], choice['choice_text'] in correct_answers)
+
+
+    def test_stateless_quiz(self):
+        """A stateless quiz is not saved, and is attempted with its token instead of its id."""
+        for size, topic in self.topics.items():
+            with self.subTest(size=size):
+                quiz_count = Quiz.objects.count()
+                # The queries of a saved quiz (see test_generate_quiz), without the two that save it.
+                quiz = self.assertQueryBudget(9, self.generate_quiz, topic, no_of_questions=size, stateless=True)
+                self.assertEqual(Quiz.objects.count(), quiz_count)
+                self.assertNotIn('id', quiz)
+
+                answers = [question['choices'][:1] for question in quiz['questions']]
+                response = self.assertQueryBudget(6, self.client.post, '/api/attempt_quiz/',
+                                                  {'token': quiz['token'], 'answers': answers}, format='json')
+                self.assertStatus(response, 201)
+                attempt = response.json()
+                self.assertEqual([question['question_text'] for question in attempt['questions']],
+                                 [question['question_text'] for question in quiz['questions']])
+                self.assertIsNone(QuizAttempt.objects.get(id=attempt['id']).quiz_id)
+
+                # The same answers are graded the same as for a saved quiz with the same questions and choices.
+                for question in attempt['questions']:
+                    question_model = Question.objects.get(creator=self.user, text=question['question_text'])
+                    correct_answers = set(question_model.answers.values_list('text', flat=True))
+                    for choice in question['choices']:
+                        self.assertEqual(choice['correct'], choice['choice_text'] in correct_answers)
+
+    def test_stateless_quiz_rejects_invalid_tokens(self):
+        quiz = self.generate_quiz(self.topics[TOPIC_SIZES[0]], stateless=True)
+        answers = [question['choices'][:1] for question in quiz['questions']]
+        token = quiz['token']
+
+        tampered = token[:10] + ('A' if token[10] != 'A' else 'B') + token[11:]
+        other_user = User.objects.create_user(username='other', password='other')
+        for client_user, quiz_token in ((self.user, tampered), (other_user, token)):
+            with self.subTest(user=client_user.username, tampered=quiz_token != token):
+                self.client.force_authenticate(user=client_user, token=self.access_token)
+                response = self.client.post('/api/attempt_quiz/', {'token': quiz_token, 'answers': answers},
+                                            format='json')
+                self.assertStatus(response, 400)
+                self.assertEqual(response.json(), {"error_description": "Invalid or expired quiz token"})
+
+        self.client.force_authenticate(user=self.user, token=self.access_token)
+        with self.settings(QUIZ_TOKEN_MAX_AGE=-1):
+            response = self.client.post('/api/attempt_quiz/', {'token': token, 'answers': answers}, format='json')
+        self.assertStatus(response, 400)
+        self.assertStatus(self.client.post('/api/attempt_quiz/', {'token': token, 'answers': answers},
+                                           format='json'), 201)
+
+
+def columns_to_rows(columns):
+    """Convert a dict of lists back into a list of dicts. The inverse of rows_to_columns."""
+    keys = list(columns)
+    no_of_rows = len(columns[keys[0]]) if keys else 0
+    # A columnar dict per row, e.g. the choices of a question of a quiz attempt.
+    return [{key: columns_to_rows(columns[key][i]) if isinstance(columns[key][i], dict) else columns[key][i]
+             for key in keys} for i in range(no_of_rows)]
+
+
+def from_layout(payload):
+    """Returns the quiz or quiz attempt payload in the row layout, whichever layout it is in, as the client does."""
+    if payload.get('layout') != COLUMNAR:
+        return payload
+    return {key: columns_to_rows(value) if isinstance(value, dict) else value
+            for key, value in payload.items() if key != 'layout'}
+
+
+class PayloadFormatTestCase(TestCase):
+    """
+    Checks the orjson and MessagePack renderers and parsers, the content negotiation between them, and the columnar
+    layout of the quiz and quiz attempt payloads (see quiz/renderers.py and quiz/layouts.py).
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='formats')
+        application = get_application_model().objects.create(
+            user=cls.user, name='formats', client_type='public', authorization_grant_type='password')
+        cls.access_token = get_access_token_model().objects.create(
+            user=cls.user, application=application, token='formats', scope='read write',
+            expires=timezone.now() + timedelta(days=1))
+        cls.topic = build_topic(cls.user, 'formats', 10, seed=0)
+        cls.quiz = cls.topic.generate_quiz(no_of_questions=5, no_of_choices=4)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user, token=self.access_token)
+        performance_logger = logging.getLogger('quiz.performance')
+        self.addCleanup(performance_logger.setLevel, performance_logger.level)
+        performance_logger.setLevel(logging.WARNING)
+
+    def answers(self):
+        return [question['choices'][:1] for question in self.quiz.quiz['questions']]
+
+    def test_renderers_and_parsers(self):
+        data = {'text': 'caf\u00e9', 'numbers': [1, 2.5, None], 'nested': {'yes': True}}
+
+        content = ORJSONRenderer().render(data)
+        self.assertEqual(json.loads(content), data)
+        self.assertEqual(ORJSONParser().parse(BytesIO(content)), data)
+        self.assertIn(b'\n  ', ORJSONRenderer().render(data, renderer_context={'indent': 4}))
+        self.assertEqual(ORJSONRenderer().render(None), b'')
+
+        content = MessagePackRenderer().render(data)
+        self.assertEqual(msgpack.unpackb(content, raw=False), data)
+        self.assertEqual(MessagePackParser().parse(BytesIO(content)), data)
+        self.assertEqual(MessagePackRenderer().render(None), b'')
+
+        # Lazy strings and other types that orjson and msgpack do not know of go through DRF's encoder.
+        self.assertEqual(json.loads(ORJSONRenderer().render({'timedelta': timedelta(seconds=1)})),
+                         {'timedelta': '1.0'})
+
+        for parser, content in ((ORJSONParser(), b'{"answers": ['), (MessagePackParser(), b'\xc1')):
+            with self.subTest(parser=type(parser).__name__):
+                with self.assertRaises(ParseError):
+                    parser.parse(BytesIO(content))
+
+    def test_content_negotiation(self):
+        path = f'/api/generate_quiz/{self.quiz.id}/'
+        response = self.client.get(path)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(response.json(), self.quiz.quiz)
+
+        response = self.client.get(path, HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(msgpack.unpackb(response.content, raw=False), self.quiz.quiz)
+
+        response = self.client.put(f'/api/attempt_quiz/{self.quiz.id}/', msgpack.packb({'answers': self.answers()}),
+                                   content_type='application/msgpack', HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(len(msgpack.unpackb(response.content, raw=False)['questions']), 5)
+
+        for content_type, content in (('application/json', b'{"answers": ['), ('application/msgpack', b'\xc1')):
+            with self.subTest(content_type=content_type):
+                response = self.client.put(f'/api/attempt_quiz/{self.quiz.id}/', content, content_type=content_type)
+                self.assertEqual(response.status_code, 400, response.content)
+
+    def test_columnar_layout_round_trip(self):
+        attempt = self.quiz.check_quiz_answers(chosen_answers=self.answers()).quiz_attempt
+        for payload in (self.quiz.quiz, attempt):
+            with self.subTest(payload=sorted(payload)):
+                columnar = to_layout(payload, COLUMNAR)
+                self.assertEqual(columnar['layout'], COLUMNAR)
+                self.assertEqual(columnar['questions']['question_text'],
+                                 [question['question_text'] for question in payload['questions']])
+                self.assertEqual(from_layout(columnar), payload)
+                self.assertIs(from_layout(payload), payload)
+                self.assertIs(to_layout(payload), payload)
+
+        self.assertEqual(columns_to_rows(rows_to_columns([{'a': 1, 'b': []}, {'a': 2, 'b': [{'c': 3}]}])),
+                         [{'a': 1, 'b': []}, {'a': 2, 'b': [{'c': 3}]}])
+
+    def test_columnar_layout_is_requested_by_the_client(self):
+        path = f'/api/generate_quiz/{self.quiz.id}/'
+        for query, accept in (({'layout': 'columnar'}, 'application/json'),
+                              ({}, 'application/json; layout=columnar'),
+                              ({}, 'application/msgpack; layout=columnar')):
+            with self.subTest(query=query, accept=accept):
+                response = self.client.get(path, query, HTTP_ACCEPT=accept)
+                self.assertEqual(response.status_code, 200, response.content)
+                if accept.startswith('application/msgpack'):
+                    payload = msgpack.unpackb(response.content, raw=False)
+                else:
+                    payload = response.json()
+                self.assertEqual(payload['layout'], COLUMNAR)
+                self.assertEqual(from_layout(payload), self.quiz.quiz)
+
+        # Any other layout is the row layout.
+        self.assertEqual(self.client.get(path, {'layout': 'unknown'}).json(), self.quiz.quiz)
+
+
+async def async_request(method, path, data=None, token=None):
+    """
+    Send a request with an AsyncClient. Django 3.1's AsyncClient drops the headers passed as extra arguments and sends
+    a broken Content-Length, so the headers of the ASGI scope are set here. data is sent as JSON if it is not a string.
+    """
+    headers = [(b'host', b'testserver')]
+    if token:
+        headers.append((b'authorization', f'Bearer {token}'.encode()))
+    body = b''
+    if data is not None:
+        body = (data if isinstance(data, str) else json.dumps(data)).encode()
+        headers += [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]
+    return await AsyncClient().generic(method, path, body, headers=headers)
+
+
+class AsyncViewsTestCase(TransactionTestCase):
+    """
+    Checks that the async endpoints under /api/async/ (see quiz/async_views.py) behave like the sync ones, including
+    their errors. A TransactionTestCase, as the quiz executor threads have their own database connections, which do not
+    see the rows created in the transaction of a TestCase.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='async')
+        application = get_application_model().objects.create(
+            user=self.user, name='async', client_type='public', authorization_grant_type='password')
+        get_access_token_model().objects.create(
+            user=self.user, application=application, token='async', scope='read write',
+            expires=timezone.now() + timedelta(days=1))
+        self.topic = build_topic(self.user, 'async', 10, seed=0)
+        # With the token cache, the request body is not read while authenticating (oauthlib reads it to validate the
+        #  token), so the views are the first to parse it.
+        cache.clear()
+        self.addCleanup(cache.clear)
+        patcher = mock.patch.object(token_cache, 'shared_cache_alias', 'default')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        token_cache.clear()
+        self.addCleanup(token_cache.clear)
+        performance_logger = logging.getLogger('quiz.performance')
+        self.addCleanup(performance_logger.setLevel, performance_logger.level)
+        performance_logger.setLevel(logging.WARNING)
+
+    def assertStatus(self, response, status_code):
+        self.assertEqual(response.status_code, status_code, response.content[:500])
+
+    async def request(self, method, path, data=None):
+        return await async_request(method, path, data, token='async')
+
+    async def generate_quiz(self, topic_id, **data):
+        return await self.request('PUT', f'/api/async/generate_quiz/{topic_id}/',
+                                  {'no_of_questions': 5, 'no_of_choices': 4, **data})
+
+    async def test_generate_and_retrieve_quiz(self):
+        response = await self.generate_quiz(self.topic.id)
+        self.assertStatus(response, 201)
+        quiz = response.json()
+        self.assertEqual(len(quiz['questions']), 5)
+
+        response = await self.request('GET', f"/api/async/generate_quiz/{quiz['id']}/")
+        self.assertStatus(response, 200)
+        self.assertEqual(response.json(), quiz)
+
+        response = await self.request('GET', f"/api/async/generate_quiz/{quiz['id']}/?layout=columnar")
+        self.assertEqual(from_layout(response.json()), quiz)
+
+    async def test_attempt_quiz(self):
+        quiz = (await self.generate_quiz(self.topic.id)).json()
+        answers = [question['choices'][:1] for question in quiz['questions']]
+        response = await self.request('PUT', f"/api/async/attempt_quiz/{quiz['id']}/", {'answers': answers})
+        self.assertStatus(response, 201)
+        attempt = response.json()
+        self.assertEqual(len(attempt['questions']), 5)
+        self.assertEqual((await database_sync_to_async(QuizAttempt.objects.get)(id=attempt['id'])).quiz_id,
+                         quiz['id'])
+
+    async def test_stateless_quiz(self):
+        quiz_count = await database_sync_to_async(Quiz.objects.count)()
+        response = await self.generate_quiz(self.topic.id, stateless=True)
+        self.assertStatus(response, 201)
+        quiz = response.json()
+        self.assertNotIn('id', quiz)
+        self.assertEqual(await database_sync_to_async(Quiz.objects.count)(), quiz_count)
+
+        answers = [question['choices'][:1] for question in quiz['questions']]
+        response = await self.request('POST', '/api/async/attempt_quiz/', {'token': quiz['token'], 'answers': answers})
+        self.assertStatus(response, 201)
+        attempt = response.json()
+        self.assertEqual([question['question_text'] for question in attempt['questions']],
+                         [question['question_text'] for question in quiz['questions']])
+        self.assertIsNone((await database_sync_to_async(QuizAttempt.objects.get)(id=attempt['id'])).quiz_id)
+
+        tampered = quiz['token'][:-1] + ('A' if quiz['token'][-1] != 'A' else 'B')
+        response = await self.request('POST', '/api/async/attempt_quiz/', {'token': tampered, 'answers': answers})
+        self.assertStatus(response, 400)
+        self.assertEqual(response.json(), {"error_description": "Invalid or expired quiz token"})
+        self.assertStatus(await self.request('POST', '/api/async/attempt_quiz/', {'answers': answers}), 400)
+        self.assertStatus(await self.request('POST', '/api/async/attempt_quiz/', '{"token": '), 400)
+        self.assertStatus(await self.request('PUT', '/api/async/attempt_quiz/', {}), 405)
+
+    async def test_errors(self):
+        quiz = (await self.generate_quiz(self.topic.id)).json()
+        generate_path = f'/api/async/generate_quiz/{self.topic.id}/'
+        attempt_path = f"/api/async/attempt_quiz/{quiz['id']}/"
+        for path in (generate_path, attempt_path):
+            with self.subTest(path=path):
+                # A malformed body is a 400, as for the sync views.
+                response = await self.request('PUT', path, '{"answers": [')
+                self.assertStatus(response, 400)
+                self.assertIn('JSON parse error', response.json()['detail'])
+                self.assertStatus(await self.request('PUT', path, {'no_of_questions': 'many'}), 400)
+                self.assertStatus(await self.request('POST', path, {}), 405)
+
+        self.assertStatus(await self.generate_quiz(0), 400)
+        self.assertStatus(await self.request('GET', '/api/async/generate_quiz/0/'), 400)
+        self.assertStatus(await self.request('PUT', '/api/async/attempt_quiz/0/', {'answers': []}), 400)
+        empty_topic = await database_sync_to_async(Topic.objects.create)(creator=self.user, name='empty')
+        response = await self.generate_quiz(empty_topic.id)
+        self.assertStatus(response, 400)
+        self.assertEqual(response.json(),
+                         {"error_description": "Topic has no questions. Add some questions to the topic first."})
+
+
+class InstrumentationTestCase(TestCase):
+    """
+    Checks the per-request timings (see quiz/instrumentation.py), the Server-Timing header of PerformanceMiddleware and
+    the histograms at /api/performance/.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='timed', is_staff=True)
+        application = get_application_model().objects.create(
+            user=cls.user, name='timed', client_type='public', authorization_grant_type='password')
+        cls.access_token = get_access_token_model().objects.create(
+            user=cls.user, application=application, token='timed', scope='read write',
+            expires=timezone.now() + timedelta(days=1))
+        cls.topic = build_topic(cls.user, 'timed', 10, seed=0)
+
+    def setUp(self):
+        performance_logger = logging.getLogger('quiz.performance')
+        self.addCleanup(performance_logger.setLevel, performance_logger.level)
+        performance_logger.setLevel(logging.WARNING)
+        route_histograms.clear()
+        self.addCleanup(route_histograms.clear)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user, token=self.access_token)
+
+    def server_timing(self, response):
+        """Returns {metric name: (duration or None, description or None)} from the Server-Timing header."""
+        server_timing = {}
+        for metric in response['Server-Timing'].split(', '):
+            name, *params = metric.split(';')
+            params = dict(param.split('=', 1) for param in params)
+            server_timing[name] = (float(params['dur']) if 'dur' in params else None, params.get('desc'))
+        return server_timing
+
+    def test_server_timing(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.put(f'/api/generate_quiz/{self.topic.id}/', {'no_of_questions': 5,
+                                                                                 'no_of_choices': 4}, format='json')
+        self.assertEqual(response.status_code, 201)
+        server_timing = self.server_timing(response)
+        self.assertEqual(list(server_timing)[0], 'db')
+        self.assertEqual(server_timing['db'][1], f'"{len(context.captured_queries)} queries"')
+        for phase in ('generate_quiz.load', 'generate_quiz.sample', 'generate_quiz.persist', 'serialize'):
+            self.assertIn(phase, server_timing)
+        self.assertGreaterEqual(server_timing['total'][0], server_timing['db'][0])
+        self.assertGreater(server_timing['total'][0], server_timing['generate_quiz.sample'][0])
+
+        quiz_id = response.json()['id']
+        response = self.client.put(f'/api/attempt_quiz/{quiz_id}/', {'answers': [[]] * 5}, format='json')
+        for phase in ('check_quiz_answers.load', 'check_quiz_answers.grade', 'check_quiz_answers.persist'):
+            self.assertIn(phase, self.server_timing(response))
+
+    def test_queries_and_phases(self):
+        # Outside of a request, nothing is recorded.
+        self.assertIsNone(current_timings())
+        with timed('outside'):
+            Topic.objects.count()
+        PhaseTimer('outside').lap('lap')
+
+        timings, token = start_request_timings()
+        try:
+            self.assertIs(current_timings(), timings)
+            Topic.objects.count()
+            list(Topic.objects.all())
+            with timed('sleep'):
+                time.sleep(0.01)
+            with timed('sleep'):
+                time.sleep(0.01)
+            phases = PhaseTimer('phases')
+            phases.lap('first')
+            time.sleep(0.01)
+            phases.lap('second')
+        finally:
+            stop_request_timings(token)
+        self.assertIsNone(current_timings())
+
+        self.assertEqual(timings.query_count, 2)
+        self.assertGreater(timings.query_time, 0)
+        self.assertEqual(list(timings.phases), ['sleep', 'phases.first', 'phases.second'])
+        self.assertGreaterEqual(timings.phases['sleep'], 0.02)
+        self.assertLess(timings.phases['phases.first'], 0.01)
+        self.assertGreaterEqual(timings.phases['phases.second'], 0.01)
+
+    def test_rolling_histogram(self):
+        histogram = RollingHistogram(buckets=(10, 50), window=50)
+        for value in range(1, 101):
+            histogram.observe(value)
+        snapshot = histogram.snapshot()
+        # The percentiles and buckets only hold the last 50 values, 51 to 100.
+        self.assertEqual((snapshot['count'], snapshot['sum'], snapshot['window']), (100, 5050, 50))
+        self.assertEqual((snapshot['p50'], snapshot['p95'], snapshot['p99']), (76, 98, 100))
+        self.assertEqual(snapshot['buckets'], {'<=10': 0, '<=50': 0, '>50': 50})
+
+        snapshot = RollingHistogram(buckets=(10,), window=10).snapshot()
+        self.assertEqual((snapshot['count'], snapshot['p50'], snapshot['buckets']), (0, None, {'<=10': 0, '>10': 0}))
+
+    def test_performance_stats(self):
+        self.client.get('/api/topics/')
+        response = self.client.get('/api/performance/')
+        self.assertEqual(response.status_code, 200)
+        topic_list = response.json()['routes']['topic-list']
+        self.assertEqual(topic_list['total_ms']['count'], 1)
+        self.assertEqual(topic_list['query_count']['count'], 1)
+
+        user = User.objects.create_user(username='not_timed')
+        self.client.force_authenticate(user=user, token=self.access_token)
+        self.assertEqual(self.client.get('/api/performance/').status_code, 403)
+        self.assertEqual(Client().get('/api/performance/').status_code, 401)
+
+
+class ConnectionPoolTestCase(SimpleTestCase):
+    """
+    Checks the connection pool and the health checks of the database backends (see quiz/backends/pooling.py), with
+    the SQLite backend and a database file, as connections to in-memory databases are not pooled.
+    """
+
+    def setUp(self):
+        database_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, database_dir)
+        self.database = {'ENGINE': 'quiz.backends.sqlite3', 'NAME': os.path.join(database_dir, 'pool.sqlite3'),
+                         'CONN_MAX_AGE': 0, 'CONN_HEALTH_CHECKS': True, 'POOL_SIZE': 2, 'POOL_TIMEOUT': 0.1,
+                         'POOL_CHECK_DELAY': 0}
+        connections.databases['test_pool'] = self.database
+        self.addCleanup(connections.databases.pop, 'test_pool')
+        # Not used itself, only copied, with the default settings filled in.
+        self.template = connections['test_pool']
+        self.addCleanup(connections.__delitem__, 'test_pool')
+        self.wrappers = []
+
+    def tearDown(self):
+        for wrapper in self.wrappers:
+            wrapper.close()
+        close_pool('test_pool')
+
+    def wrapper(self, **settings_dict):
+        """A new DatabaseWrapper for the database, as every thread gets its own."""
+        wrapper = self.template.copy()
+        wrapper.settings_dict.update(settings_dict)
+        self.wrappers.append(wrapper)
+        return wrapper
+
+    def stats(self):
+        return pool_stats()['test_pool']
+
+    def test_connections_are_reused(self):
+        first, second = self.wrapper(), self.wrapper()
+        first.ensure_connection()
+        raw_connection = first.connection
+        first.close()
+        self.assertEqual((self.stats()['open'], self.stats()['idle']), (1, 1))
+
+        second.ensure_connection()
+        self.assertIs(second.connection, raw_connection)
+        self.assertEqual((self.stats()['created'], self.stats()['acquired'], self.stats()['in_use']), (1, 2, 1))
+
+    def test_pool_timeout(self):
+        for wrapper in (self.wrapper(), self.wrapper()):
+            wrapper.ensure_connection()
+        with self.assertRaisesMessage(OperationalError, 'POOL_SIZE=2'):
+            self.wrapper().ensure_connection()
+        self.assertEqual((self.stats()['timeouts'], self.stats()['open']), (1, 2))
+
+        # A connection returned from another thread is handed to the one that is waiting.
+        self.wrappers[0].close()
+        wrapper = self.wrapper(POOL_TIMEOUT=5)
+        thread = threading.Thread(target=wrapper.ensure_connection)
+        self.wrappers[1].close()
+        thread.start()
+        thread.join()
+        self.assertIsNotNone(wrapper.connection)
+
+    def test_connections_that_fail_the_check_are_discarded(self):
+        wrapper = self.wrapper()
+        wrapper.ensure_connection()
+        broken_connection = wrapper.connection
+        wrapper.close()
+        # e.g. closed by the database while it was idle.
+        broken_connection.close()
+
+        wrapper.ensure_connection()
+        self.assertIsNot(wrapper.connection, broken_connection)
+        with wrapper.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        self.assertEqual((self.stats()['discarded'], self.stats()['created'], self.stats()['open']), (1, 2, 1))
+
+    def test_open_transactions_are_rolled_back(self):
+        wrapper = self.wrapper()
+        with wrapper.cursor() as cursor:
+            cursor.execute('CREATE TABLE t (x INTEGER)')
+        raw_connection = wrapper.connection
+        raw_connection.execute('BEGIN')
+        raw_connection.execute('INSERT INTO t VALUES (1)')
+        self.assertTrue(raw_connection.in_transaction)
+        wrapper.close()
+
+        wrapper.ensure_connection()
+        self.assertIs(wrapper.connection, raw_connection)
+        self.assertFalse(raw_connection.in_transaction)
+        with wrapper.cursor() as cursor:
+            cursor.execute('SELECT COUNT(*) FROM t')
+            self.assertEqual(cursor.fetchone(), (0,))
+
+    def test_health_check_replaces_a_dead_persistent_connection(self):
+        wrapper = self.wrapper(POOL_SIZE=0, CONN_MAX_AGE=60)
+        wrapper.ensure_connection()
+        dead_connection = wrapper.connection
+        # As at the end of a request: the persistent connection is kept.
+        wrapper.close_if_unusable_or_obsolete()
+        self.assertIs(wrapper.connection, dead_connection)
+        dead_connection.close()
+
+        # The next request checks it before its first query, and opens a new one.
+        with wrapper.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        self.assertIsNot(wrapper.connection, dead_connection)
+
+        # Only once per request.
+        with mock.patch.object(wrapper, 'is_usable') as is_usable:
+            wrapper.ensure_connection()
+            is_usable.assert_not_called()
+            wrapper.close_if_unusable_or_obsolete()
+            wrapper.ensure_connection()
+            is_usable.assert_called_once()
+
+
+class AccessTokenCacheTestCase(TestCase):
+    """Checks the cache of validated access tokens, and that revoked tokens are dropped by every worker at once."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='cached')
+        cls.application = get_application_model().objects.create(
+            user=cls.user, name='cached', client_type='public', authorization_grant_type='password')
+        cls.access_token = get_access_token_model().objects.create(
+            user=cls.user, application=cls.application, token='cached', scope='read write',
+            expires=timezone.now() + timedelta(days=1))
+
+    def setUp(self):
+        performance_logger = logging.getLogger('quiz.performance')
+        self.addCleanup(performance_logger.setLevel, performance_logger.level)
+        performance_logger.setLevel(logging.WARNING)
+        cache.clear()
+        self.addCleanup(cache.clear)
+        # The token cache of this process, with the default cache as the shared cache. worker is the one of another
+        #  process.
+        patcher = mock.patch.object(token_cache, 'shared_cache_alias', 'default')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        token_cache.clear()
+        self.addCleanup(token_cache.clear)
+        self.worker = AccessTokenCache(ttl=300, max_size=10, shared_cache_alias='default')
+
+    def verify(self, token='cached'):
+        return verify_request(RequestFactory().get('/api/topics/', HTTP_AUTHORIZATION=f'Bearer {token}'))[0]
+
+    def test_cache_hit(self):
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.verify(), self.access_token)
+        self.assertTrue(any('oauth2_provider_accesstoken' in query['sql'] for query in context.captured_queries))
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.verify().user, self.user)
+        # In the shared cache as well.
+        with self.assertNumQueries(0):
+            self.assertEqual(self.worker.get('cached'), self.access_token)
+
+        client = APIClient(HTTP_AUTHORIZATION='Bearer cached')
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(client.get('/api/topics/').status_code, 200)
+        self.assertFalse(any('oauth2_provider_accesstoken' in query['sql'] for query in context.captured_queries))
+
+    def test_cached_until_the_token_expires(self):
+        access_token = get_access_token_model().objects.create(
+            user=self.user, application=self.application, token='expiring', scope='read write',
+            expires=timezone.now() + timedelta(seconds=10))
+        self.worker.set(access_token)
+        expires_at, _ = self.worker._local[self.worker.key('expiring')]
+        self.assertLessEqual(expires_at - time.monotonic(), 10)
+
+        expired = get_access_token_model().objects.create(
+            user=self.user, application=self.application, token='expired', scope='read write',
+            expires=timezone.now() - timedelta(seconds=1))
+        self.worker.set(expired)
+        self.assertIsNone(self.worker.get('expired'))
+
+    def test_revocation_reaches_every_worker(self):
+        self.verify()
+        self.assertEqual(self.worker.get('cached'), self.access_token)
+
+        # Revoked in this process: the other worker drops its own copy of the token at once.
+        self.access_token.delete()
+        self.assertIsNone(self.worker.get('cached'))
+        self.assertIsNone(token_cache.get('cached'))
+        self.assertIsNone(self.verify())
+
+    def test_revoked_while_validating(self):
+        # The other worker validated the token just before it was revoked, and caches it just after.
+        access_token = get_access_token_model().objects.get(token='cached')
+        get_access_token_model().objects.get(token='cached').delete()
+        self.worker.set(access_token)
+        self.assertIsNone(self.worker.get('cached'))
+        self.assertIsNone(token_cache.get('cached'))
+        # Or had checked for the revocation just before it, and put the token in the shared cache.
+        cache.set(AccessTokenCache.key('cached'), access_token)
+        self.assertIsNone(self.worker.get('cached'))
+        self.assertIsNone(self.verify())
+
+    def test_deactivated_user(self):
+        self.verify()
+        self.worker.get('cached')
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertIsNone(self.worker.get('cached'))
+        self.assertIsNone(token_cache.get('cached'))
+        self.assertFalse(self.verify().user.is_active)
+
+    def test_not_cached_without_a_shared_cache(self):
+        worker = AccessTokenCache(ttl=300, max_size=10)
+        worker.set(self.access_token)
+        self.assertIsNone(worker.get('cached'))
+
+    def test_shared_cache_check(self):
+        caches = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+                  'shared': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                             'LOCATION': tempfile.gettempdir()}}
+        for alias, error_ids in (('', []), ('shared', []), ('default', ['quiz.E002']), ('missing', ['quiz.E001'])):
+            with self.subTest(alias=alias), self.settings(CACHES=caches, OAUTH2_TOKEN_CACHE=alias):
+                self.assertEqual([error.id for error in check_token_cache(None)], error_ids)
+
+
+class LeaderboardTestCase(TestCase):
+    """Checks the ranks and percentiles of the leaderboards (see quiz/leaderboards.py)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [User.objects.create_user(username=f'player{i}') for i in range(4)]
+        cls.topic = Topic.objects.create(creator=cls.users[0], name='topic')
+        cls.other_topic = Topic.objects.create(creator=cls.users[0], name='other topic')
+        # Best scores overall: player0 0.9, player1 0.7, player2 0.7, player3 0.2.
+        scores = [(0, cls.topic, 0.5), (0, cls.other_topic, 0.9), (1, cls.topic, 0.7), (1, cls.topic, 0.1),
+                  (2, cls.topic, 0.7), (3, cls.topic, 0.2)]
+        cls.attempts = [QuizAttempt.objects.create(user=cls.users[user], topic=topic, score=score, quiz_attempt={})
+                        for user, topic, score in scores]
+
+    def test_leaders(self):
+        self.assertEqual(
+            [(leader['username'], leader['best_score'], leader['rank'], leader['attempts'])
+             for leader in leaderboards.compute_leaders()],
+            [('player0', 0.9, 1, 2), ('player1', 0.7, 2, 2), ('player2', 0.7, 2, 1), ('player3', 0.2, 4, 1)],
+        )
+        topic_leaders = leaderboards.compute_leaders(self.topic, limit=2)
+        self.assertEqual([(leader['username'], leader['rank']) for leader in topic_leaders],
+                         [('player1', 1), ('player2', 1)])
+        self.assertEqual(topic_leaders[0]['percentile'], 2 / 3)
+
+    def test_user_standing(self):
+        self.assertEqual(leaderboards.user_standing(self.users[2]), {'rank': 2, 'best_score': 0.7, 'attempts': 1})
+        self.assertEqual(leaderboards.user_standing(self.users[0], self.topic)['rank'], 3)
+        self.assertIsNone(leaderboards.user_standing(self.users[1], self.other_topic))
+
+    def test_attempt_percentile(self):
+        # 2 of the 5 other attempts at the topic scored lower than 0.5.
+        self.assertEqual(leaderboards.attempt_percentile(self.attempts[0], self.topic), 2 / 4)
+        self.assertEqual(leaderboards.attempt_percentile(self.attempts[1]), 1.0)
+
+
+class SyntheticDataTestCase(TestCase):
+    """Checks the generate_synthetic_data command (see quiz/synthetic.py)."""
+
+    def test_generate_synthetic_data(self):
+        output = StringIO()
+        call_command('generate_synthetic_data', users=2, topics_per_user=2, questions_per_topic=10,
+                     quizzes_per_topic=3, attempts_per_quiz=2, seed=1, stdout=output, stderr=StringIO())
+        counts = json.loads(output.getvalue())
+        self.assertEqual({key: counts[key] for key in ('users', 'topics', 'questions', 'quizzes', 'quiz_attempts')},
+                         {'users': 2, 'topics': 4, 'questions': 40, 'quizzes': 12, 'quiz_attempts': 24})
+        self.assertEqual(Quiz.objects.count(), 12)
+        self.assertEqual(QuizAttempt.objects.count(), 24)
+        attempt = QuizAttempt.objects.order_by('id').last()
+        self.assertEqual(attempt.quiz_attempt['id'], attempt.id)
+        self.assertEqual(attempt.quiz.quiz['id'], attempt.quiz_id)
+
+        with self.assertRaises(CommandError):
+            call_command('generate_synthetic_data', users=1, stdout=StringIO(), stderr=StringIO())
+
+        # The ids of the quizzes and quiz attempts were allocated up front and inserted explicitly. The database carries
+        #  on after them, for these and for the other rows made with bulk inserts.
+        user = User.objects.get(username='synthetic_user0')
+        topic = user.topics.first()
+        question = Question.objects.create(creator=user, text='made with the ORM')
+        answer = Answer.objects.create(creator=user, text='made with the ORM')
+        question.answers.add(answer)
+        topic.questions.add(question)
+        self.assertEqual(question.id, Question.objects.order_by('id').values_list('id', flat=True).last())
+        self.assertEqual(answer.id, Answer.objects.order_by('id').values_list('id', flat=True).last())
+
+        quiz = topic.generate_quiz(no_of_questions=5, no_of_choices=4)
+        self.assertGreater(quiz.id, attempt.quiz_id)
+        quiz_attempt = quiz.check_quiz_answers(chosen_answers=[[]] * 5)
+        self.assertGreater(quiz_attempt.id, attempt.id)
+        self.assertEqual(IdAllocator(Quiz, QuizAttempt)(QuizAttempt), quiz_attempt.id + 1)
+
+    def test_loadtest_counts_connection_errors(self):
+        # A port that nothing listens on.
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        output = StringIO()
+        call_command('loadtest', base_url=f'http://127.0.0.1:{port}', token='token', topic=1, requests=3,
+                     concurrency=2, timeout=5, stdout=output)
+        report = json.loads(output.getvalue())
+        self.assertEqual(list(report['endpoints']), ['generate_quiz'])
+        generate_quiz = report['endpoints']['generate_quiz']
+        self.assertEqual((generate_quiz['requests'], generate_quiz['errors']), (3, 3))
+
+
+class BootstrapTestCase(TestCase):
+    """Checks that the bootstrap command (run on every container start, see run_django.sh) can run again and again."""
+
+    def test_bootstrap_is_idempotent(self):
+        static_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, static_root)
+        outputs = []
+        with self.settings(STATIC_ROOT=static_root):
+            for _ in range(2):
+                output = StringIO()
+                call_command('bootstrap', stdout=output)
+                outputs.append({line.split()[0]: line.split('s  ', 1)[-1] for line in output.getvalue().splitlines()})
+
+        self.assertEqual(outputs[0]['collectstatic'], 'collected')
+        self.assertEqual((outputs[0]['admin'], outputs[0]['oauth']), ('created', 'created'))
+        self.assertEqual([outputs[1][step] for step in ('migrate', 'collectstatic', 'admin', 'oauth')],
+                         ['up to date', 'up to date', 'exists', 'exists'])
+
+        self.assertEqual(User.objects.filter(username='admin', is_superuser=True).count(), 1)
+        application = get_application_model().objects.get(client_id='QuizAppClientID')
+        self.assertEqual(application.user.username, 'admin')
+        self.assertEqual(application.authorization_grant_type, get_application_model().GRANT_PASSWORD)
+
+
+class UUIDTestCase(TestCase):
+    """Checks that every object gets a unique UUID, including the ones created with bulk_create."""
+
+    def test_bulk_create_sets_the_uuids(self):
+        user = User.objects.create_user(username='uuid')
+        topic = build_topic(user, 'uuid', 10)
+        answers = [Answer(creator=user, text='with a uuid'), Answer(creator=user, text='without a uuid', uuid=None)]
+        Answer.objects.bulk_create(answers)
+        self.assertFalse(Answer.objects.filter(uuid__isnull=True).exists())
+        self.assertFalse(Question.objects.filter(uuid__isnull=True).exists())
+        self.assertIsNotNone(topic.uuid)
+
+        with self.assertRaises(IntegrityError):
+            Answer.objects.create(creator=user, text='duplicate', uuid=answers[0].uuid)
+
+
+class SearchTestCase(TestCase):
+    """Checks the search endpoint, and that the write paths of the API keep the search index up to date."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='searcher')
+        cls.other_user = User.objects.create_user(username='other searcher')
+        application = get_application_model().objects.create(
+            user=cls.user, name='search', client_type='public', authorization_grant_type='password')
+        cls.access_token = get_access_token_model().objects.create(
+            user=cls.user, application=application, token='search', scope='read write',
+            expires=timezone.now() + timedelta(days=1))
+        cls.topic = build_topic(cls.user, 'geography', 30, seed=0)
+        build_topic(cls.other_user, 'geography', 30, seed=0)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user, token=self.access_token)
+
+    def search(self, **params):
+        response = self.client.get('/api/search/', params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_search_only_finds_the_users_own_questions_and_answers(self):
+        results = self.search(q='Geography Question 1', limit=100)['results']
+        # Questions 1 and 10 to 19, with 'question 1' being the best match.
+        self.assertEqual(len(results), 11)
+        self.assertEqual(results[0]['text'], 'geography question 1')
+        self.assertEqual(set(Question.objects.filter(id__in=[result['id'] for result in results])
+                             .values_list('creator', flat=True)), {self.user.id})
+
+    def test_type_and_pagination(self):
+        first_page = self.search(q='geography', type='answer', limit=10)
+        self.assertEqual({result['type'] for result in first_page['results']}, {'answer'})
+        self.assertEqual(first_page['next_offset'], 10)
+        last_page = self.search(q='geography', type='answer', limit=10, offset=10)
+        # build_topic creates 15 answers for 30 questions.
+        self.assertEqual(len(last_page['results']), 5)
+        self.assertIsNone(last_page['next_offset'])
+
+    def test_write_paths_update_the_index(self):
+        response = self.client.post('/api/qna/', {
+            'topic': self.topic.id, 'question': 'What is the capital of Burkina Faso?', 'answers': ['Ouagadougou'],
+            'wrong_answers': ['Niamey'],
+        }, format='json')
+        question_id = response.json()['question_id']
+        answer_id = response.json()['answers'][0]['answer_id']
+        self.assertEqual([result['id'] for result in self.search(q='burkina')['results']], [question_id])
+
+        self.client.put(f'/api/questions/{question_id}/', {'text': 'What is the capital of Mali?',
+                                                           'creator': self.user.id}, format='json')
+        self.assertEqual(self.search(q='burkina')['results'], [])
+        self.assertEqual([result['id'] for result in self.search(q='mali')['results']], [question_id])
+
+        # The only correct answer of a question cannot be deleted.
+        self.client.delete(f'/api/answers/{answer_id}/', {'question_id': question_id}, format='json')
+        self.assertEqual(len(self.search(q='ouagadougou')['results']), 1)
+        Question.objects.get(id=question_id).answers.add(Answer.objects.create(creator=self.user, text='Bamako'))
+        self.client.delete(f'/api/answers/{answer_id}/', {'question_id': question_id}, format='json')
+        self.assertEqual(self.search(q='ouagadougou')['results'], [])
+
+    def test_rebuild(self):
+        Question.objects.create(creator=self.user, text='Not indexed yet')
+        self.assertEqual(self.search(q='indexed')['results'], [])
+        call_command('rebuild_search_index', stdout=open(os.devnull, 'w'))
+        self.assertEqual(len(self.search(q='indexed')['results']), 1)
+
+
+class AdminTestCase(TestCase):
+    """Checks the bulk edits of the admin actions, the estimated counts and the change lists."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('quizadmin', 'quizadmin@example.com', 'password')
+        cls.user = User.objects.create_user(username='editor')
+        cls.topic = build_topic(cls.user, 'history', 20, seed=0)
+        cls.other_topic = Topic.objects.create(creator=cls.user, name='archive')
+
+    def test_move_questions(self):
+        other_users_question = build_topic(User.objects.create_user(username='stranger'), 'history', 1).questions.get()
+        questions = Question.objects.filter(text__in=['history question 1', 'history question 2'])
+        with self.assertNumQueries(5):
+            moved = bulk_edits.move_questions(questions | Question.objects.filter(id=other_users_question.id),
+                                              self.other_topic)
+        self.assertEqual(moved, 2)
+        self.assertEqual(set(self.other_topic.questions.values_list('text', flat=True)),
+                         {'history question 1', 'history question 2'})
+        self.assertEqual(self.topic.questions.count(), 18)
+        self.assertEqual(other_users_question.topic.count(), 1)
+        # Moving them again changes nothing.
+        self.assertEqual(bulk_edits.move_questions(questions, self.other_topic), 2)
+        self.assertEqual(self.other_topic.questions.count(), 2)
+
+    def test_merge_duplicate_answers(self):
+        keeper = Answer.objects.create(creator=self.user, text='Waterloo')
+        duplicate = Answer.objects.create(creator=self.user, text=' waterloo ')
+        wrong_duplicate = Answer.objects.create(creator=self.user, text='WATERLOO')
+        other_users_answer = Answer.objects.create(creator=User.objects.create_user(username='stranger'),
+                                                   text='waterloo')
+        search.index([keeper, duplicate, wrong_duplicate])
+        question, other_question = Question.objects.filter(topic=self.topic)[:2]
+        question.answers.add(keeper, duplicate)
+        question.wrong_answers.add(wrong_duplicate)
+        other_question.wrong_answers.add(duplicate, wrong_duplicate)
+
+        merged = bulk_edits.merge_duplicate_answers(Answer.objects.filter(text__iendswith='waterloo '))
+        self.assertEqual(merged, 0)
+        merged = bulk_edits.merge_duplicate_answers(Answer.objects.filter(text__icontains='waterloo'))
+        self.assertEqual(merged, 2)
+        self.assertEqual(set(Answer.objects.filter(text__icontains='waterloo')), {keeper, other_users_answer})
+        self.assertEqual(list(question.answers.filter(text__icontains='waterloo')), [keeper])
+        self.assertEqual(list(question.wrong_answers.filter(text__icontains='waterloo')), [])
+        self.assertEqual(list(other_question.wrong_answers.filter(text__icontains='waterloo')), [keeper])
+        self.assertEqual([result['id'] for result in search.search(self.user, 'waterloo')], [keeper.id])
+
+    def test_estimated_count(self):
+        questions = Question.objects.order_by('id')
+        with override_settings(ADMIN_EXACT_COUNT_THRESHOLD=5):
+            # SQLite estimates with the largest id.
+            expected = questions.last().id if connection.vendor == 'sqlite' else questions.count()
+            self.assertEqual(EstimatedCountPaginator(questions, 10).count, expected)
+            self.assertEqual(EstimatedCountPaginator(questions.filter(creator=self.user), 10).count, 20)
+        self.assertEqual(EstimatedCountPaginator(questions, 10).count, 20)
+
+    @override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+    def test_change_lists(self):
+        search.index(self.topic.questions.all())
+        client = Client()
+        client.force_login(self.admin)
+        for model in ('question', 'answer', 'topic', 'quiz', 'quizattempt'):
+            response = client.get(f'/admin/quiz/{model}/')
+            self.assertEqual(response.status_code, 200, model)
+        response = client.get('/admin/quiz/question/', {'q': 'question 7', 'topic__id__exact': self.topic.id,
+                                                         'creator__id__exact': self.user.id})
+        self.assertEqual([question.text for question in response.context['cl'].result_list],
+                         ['history question 7'])
+        self.assertContains(response, 'quiz-autocomplete-filter')
+
+        response = client.post('/admin/quiz/question/', {
+            'action': 'move_to_topic', 'topic': self.other_topic.id, '_selected_action': [
+                question.id for question in response.context['cl'].result_list],
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(list(self.other_topic.questions.values_list('text', flat=True)), ['history question 7'])
+
+
+class SamplingTestCase(SimpleTestCase):
+    """Checks the alias tables and the question weights of the adaptive quizzes (see quiz/sampling.py)."""
+
+    def test_alias_table_picks_in_proportion_to_the_weights(self):
+        weights = [1, 2, 3, 0.5, 8, 0.05]
+        table = sampling.AliasTable.build(weights)
+        # The chance of picking an index is the chance of landing on its own slot and keeping it, plus the chance of
+        #  landing on a slot that has it as its alias and not keeping that slot.
+        for index, weight in enumerate(weights):
+            chance = sum((table.probabilities[slot] if slot == index else 0) +
+                         (1 - table.probabilities[slot] if table.aliases[slot] == index else 0)
+                         for slot in range(len(weights))) / len(weights)
+            self.assertAlmostEqual(chance, weight / sum(weights))
+
+    def test_sample_distinct(self):
+        rng = random.Random(0)
+        weights = [1.0] * 10 + [16.0] * 2
+        table = sampling.AliasTable.build(weights)
+        for k in (1, 5, 6, 11, 12, 20):
+            with self.subTest(k=k):
+                indexes = sampling.sample_distinct(table, weights, k, rng)
+                self.assertEqual(len(indexes), min(k, len(weights)))
+                self.assertEqual(len(set(indexes)), len(indexes))
+
+    def test_weights(self):
+        self.assertGreater(sampling.next_weight(sampling.DEFAULT_WEIGHT, 0), sampling.DEFAULT_WEIGHT)
+        self.assertLess(sampling.next_weight(sampling.DEFAULT_WEIGHT, 1), sampling.DEFAULT_WEIGHT)
+        self.assertEqual(sampling.next_weight(sampling.MAX_WEIGHT, 0), sampling.MAX_WEIGHT)
+
+        now = timezone.now()
+        self.assertEqual(sampling.effective_weight(4.0, now, now), 4.0)
+        self.assertEqual(sampling.effective_weight(4.0, now - sampling.RECOVERY_PERIOD, now), sampling.DEFAULT_WEIGHT)
+
+
+class BitsetTestCase(SimpleTestCase):
+    """Checks the bitsets of the rotation quizzes (see quiz/sampling.py)."""
+
+    def test_mark_and_scan(self):
+        bitset = sampling.mark_seen(b'', [0, 3, 8, 19], 20)
+        self.assertEqual(len(bitset), 3)
+        self.assertEqual(sampling.count_seen(bitset), 4)
+        self.assertTrue(sampling.is_seen(bitset, 19))
+        self.assertFalse(sampling.is_seen(bitset, 1))
+        self.assertFalse(sampling.is_seen(bitset, 100))
+        self.assertEqual(sampling.unseen_indexes(bitset, 20),
+                         [index for index in range(20) if index not in (0, 3, 8, 19)])
+        self.assertEqual(sampling.unseen_indexes(sampling.mark_seen(b'', range(16), 16), 16), [])
+
+    def test_pick_unseen_covers_every_index_before_starting_over(self):
+        rng = random.Random(0)
+        bitset = b''
+        picked = []
+        for _ in range(3):
+            indexes, bitset = sampling.pick_unseen(bitset, 10, 3, rng)
+            picked += indexes
+        self.assertEqual(len(set(picked)), 9)
+        # One index left: it is picked first, and the two others start the next round.
+        indexes, bitset = sampling.pick_unseen(bitset, 10, 3, rng)
+        self.assertEqual(set(range(10)) - set(picked), {indexes[0]})
+        self.assertEqual(len(set(indexes)), 3)
+        self.assertEqual(sampling.count_seen(bitset), 2)
+        self.assertEqual(set(sampling.unseen_indexes(bitset, 10)), set(range(10)) - set(indexes[1:]))
+
+
+class AdaptiveQuizTestCase(TestCase):
+    """Checks that grading updates the question weights, and that the adaptive quizzes follow them."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='adaptive')
+        cls.topic = build_topic(cls.user, 'adaptive', 20, answers_per_question=(1, 1), seed=0)
+
+    def test_wrong_answers_raise_the_weights(self):
+        quiz = self.topic.generate_quiz(no_of_questions=20, no_of_choices=4, adaptive=True)
+        # Not choosing anything gets every question wrong.
+        quiz.check_quiz_answers([[] for _ in quiz.quiz['questions']])
+        weights = set(QuestionWeight.objects.filter(user=self.user).values_list('weight', flat=True))
+        self.assertEqual(weights, {sampling.next_weight(sampling.DEFAULT_WEIGHT, 0)})
+        self.assertTrue(QuestionSampler.objects.get(user=self.user, topic=self.topic).stale)
+
+        # The weights that are there already are updated (as when two attempts are graded at the same time).
+        quiz.check_quiz_answers([[] for _ in quiz.quiz['questions']])
+        weights = QuestionWeight.objects.filter(user=self.user).values_list('weight', flat=True)
+        self.assertEqual(len(weights), 20)
+        for weight in weights:
+            self.assertAlmostEqual(weight, sampling.next_weight(sampling.next_weight(sampling.DEFAULT_WEIGHT, 0), 0))
+
+    def test_weights_are_only_kept_for_adaptive_topics(self):
+        quiz = self.topic.generate_quiz(no_of_questions=20, no_of_choices=4)
+        quiz.check_quiz_answers([[] for _ in quiz.quiz['questions']])
+        self.assertFalse(QuestionWeight.objects.exists())
+
+    def test_adaptive_quiz_prefers_heavy_questions(self):
+        questions = list(self.topic.questions.order_by('id'))
+        heavy = {question.text for question in questions[:2]}
+        QuestionWeight.objects.bulk_create(
+            QuestionWeight(user=self.user, question=question, answered_at=timezone.now(),
+                           weight=sampling.MAX_WEIGHT if question.text in heavy else sampling.MIN_WEIGHT)
+            for question in questions
+        )
+        random.seed(0)
+        picked = [question['question_text'] for _ in range(20) for question in
+                  self.topic.generate_quiz(no_of_questions=2, no_of_choices=4, adaptive=True).quiz['questions']]
+        # Each heavy question has 16 / (2 * 16 + 18 * 0.05) = 49% of the weight.
+        self.assertGreater(sum(text in heavy for text in picked) / len(picked), 0.9)
+
+    def test_rotation_quiz_serves_every_question_once_per_round(self):
+        picked = [question['question_text'] for _ in range(5) for question in
+                  self.topic.generate_quiz(no_of_questions=4, no_of_choices=4, rotation=True).quiz['questions']]
+        self.assertEqual(len(set(picked)), 20)
+        rotation = QuestionRotation.objects.get(user=self.user, topic=self.topic)
+        self.assertEqual(rotation.seen_count(), 20)
+
+        # Every question has been served, so the next quiz starts a new round.
+        self.topic.generate_quiz(no_of_questions=4, no_of_choices=4, rotation=True)
+        rotation.refresh_from_db()
+        self.assertEqual(rotation.seen_count(), 4)
+
+    def test_rotation_keeps_the_seen_questions_when_the_topic_changes(self):
+        served = {question['question_text'] for question in
+                  self.topic.generate_quiz(no_of_questions=4, no_of_choices=4, rotation=True).quiz['questions']}
+        self.topic.questions.exclude(text__in=served).first().delete()
+        picked = {question['question_text'] for question in
+                  self.topic.generate_quiz(no_of_questions=15, no_of_choices=4, rotation=True).quiz['questions']}
+        self.assertFalse(served & picked)
+
+
+class RegradeTestCase(TestCase):
+    """Checks that the attempts are regraded after an answer key changed, and that the regrade jobs resume."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='regrader')
+        application = get_application_model().objects.create(
+            user=cls.user, name='regrade', client_type='public', authorization_grant_type='password')
+        cls.access_token = get_access_token_model().objects.create(
+            user=cls.user, application=application, token='regrade', scope='read write',
+            expires=timezone.now() + timedelta(days=1))
+        cls.topic = build_topic(cls.user, 'regrade', 10, answers_per_question=(1, 1), seed=0)
+        cls.question = cls.topic.questions.order_by('id').first()
+        # Attempts that chose a wrong answer to the question, and only that answer, and attempts without it.
+        cls.attempts = []
+        for _ in range(5):
+            quiz = cls.topic.generate_quiz(no_of_questions=10, no_of_choices=4, fixed_choices_only=False)
+            chosen_answers = [[choice for choice in question['choices'] if choice != cls.question.answer_text][:1]
+                              if question['question_text'] == cls.question.text else []
+                              for question in quiz.quiz['questions']]
+            cls.attempts.append(quiz.check_quiz_answers(chosen_answers))
+        other_quiz = cls.topic.generate_quiz(no_of_questions=1, no_of_choices=4)
+        while other_quiz.quiz['questions'][0]['question_text'] == cls.question.text:
+            other_quiz = cls.topic.generate_quiz(no_of_questions=1, no_of_choices=4)
+        cls.other_attempt = other_quiz.check_quiz_answers([[]])
+        cls.chosen_texts = {next(choice['choice_text'] for question in attempt.quiz_attempt['questions']
+                                 if question['question_text'] == cls.question.text
+                                 for choice in question['choices'] if choice['chosen'])
+                            for attempt in cls.attempts}
+
+    def make_chosen_answers_correct(self):
+        self.question.answers.add(*Answer.objects.filter(creator=self.user, text__in=self.chosen_texts))
+
+    def test_answer_changes_schedule_a_regrade(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user, token=self.access_token)
+        response = client.post('/api/answers/', {'text': 'a new correct answer', 'questions': [self.question.id],
+                                                 'correct': True}, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        job = RegradeJob.objects.get()
+        self.assertEqual(job.question_ids, [self.question.id])
+        self.assertEqual(job.total, 6)
+
+        response = client.get(f'/api/regrade_jobs/{job.id}/')
+        self.assertEqual(response.json()['status'], RegradeJob.PENDING)
+
+    def test_regrade(self):
+        self.make_chosen_answers_correct()
+        job = regrading.schedule(self.user, [self.question.id], run=False)
+        progress = []
+        regrading.run_job(job.id, workers=0, batch_size=2, progress=lambda job: progress.append(job.processed))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.processed, job.regraded), (RegradeJob.DONE, 6, 5))
+        self.assertEqual(progress, [2, 4, 6])
+
+        for attempt in self.attempts:
+            old_score = attempt.score
+            attempt.refresh_from_db()
+            # The question is now partly right (the other correct answers among its choices were not chosen).
+            self.assertGreater(attempt.score, old_score)
+            self.assertEqual(attempt.quiz_attempt['score'], attempt.score)
+        self.other_attempt.refresh_from_db()
+        self.assertEqual(self.other_attempt.score, 0)
+
+    def test_interrupted_job_resumes(self):
+        self.make_chosen_answers_correct()
+        job = regrading.schedule(self.user, [self.question.id], run=False)
+
+        def interrupt(job):
+            raise KeyboardInterrupt
+        with self.assertRaises(KeyboardInterrupt):
+            regrading.run_job(job.id, workers=0, batch_size=4, progress=interrupt)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.processed, job.last_attempt_id), (RegradeJob.RUNNING, 4,
+                                                                            self.attempts[3].id))
+
+        call_command('regrade', workers=0, stdout=open(os.devnull, 'w'))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.processed, job.regraded), (RegradeJob.DONE, 6, 5))
+        self.assertEqual(QuizAttempt.objects.filter(id__in=[attempt.id for attempt in self.attempts],
+                                                    score__gt=0).count(), 5)
+
+
+class AttemptBufferTestCase(TestCase):
+    """Checks that the buffered attempts are inserted in batches, and recovered from the spool files after a crash."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='buffered')
+        application = get_application_model().objects.create(
+            user=cls.user, name='buffer', client_type='public', authorization_grant_type='password')
+        cls.access_token = get_access_token_model().objects.create(
+            user=cls.user, application=application, token='buffer', scope='read write',
+            expires=timezone.now() + timedelta(days=1))
+        cls.topic = build_topic(cls.user, 'buffer', 10, seed=0)
+
+    def setUp(self):
+        self.spool_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.spool_dir)
+        # A long delay, so that only full buffers are flushed.
+        self.buffer = attempt_buffer.AttemptBuffer(self.spool_dir, size=3, delay=60)
+        self.addCleanup(self.buffer.flush)
+        patcher = mock.patch.object(attempt_buffer, '_buffer', self.buffer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        settings_override = override_settings(ATTEMPT_BUFFER_SIZE=3, ATTEMPT_SPOOL_DIR=self.spool_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user, token=self.access_token)
+        performance_logger = logging.getLogger('quiz.performance')
+        self.addCleanup(performance_logger.setLevel, performance_logger.level)
+        performance_logger.setLevel(logging.WARNING)
+
+    def attempt_quiz(self):
+        quiz = self.topic.generate_quiz(no_of_questions=5, no_of_choices=4)
+        answers = [question['choices'][:1] for question in quiz.quiz['questions']]
+        response = self.client.put(f'/api/attempt_quiz/{quiz.id}/', {'answers': answers}, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.json()
+
+    def spool_files(self):
+        return sorted(os.listdir(self.spool_dir))
+
+    def test_attempts_are_inserted_when_the_buffer_is_full(self):
+        attempts = [self.attempt_quiz(), self.attempt_quiz()]
+        # Graded at once, but only in the spool file until the buffer is full.
+        self.assertEqual([len(attempt['questions']) for attempt in attempts], [5, 5])
+        self.assertNotIn('id', attempts[0])
+        self.assertFalse(QuizAttempt.objects.exists())
+        self.assertEqual(len(self.spool_files()), 1)
+        response = self.client.get(f"/api/quiz_attempts/{attempts[0]['uuid']}/")
+        self.assertEqual(response.status_code, 400)
+
+        attempts.append(self.attempt_quiz())
+        self.assertEqual(QuizAttempt.objects.count(), 3)
+        self.assertEqual(self.spool_files(), [])
+        for attempt in attempts:
+            quiz_attempt = QuizAttempt.objects.get(uuid=attempt['uuid'])
+            self.assertEqual(quiz_attempt.quiz_attempt['id'], quiz_attempt.id)
+            self.assertEqual((quiz_attempt.score, quiz_attempt.no_of_questions), (attempt['score'], 5))
+            response = self.client.get(f"/api/quiz_attempts/{attempt['uuid']}/")
+            self.assertEqual(response.json()['id'], quiz_attempt.id)
+
+    def test_flush_runs_a_few_queries_per_batch(self):
+        for _ in range(2):
+            self.attempt_quiz()
+        # The INSERT, the lookup of the ids, the UPDATE of the payloads and the lookup of the adaptive quizzes of the
+        #  topics, of which there are none, in a savepoint of the test case.
+        with self.assertNumQueries(6):
+            self.assertEqual(len(self.buffer.flush()), 2)
+
+    def test_flush_updates_the_question_weights(self):
+        quiz = self.topic.generate_quiz(no_of_questions=10, no_of_choices=4, adaptive=True)
+        # Not choosing anything gets every question wrong.
+        for _ in range(2):
+            response = self.client.put(f'/api/attempt_quiz/{quiz.id}/', {'answers': [[]] * 10}, format='json')
+            self.assertEqual(response.status_code, 201, response.content)
+        self.assertFalse(QuestionWeight.objects.exists())
+
+        # And the INSERT, locking and UPDATE of the weights and of the alias table, in a savepoint.
+        with self.assertNumQueries(12):
+            self.assertEqual(len(self.buffer.flush()), 2)
+        weights = QuestionWeight.objects.filter(user=self.user).values_list('weight', flat=True)
+        self.assertEqual(len(weights), 10)
+        for weight in weights:
+            self.assertAlmostEqual(weight, sampling.next_weight(sampling.next_weight(sampling.DEFAULT_WEIGHT, 0), 0))
+        self.assertTrue(QuestionSampler.objects.get(user=self.user, topic=self.topic).stale)
+
+    def test_spool_files_of_dead_processes_are_recovered(self):
+        attempts = [self.attempt_quiz(), self.attempt_quiz()]
+        [spool_file] = self.spool_files()
+        # As if the process had died before the flush: its spool file is left, with a record cut short at the end.
+        dead_spool_file = os.path.join(self.spool_dir, 'attempts-999999999-1.spool')
+        shutil.copy(os.path.join(self.spool_dir, spool_file), dead_spool_file)
+        with open(dead_spool_file, 'ab') as file:
+            file.write(attempt_buffer.RECORD_HEADER.pack(100) + b'cut short')
+        self.buffer.flush()
+        # Flushed before, so only the attempt that was not is inserted.
+        QuizAttempt.objects.filter(uuid=attempts[1]['uuid']).delete()
+
+        call_command('flush_attempts', spool_dir=self.spool_dir, stdout=open(os.devnull, 'w'))
+        self.assertEqual(self.spool_files(), [])
+        self.assertEqual(QuizAttempt.objects.count(), 2)
+        quiz_attempt = QuizAttempt.objects.get(uuid=attempts[1]['uuid'])
+        self.assertEqual(quiz_attempt.quiz_attempt['id'], quiz_attempt.id)
+        self.assertEqual(quiz_attempt.user, self.user)
+
+    def test_failed_flush_does_not_fail_the_request(self):
+        with mock.patch.object(attempt_buffer, 'insert', side_effect=OperationalError('database is down')), \
+                self.assertLogs('quiz.attempt_buffer', 'ERROR'):
+            attempts = [self.attempt_quiz() for _ in range(3)]
+        # Flushed again with the next attempts.
+        self.assertFalse(QuizAttempt.objects.exists())
+        self.assertEqual(len(self.buffer.pending), 3)
+        self.assertEqual(len(self.buffer.flush()), 3)
+        self.assertEqual(set(QuizAttempt.objects.values_list('uuid', flat=True).order_by()),
+                         {uuid.UUID(attempt['uuid']) for attempt in attempts})
+
+    def test_failed_recovery_does_not_fail_get_buffer(self):
+        with mock.patch.object(attempt_buffer, '_buffer', None), \
+                mock.patch.object(attempt_buffer, 'recover', side_effect=OperationalError('database is down')), \
+                mock.patch('atexit.register'), self.assertLogs('quiz.attempt_buffer', 'ERROR'):
+            buffer = attempt_buffer.get_buffer()
+        self.assertIsInstance(buffer, attempt_buffer.AttemptBuffer)
+
+
+class AttemptBufferIntegrityTestCase(TransactionTestCase):
+    """
+    Checks that an attempt that cannot be inserted does not hold back the others. A TransactionTestCase, as the foreign
+    keys are only checked when the transaction is committed.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='buffered')
+        self.topic = build_topic(self.user, 'buffer', 10, seed=0)
+        self.spool_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.spool_dir)
+        self.buffer = attempt_buffer.AttemptBuffer(self.spool_dir, size=3, delay=60)
+        patcher = mock.patch.object(attempt_buffer, '_buffer', self.buffer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        settings_override = override_settings(ATTEMPT_BUFFER_SIZE=3, ATTEMPT_SPOOL_DIR=self.spool_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        performance_logger = logging.getLogger('quiz.performance')
+        self.addCleanup(performance_logger.setLevel, performance_logger.level)
+        performance_logger.setLevel(logging.WARNING)
+
+    def attempt_quiz(self, quiz=None):
+        quiz = quiz or self.topic.generate_quiz(no_of_questions=5, no_of_choices=4)
+        answers = [question['choices'][:1] for question in quiz.quiz['questions']]
+        response = self.client.put(f'/api/attempt_quiz/{quiz.id}/', {'answers': answers}, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.json()
+
+    def test_attempt_at_a_deleted_quiz(self):
+        quiz = self.topic.generate_quiz(no_of_questions=5, no_of_choices=4)
+        orphan = self.attempt_quiz(quiz)
+        quiz.delete()
+        with self.assertLogs('quiz.attempt_buffer', 'WARNING'):
+            attempts = [self.attempt_quiz(), self.attempt_quiz()]
+
+        self.assertEqual(QuizAttempt.objects.count(), 3)
+        self.assertEqual(os.listdir(self.spool_dir), [])
+        # As if it had been inserted before the quiz was deleted.
+        quiz_attempt = QuizAttempt.objects.get(uuid=orphan['uuid'])
+        self.assertEqual((quiz_attempt.quiz, quiz_attempt.topic), (None, self.topic))
+        for attempt in [orphan, *attempts]:
+            quiz_attempt = QuizAttempt.objects.get(uuid=attempt['uuid'])
+            self.assertEqual(quiz_attempt.quiz_attempt['id'], quiz_attempt.id)
+
+    def test_attempts_that_cannot_be_inserted_are_dead_lettered(self):
+        attempt = self.attempt_quiz()
+        # As if the user had been deleted since.
+        dead_attempt = QuizAttempt(user_id=self.user.id + 1, topic=self.topic, quiz_attempt={'questions': []}, score=0)
+        self.buffer.add(dead_attempt)
+        with self.assertLogs('quiz.attempt_buffer', 'ERROR') as logs:
+            self.assertEqual([inserted.uuid for inserted in self.buffer.flush()], [uuid.UUID(attempt['uuid'])])
+        self.assertIn(str(dead_attempt.uuid), logs.output[-1])
+
+        self.assertEqual(QuizAttempt.objects.get().uuid, uuid.UUID(attempt['uuid']))
+        [dead_letters] = os.listdir(self.spool_dir)
+        self.assertTrue(dead_letters.startswith('dead-attempts-'))
+        [record] = attempt_buffer.read_records(os.path.join(self.spool_dir, dead_letters))
+        self.assertEqual((record.uuid, record.user_id), (dead_attempt.uuid, dead_attempt.user_id))
+        # Not recovered.
+        self.assertEqual(attempt_buffer.recover(self.spool_dir), 0)
+
+    def test_spool_files_with_a_deleted_quiz_are_recovered(self):
+        quiz = self.topic.generate_quiz(no_of_questions=5, no_of_choices=4)
+        orphan = self.attempt_quiz(quiz)
+        attempt = self.attempt_quiz()
+        # As if the process had died before the flush.
+        [spool_file] = os.listdir(self.spool_dir)
+        os.rename(os.path.join(self.spool_dir, spool_file), os.path.join(self.spool_dir, 'attempts-999999999-1.spool'))
+        self.buffer.pending = []
+        self.buffer.spool_paths = []
+        quiz.delete()
+
+        with mock.patch.object(attempt_buffer, '_buffer', None), mock.patch('atexit.register'), \
+                self.assertLogs('quiz.attempt_buffer', 'WARNING'):
+            attempt_buffer.get_buffer()
+        self.assertEqual(os.listdir(self.spool_dir), [])
+        self.assertEqual(set(QuizAttempt.objects.values_list('uuid', flat=True).order_by()),
+                         {uuid.UUID(orphan['uuid']), uuid.UUID(attempt['uuid'])})
+        self.assertIsNone(QuizAttempt.objects.get(uuid=orphan['uuid']).quiz)
+
+
+@override_settings(DATABASE_REPLICAS=['test_replica'], REPLICA_STICKINESS=60)
+class ReplicaRoutingTestCase(TransactionTestCase):
+    """
+    Checks that the reads of safe requests go to the replica, a second SQLite database with other rows, and that a
+    user's reads go to the primary after a write. A TransactionTestCase, as the reads in a transaction (such as the one
+    of a TestCase) go to the primary.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.replica_dir = tempfile.mkdtemp()
+        connections.databases['test_replica'] = {'ENGINE': 'django.db.backends.sqlite3',
+                                            'NAME': os.path.join(cls.replica_dir, 'replica.sqlite3')}
+        # Only the tables read by the tests.
+        with connections['test_replica'].schema_editor() as editor:
+            editor.create_model(User)
+            editor.create_model(Topic)
+            editor.create_model(Quiz)
+
+    @classmethod
+    def tearDownClass(cls):
+        connections['test_replica'].close()
+        del connections['test_replica']
+        del connections.databases['test_replica']
+        shutil.rmtree(cls.replica_dir)
+        super().tearDownClass()
+
+    def setUp(self):
+        with connections['test_replica'].cursor() as cursor:
+            cursor.execute("DELETE FROM quiz_quiz")
+            cursor.execute("DELETE FROM quiz_topic")
+            cursor.execute("DELETE FROM auth_user")
+        self.user = User.objects.create_user(username='replicated')
+        User.objects.using('test_replica').create(id=self.user.id, username=self.user.username)
+        Topic.objects.create(creator=self.user, name='on the primary')
+        Topic.objects.using('test_replica').create(creator_id=self.user.id, name='on the replica')
+        # The users pinned to the primary by the writes of other tests.
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+        application = get_application_model().objects.create(
+            user=self.user, name='replica', client_type='public', authorization_grant_type='password')
+        access_token = get_access_token_model().objects.create(
+            user=self.user, application=application, token='replica', scope='read write',
+            expires=timezone.now() + timedelta(days=1))
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user, token=access_token)
+        performance_logger = logging.getLogger('quiz.performance')
+        self.addCleanup(performance_logger.setLevel, performance_logger.level)
+        performance_logger.setLevel(logging.WARNING)
+
+    def topic_names(self):
+        response = self.client.get('/api/topics/')
+        self.assertEqual(response.status_code, 200, response.content)
+        return sorted(topic['name'] for topic in response.json())
+
+    def test_reads_go_to_the_replica_until_the_user_writes(self):
+        self.assertEqual(self.topic_names(), ['on the replica'])
+
+        response = self.client.post('/api/topics/', {'name': 'new topic'}, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(self.topic_names(), ['new topic', 'on the primary'])
+
+        cache.clear()
+        self.assertEqual(self.topic_names(), ['on the replica'])
+
+    def test_other_reads_go_to_the_primary(self):
+        # A view without ReplicaReadMixin (the replica has no regrade jobs table).
+        self.assertEqual(self.client.get('/api/regrade_jobs/').status_code, 200)
+
+        replica = routers.start_replica_reads(self.user)
+        try:
+            self.assertEqual(router.db_for_read(Topic), 'test_replica')
+            self.assertEqual(router.db_for_write(Topic), 'default')
+            with transaction.atomic():
+                self.assertEqual(router.db_for_read(Topic), 'default')
+        finally:
+            routers.end_replica_reads(replica)
+        self.assertEqual(router.db_for_read(Topic), 'default')
+
+    def test_stickiness_cache_check(self):
+        shared = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                              'LOCATION': tempfile.gettempdir()}}
+        per_process = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        for caches, replicas, stickiness, error_ids in ((per_process, ['test_replica'], 60, ['quiz.E003']),
+                                                        (shared, ['test_replica'], 60, []),
+                                                        (per_process, ['test_replica'], 0, []),
+                                                        (per_process, [], 60, [])):
+            with self.subTest(caches=caches, replicas=replicas, stickiness=stickiness), \
+                    self.settings(CACHES=caches, DATABASE_REPLICAS=replicas, REPLICA_STICKINESS=stickiness):
+                self.assertEqual([error.id for error in routers.check_stickiness_cache(None)], error_ids)
+
+    async def test_async_views_read_from_the_replica(self):
+        # The async views start the replica reads in a sync thread, and end them in the event loop.
+        quiz = await database_sync_to_async(Quiz.objects.using('test_replica').create)(
+            creator_id=self.user.id, quiz={'topic_name': 'on the replica', 'questions': []})
+        response = await async_request('GET', f'/api/async/generate_quiz/{quiz.id}/', token='replica')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.json(), {'topic_name': 'on the replica', 'questions': []})
+        self.assertEqual(router.db_for_read(Topic), 'default')
+
+
+class MetricsTestCase(TestCase):
+    """Checks the Prometheus metrics at /metrics, and that they add up the metrics of every worker process."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='measured')
+        application = get_application_model().objects.create(
+            user=cls.user, name='metrics', client_type='public', authorization_grant_type='password')
+        cls.access_token = get_access_token_model().objects.create(
+            user=cls.user, application=application, token='metrics', scope='read write',
+            expires=timezone.now() + timedelta(days=1))
+        cls.topic = build_topic(cls.user, 'metrics', 10, seed=0)
+
+    def setUp(self):
+        performance_logger = logging.getLogger('quiz.performance')
+        self.addCleanup(performance_logger.setLevel, performance_logger.level)
+        performance_logger.setLevel(logging.WARNING)
+
+    def sample(self, name, **labels):
+        return prometheus_client.REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_metrics(self):
+        requests = self.sample('quiz_requests_total', route='topic-list', method='GET', status='200')
+        generated = self.sample('quiz_generate_quiz_duration_seconds_count')
+        topic_sizes = self.sample('quiz_topic_questions_bucket', le='10.0')
+
+        client = APIClient()
+        client.force_authenticate(user=self.user, token=self.access_token)
+        self.assertEqual(client.get('/api/topics/').status_code, 200)
+        self.assertEqual(client.put(f'/api/generate_quiz/{self.topic.id}/', {'no_of_questions': 5, 'no_of_choices': 4},
+                                    format='json').status_code, 201)
+
+        self.assertEqual(self.sample('quiz_requests_total', route='topic-list', method='GET', status='200'),
+                         requests + 1)
+        self.assertEqual(self.sample('quiz_generate_quiz_duration_seconds_count'), generated + 1)
+        self.assertEqual(self.sample('quiz_topic_questions_bucket', le='10.0'), topic_sizes + 1)
+
+        response = Client().get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        families = {family.name: family for family in text_string_to_metric_families(response.content.decode())}
+        self.assertIn('quiz_request_queries', families)
+        self.assertIn('quiz_check_quiz_answers_duration_seconds', families)
+
+    @override_settings(METRICS_TOKEN='scraper')
+    def test_metrics_token(self):
+        self.assertEqual(Client().get('/metrics').status_code, 401)
+        self.assertEqual(Client().get('/metrics', HTTP_AUTHORIZATION='Bearer scraper').status_code, 200)
+
+    def test_metrics_add_up_across_processes(self):
+        metrics_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, metrics_dir)
+        script = ("import django; django.setup(); from quiz import metrics; "
+                  "metrics.observe_request('topic-list', 'GET', 500, 0.2, 0.01, 3)")
+        for _ in range(2):
+            subprocess.run([sys.executable, '-c', script], check=True, cwd=settings.BASE_DIR,
+                           env={**os.environ, 'PROMETHEUS_MULTIPROC_DIR': metrics_dir})
+
+        samples = {(sample.name, tuple(sorted(sample.labels.items()))): sample.value
+                   for family in text_string_to_metric_families(metrics.render(metrics_dir).decode())
+                   for sample in family.samples}
+        labels = (('method', 'GET'), ('route', 'topic-list'), ('status', '500'))
+        self.assertEqual(samples[('quiz_requests_total', labels)], 2)
+        self.assertEqual(samples[('quiz_request_errors_total', labels)], 2)
+        self.assertEqual(samples[('quiz_request_queries_sum', (('route', 'topic-list'),))], 6)
+
+
+class SlowQueryTestCase(TestCase):
+    """Checks the slow-query log, its fingerprints and plans, and the slow queries at /api/performance/slow_queries/."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='slow', is_staff=True)
+        application = get_application_model().objects.create(
+            user=cls.user, name='slow', client_type='public', authorization_grant_type='password')
+        cls.access_token = get_access_token_model().objects.create(
+            user=cls.user, application=application, token='slow', scope='read write',
+            expires=timezone.now() + timedelta(days=1))
+        cls.topic = build_topic(cls.user, 'slow', 10, seed=0)
+
+    def setUp(self):
+        performance_logger = logging.getLogger('quiz.performance')
+        self.addCleanup(performance_logger.setLevel, performance_logger.level)
+        performance_logger.setLevel(logging.WARNING)
+        slow_queries.slow_queries.clear()
+        self.addCleanup(slow_queries.slow_queries.clear)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user, token=self.access_token)
+
+    def test_fingerprint(self):
+        self.assertEqual(
+            slow_queries.fingerprint('SELECT "quiz_topic"."id" FROM "quiz_topic"\n WHERE ("quiz_topic"."id" IN (%s, %s, 3)'
+                                     ' AND "quiz_topic"."name" = \'it\'\'s\') LIMIT 21'),
+            'SELECT "quiz_topic"."id" FROM "quiz_topic" WHERE ("quiz_topic"."id" IN (...) AND "quiz_topic"."name" = ?) '
+            'LIMIT ?')
+        self.assertEqual(slow_queries.fingerprint('INSERT INTO "t" ("a", "b") VALUES (%s, %s), (%s, %s)'),
+                         'INSERT INTO "t" ("a", "b") VALUES (...)')
+
+    @override_settings(SLOW_QUERY_THRESHOLD_MS=0, SLOW_QUERY_EXPLAIN=True)
+    def test_slow_queries(self):
+        with connection.execute_wrapper(slow_queries.log_slow_query), \
+                self.assertLogs('quiz.slow_queries', logging.WARNING) as logs:
+            self.assertEqual(self.client.get(f'/api/topics/{self.topic.id}/').status_code, 200)
+        lines = [json.loads(record.getMessage()) for record in logs.records]
+        topic_lookup = next(line for line in lines if line['fingerprint'].startswith('SELECT')
+                            and 'FROM "quiz_topic"' in line['fingerprint'])
+        self.assertEqual(topic_lookup['route'], 'topic-detail')
+        self.assertEqual(topic_lookup['database'], 'default')
+        self.assertTrue(any('quiz_topic' in step for step in topic_lookup['plan']))
+
+        response = self.client.get('/api/performance/slow_queries/')
+        self.assertEqual(response.status_code, 200)
+        queries = response.json()['queries']
+        self.assertEqual([query['total_ms'] for query in queries],
+                         sorted((query['total_ms'] for query in queries), reverse=True))
+        query = next(query for query in queries if query['fingerprint'] == topic_lookup['fingerprint'])
+        self.assertEqual(query['routes'], {'topic-detail': 1})
+        self.assertTrue(query['plan'])
+
+    @override_settings(SLOW_QUERY_THRESHOLD_MS=0)
+    def test_slow_queries_outside_a_route(self):
+        # As in the background threads, or before the URL is resolved.
+        with connection.execute_wrapper(slow_queries.log_slow_query), self.assertLogs('quiz.slow_queries'):
+            Topic.objects.count()
+        response = self.client.get('/api/performance/slow_queries/')
+        self.assertEqual(response.status_code, 200)
+        [query] = [query for query in response.json()['queries'] if 'COUNT' in query['fingerprint']]
+        self.assertEqual(query['routes'], {slow_queries.NO_ROUTE: 1})
+
+    def test_slow_queries_are_bounded(self):
+        stats = slow_queries.SlowQueryStats(size=2)
+        stats.add('a', 'topic-list', 30.0, 'a')
+        stats.add('b', 'topic-list', 10.0, 'b')
+        stats.add('a', 'topic-list', 30.0, 'a')
+        # Takes the place of b, the one with the least time.
+        stats.add('c', 'topic-list', 5.0, 'c')
+        self.assertEqual([(query['fingerprint'], query['total_ms'], query['error_ms']) for query in stats.snapshot()],
+                         [('a', 60.0, 0.0), ('c', 15.0, 10.0)])
+
+    def test_slow_queries_are_staff_only(self):
+        user = User.objects.create_user(username='not_staff')
+        self.client.force_authenticate(user=user, token=self.access_token)
+        self.assertEqual(self.client.get('/api/performance/slow_queries/').status_code, 403)
+
+
+class ProfilingTestCase(TestCase):
+    """Checks the profiling of the requests of staff users, and the profiles at /api/performance/profiles/."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user(username='profiler', is_staff=True)
+        cls.user = User.objects.create_user(username='profiled')
+        application = get_application_model().objects.create(
+            user=cls.staff, name='profiling', client_type='public', authorization_grant_type='password')
+        for user in (cls.staff, cls.user):
+            get_access_token_model().objects.create(
+                user=user, application=application, token=user.username, scope='read write',
+                expires=timezone.now() + timedelta(days=1))
+        cls.topic = build_topic(cls.staff, 'profiling', 10, seed=0)
+
+    def setUp(self):
+        performance_logger = logging.getLogger('quiz.performance')
+        self.addCleanup(performance_logger.setLevel, performance_logger.level)
+        performance_logger.setLevel(logging.WARNING)
+        profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, profile_dir)
+        settings_override = override_settings(PROFILE_DIR=profile_dir, PROFILE_SAMPLE_INTERVAL=0.0005)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def client_for(self, user):
+        # With the access token in the header rather than force_authenticate, as the middleware sees the user through
+        #  CachedOAuth2TokenMiddleware.
+        return APIClient(HTTP_AUTHORIZATION=f'Bearer {user.username}')
+
+    def test_profiling(self):
+        client = self.client_for(self.staff)
+        response = client.put(f'/api/generate_quiz/{self.topic.id}/?profile=1',
+                              {'no_of_questions': 5, 'no_of_choices': 4}, format='json')
+        self.assertEqual(response.status_code, 201)
+        profile_id = response['X-Profile-Id']
+
+        profiles = client.get('/api/performance/profiles/').json()
+        self.assertEqual(len(profiles), 1)
+        self.assertEqual(profiles[0]['id'], profile_id)
+        self.assertEqual(profiles[0]['route'], 'generate_quiz-detail')
+        self.assertEqual(profiles[0]['user'], 'profiler')
+        self.assertEqual(profiles[0]['status'], 201)
+
+        response = client.get(f'/api/performance/profiles/{profile_id}/pstats/')
+        self.assertEqual(response.status_code, 200)
+        path = os.path.join(settings.PROFILE_DIR, 'downloaded.pstats')
+        with open(path, 'wb') as file:
+            file.write(b''.join(response.streaming_content))
+        functions = {function_name for _, _, function_name in pstats.Stats(path).stats}
+        self.assertIn('generate_quiz', functions)
+
+        response = client.get(f'/api/performance/profiles/{profile_id}/collapsed/')
+        self.assertEqual(response.status_code, 200)
+        for line in b''.join(response.streaming_content).decode().splitlines():
+            self.assertRegex(line, r'^\S+ \d+$')
+
+        self.assertEqual(client.get(f'/api/performance/profiles/{profile_id}/svg/').status_code, 404)
+        self.assertEqual(client.get('/api/performance/profiles/..%2Fsettings/pstats/').status_code, 404)
+
+    def test_profiling_is_staff_only(self):
+        client = self.client_for(self.user)
+        response = client.get('/api/topics/', HTTP_X_PROFILE='1')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(client.get('/api/performance/profiles/').status_code, 403)
+
+        response = self.client_for(self.staff).get('/api/topics/')
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(os.listdir(settings.PROFILE_DIR), [])
+
+    @override_settings(PROFILE_KEEP=2)
+    def test_old_profiles_are_deleted(self):
+        client = self.client_for(self.staff)
+        profile_ids = [client.get('/api/topics/', HTTP_X_PROFILE='1')['X-Profile-Id'] for _ in range(3)]
+        self.assertEqual(len(os.listdir(settings.PROFILE_DIR)), 6)
+        self.assertEqual({profile['id'] for profile in client.get('/api/performance/profiles/').json()},
+                         set(profile_ids[1:]))
+
+    def test_stack_sampler(self):
+        def spin():
+            deadline = time.perf_counter() + 0.05
+            while time.perf_counter() < deadline:
+                pass
+
+        sampler = profiling.StackSampler(threading.get_ident(), 0.001)
+        sampler.start()
+        spin()
+        sampler.stop()
+        self.assertTrue(any(stack.endswith('quiz.tests:spin') for stack in sampler.stacks))
+        self.assertRegex(sampler.collapsed().splitlines()[0], r'^\S+ \d+$')
+
+
+class StaticFilesTestCase(SimpleTestCase):
+    """Checks that the collected static files are served precompressed and with the right cache headers."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        static_root = tempfile.mkdtemp()
+        cls.addClassCleanup(shutil.rmtree, static_root)
+        settings_override = override_settings(STATIC_ROOT=static_root)
+        settings_override.enable()
+        cls.addClassCleanup(settings_override.disable)
+        call_command('collectstatic', interactive=False, verbosity=0)
+
+    def setUp(self):
+        # Whitenoise scans STATIC_ROOT when the middleware is created, so create it after collectstatic.
+        self.client = Client()
+        self.hashed_url = staticfiles_storage.url('admin/css/base.css')
+
+    def test_hashed_file_is_cached_forever(self):
+        self.assertNotEqual(self.hashed_url, '/static/admin/css/base.css')
+        response = self.client.get(self.hashed_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn('max-age=315360000', response['Cache-Control'])
+
+    def test_file_without_hash_is_not_cached_forever(self):
+        response = self.client.get('/static/admin/css/base.css')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('immutable', response['Cache-Control'])
+
+    def test_encoding_negotiation(self):
+        response = self.client.get(self.hashed_url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+
+        response = self.client.get(self.hashed_url)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertIn('Accept-Encoding', response['Vary'])
+
+    @skipUnless(brotli, "Brotli is not installed, so collectstatic does not write .br files.")
+    def test_brotli_is_preferred(self):
+        response = self.client.get(self.hashed_url, HTTP_ACCEPT_ENCODING='gzip, deflate, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+
+
+class APICompressionTestCase(SimpleTestCase):
+    """Checks the encoding negotiation and size threshold of APICompressionMiddleware."""
+    large_payload = {'questions': [{'question_text': f'question {i}', 'choices': ['a', 'b', 'c']} for i in range(200)]}
+
+    def get(self, response, path='/api/qna/1/', accept_encoding=None):
+        middleware = APICompressionMiddleware(lambda request: response)
+        headers = {'HTTP_ACCEPT_ENCODING': accept_encoding} if accept_encoding is not None else {}
+        return middleware(RequestFactory().get(path, **headers))
+
+    def test_large_response_is_gzipped(self):
+        response = self.get(JsonResponse(self.large_payload), accept_encoding='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(int(response['Content-Length']), len(response.content))
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(json.loads(gzip.decompress(response.content)), self.large_payload)
+
+    @skipUnless(brotli, "Brotli is not installed.")
+    def test_brotli_is_preferred(self):
+        response = self.get(JsonResponse(self.large_payload), accept_encoding='gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(json.loads(brotli.decompress(response.content)), self.large_payload)
+
+    def test_not_compressed(self):
+        cases = {
+            'small response': (JsonResponse({'id': 1}), '/api/qna/1/', 'gzip'),
+            'no accept-encoding': (JsonResponse(self.large_payload), '/api/qna/1/', None),
+            'gzip refused': (JsonResponse(self.large_payload), '/api/qna/1/', 'gzip;q=0, identity'),
+            'not the api': (JsonResponse(self.large_payload), '/admin/', 'gzip'),
+            'not compressible': (HttpResponse(b'x' * 5000, content_type='image/png'), '/api/qna/1/', 'gzip'),
+        }
+        for case, (response, path, accept_encoding) in cases.items():
+            with self.subTest(case):
+                self.assertFalse(self.get(response, path, accept_encoding).has_header('Content-Encoding'))
+
+    def test_async_response_is_compressed_outside_the_event_loop(self):
+        async def get_response(request):
+            return JsonResponse(self.large_payload)
+
+        middleware = APICompressionMiddleware(get_response)
+        compress = middleware.compress
+        threads = []
+
+        def compress_in_thread(*args):
+            threads.append(threading.get_ident())
+            return compress(*args)
+
+        async def call():
+            response = await middleware(RequestFactory().get('/api/qna/1/', HTTP_ACCEPT_ENCODING='gzip'))
+            return threading.get_ident(), response
+
+        with mock.patch.object(middleware, 'compress', compress_in_thread):
+            loop_thread, response = asyncio.run(call())
+        self.assertEqual(json.loads(gzip.decompress(response.content)), self.large_payload)
+        self.assertEqual(len(threads), 1)
+        self.assertNotEqual(threads[0], loop_thread)
+
+    def test_streaming_response_is_compressed_chunk_by_chunk(self):
+        chunks = [json.dumps(self.large_payload).encode()] * 3
+        response = self.get(StreamingHttpResponse(iter(chunks), content_type='application/json'),
+                            accept_encoding='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertFalse(response.has_header('Content-Length'))
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), b''.join(chunks))
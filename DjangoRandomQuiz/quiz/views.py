@@ -1,21 +1,33 @@
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.core import signing
+from django.core.exceptions import ObjectDoesNotExist
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils.crypto import constant_time_compare
+from prometheus_client import CONTENT_TYPE_LATEST
 
 # Create your views here.
 from rest_framework import generics, status
 from rest_framework import viewsets
 
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
 
 from oauth2_provider.contrib.rest_framework import TokenHasReadWriteScope
 from rest_framework.response import Response
 
-from quiz.mixins import NoUpdateCreatorMixin, UserDataBasedOnRequestMixin
-from quiz.models import Topic, Question, Answer, Quiz
+from quiz import leaderboards, metrics, profiling, quiz_tokens, search
+from quiz.backends.pooling import pool_stats
+from quiz.instrumentation import route_histograms
+from quiz.slow_queries import slow_queries
+from quiz.mixins import NoUpdateCreatorMixin, UserDataBasedOnRequestMixin, PayloadLayoutMixin, SearchIndexMixin, \
+    RegradeMixin, ReplicaReadMixin
+from quiz.models import Topic, Question, Answer, Quiz, QuizAttempt, RegradeJob
 from quiz.serializers import TopicSerializer, QuestionSerializer, AnswerSerializer, UserSerializer, \
-    QuestionAnswerSerializer, QuizSerializer, QuizAnswerSerializer
+    QuestionAnswerSerializer, QuizSerializer, QuizAnswerSerializer, LeaderboardSerializer, SearchSerializer, \
+    HistorySerializer, QuizTokenAnswerSerializer
 
 
-class TopicAPIView(UserDataBasedOnRequestMixin, NoUpdateCreatorMixin, viewsets.ModelViewSet):
+class TopicAPIView(ReplicaReadMixin, UserDataBasedOnRequestMixin, NoUpdateCreatorMixin, viewsets.ModelViewSet):
     """View to create, read, update and destroy ALL topics belonging to a user"""
     serializer_class = TopicSerializer
 
@@ -26,7 +38,8 @@ class TopicAPIView(UserDataBasedOnRequestMixin, NoUpdateCreatorMixin, viewsets.M
         return Topic.objects.filter(creator=user)
 
 
-class QuestionAPIView(UserDataBasedOnRequestMixin, NoUpdateCreatorMixin, viewsets.ModelViewSet):
+class QuestionAPIView(ReplicaReadMixin, UserDataBasedOnRequestMixin, NoUpdateCreatorMixin, SearchIndexMixin,
+                      viewsets.ModelViewSet):
     """View to create, read, update and destroy ALL questions belonging to a user"""
     serializer_class = QuestionSerializer
 
@@ -35,7 +48,12 @@ class QuestionAPIView(UserDataBasedOnRequestMixin, NoUpdateCreatorMixin, viewset
 
     def get_queryset(self):
         user = self.request.user
-        return Question.objects.filter(creator=user)
+        queryset = Question.objects.filter(creator=user)
+        if self.action == 'list':
+            # The serializer lists the topic and answer ids of every question. Only prefetch these for the list, as
+            #  update and destroy change them and then read them again.
+            queryset = queryset.prefetch_related('topic', 'answers')
+        return queryset
 
     def topic_queryset(self):
         user = self.request.user
@@ -123,6 +141,7 @@ class QuestionAPIView(UserDataBasedOnRequestMixin, NoUpdateCreatorMixin, viewset
                 # Otherwise, create a new answer object and add that to the question.
                 new_question = Question.objects.create(text=updated_question_text,
                                                        creator=self.request.user)
+                search.index([new_question])
                 topic.questions.add(new_question)
             response_dict = {
                 'id': new_question.id,
@@ -169,15 +188,24 @@ class QuestionAPIView(UserDataBasedOnRequestMixin, NoUpdateCreatorMixin, viewset
                 return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class AnswerAPIView(UserDataBasedOnRequestMixin, NoUpdateCreatorMixin, viewsets.ModelViewSet):
-    """View to create, read, update and destroy ALL answers belonging to a user"""
+class AnswerAPIView(ReplicaReadMixin, UserDataBasedOnRequestMixin, NoUpdateCreatorMixin, SearchIndexMixin,
+                    RegradeMixin, viewsets.ModelViewSet):
+    """
+    View to create, read, update and destroy ALL answers belonging to a user. The quiz attempts with the questions whose
+    answers changed are regraded in the background (see RegradeJobAPIView for the progress).
+    """
     serializer_class = AnswerSerializer
 
     permission_classes = (IsAuthenticated, TokenHasReadWriteScope)
 
     def get_queryset(self):
         user = self.request.user
-        return Answer.objects.filter(creator=user)
+        queryset = Answer.objects.filter(creator=user)
+        if self.action == 'list':
+            # The serializer lists the question ids of every answer. Only prefetch these for the list, as update and
+            #  destroy change them and then read them again.
+            queryset = queryset.prefetch_related('questions')
+        return queryset
 
     def question_queryset(self):
         """Only search questions from what the user has created."""
@@ -244,6 +272,7 @@ class AnswerAPIView(UserDataBasedOnRequestMixin, NoUpdateCreatorMixin, viewsets.
             # Create a wrong answer
             else:
                 answer = Answer.objects.create(creator=request.user, text=answer_text)
+                search.index([answer])
 
                 # Add the answer to the wrong answer set
                 for question in questions:
@@ -349,6 +378,7 @@ class AnswerAPIView(UserDataBasedOnRequestMixin, NoUpdateCreatorMixin, viewsets.
                     new_answer = self.get_queryset().filter(text=updated_answer_text).get()
 
                     # Delete the old answer and reference the new one.
+                    search.unindex([answer])
                     answer.delete()
 
                 answer = new_answer
@@ -395,6 +425,7 @@ class AnswerAPIView(UserDataBasedOnRequestMixin, NoUpdateCreatorMixin, viewsets.
                 # Otherwise, create a new answer object and add that to the question.
                 new_answer = Answer.objects.create(text=updated_answer_text,
                                                    creator=self.request.user)
+                search.index([new_answer])
 
             # Add to correct or wrong answers
             if correct is True or correct is None:
@@ -506,7 +537,7 @@ class QuizViewSet(viewsets.ViewSet):
         return Quiz.objects.filter(creator=self.request.user)
 
 
-class QuestionAnswerAPIView(QuizViewSet):
+class QuestionAnswerAPIView(ReplicaReadMixin, QuizViewSet):
     """
     This serves as the primary endpoint to retrieve a list of questions and answers for a given topic, and to then
     edit said questions and answers.
@@ -551,7 +582,8 @@ class QuestionAnswerAPIView(QuizViewSet):
             'qna': []
         }
 
-        for question in topic.questions.all():
+        # Get the answers and wrong answers of all the questions with two more queries, not two per question.
+        for question in topic.questions.prefetch_related('answers', 'wrong_answers'):
             question_dict = {
                 'question_id': question.id,
                 'question_text': question.text,
@@ -603,6 +635,8 @@ class QuestionAnswerAPIView(QuizViewSet):
                 return Response({"error_description": "Topic Does Not Exist"}, status=status.HTTP_400_BAD_REQUEST)
 
             user = self.request.user
+            # The new questions and answers, to add to the search index with one query.
+            new_objects = []
             list_of_answer_instances = []
             for answer_text in list_of_answer_text:
                 if self.answer_queryset().filter(text=answer_text):
@@ -611,6 +645,7 @@ class QuestionAnswerAPIView(QuizViewSet):
                 else:
                     # Otherwise, we create a new answer object.
                     new_answer = Answer.objects.create(text=answer_text, creator=user)
+                    new_objects.append(new_answer)
                     list_of_answer_instances.append(new_answer)
 
             # Get wrong answers
@@ -622,6 +657,7 @@ class QuestionAnswerAPIView(QuizViewSet):
                 else:
                     # Otherwise, we create a new answer object.
                     new_answer = Answer.objects.create(text=answer_text, creator=user)
+                    new_objects.append(new_answer)
                     list_of_wrong_answer_instances.append(new_answer)
 
             # If the question already exists in the database, we will just add the topic and the answers to this question
@@ -633,12 +669,14 @@ class QuestionAnswerAPIView(QuizViewSet):
             else:
                 # Otherwise, create a new question then add to the database.
                 question = Question.objects.create(text=question_text, creator=user)
+                new_objects.append(question)
                 question.topic.add(topic)
                 question.answers.add(*list_of_answer_instances)
                 question.wrong_answers.add(*list_of_wrong_answer_instances)
 
             # Save the question to the database.
             question.save()
+            search.index(new_objects)
 
             response_dict = {
                 'topic': topic.id,
@@ -679,10 +717,12 @@ class QuestionAnswerAPIView(QuizViewSet):
         return Response({"error_description": error_description}, status=status.HTTP_400_BAD_REQUEST)
 
 
-class GenerateQuizAPIView(QuizViewSet):
+class GenerateQuizAPIView(ReplicaReadMixin, PayloadLayoutMixin, QuizViewSet):
     """
     For this end point, we must pass in a topic ID. We will then get the relevant topic and generate a quiz using
     no_of_choices and no_of_questions
+
+    Pass in '?layout=columnar' to get the quiz in the columnar layout (see quiz.layouts).
     """
 
     def retrieve(self, request, pk, format=None):
@@ -697,7 +737,7 @@ class GenerateQuizAPIView(QuizViewSet):
             return Response({"error_description": "Quiz Does Not Exist"}, status=status.HTTP_400_BAD_REQUEST)
 
         else:
-            return Response(quiz, status=status.HTTP_200_OK)
+            return Response(self.to_layout(quiz), status=status.HTTP_200_OK)
 
     def update(self, request, pk, format=None):
         """
@@ -706,6 +746,9 @@ class GenerateQuizAPIView(QuizViewSet):
         curl -X PUT -H "Authorization: Bearer <Token>" -H "Content-Type: application/json"
          --data '{"no_of_questions":"<no_of_questions>","no_of_choices":"<no_of_choices>"}'
          "127.0.0.1:8000/api/generate_quiz/<topic_id>/"
+
+        Pass in "stateless": true to not save the quiz. The quiz then has no id, but a 'token' to POST to
+        /api/attempt_quiz/ with the answers (see CheckQuizAnswersAPIView.create).
          """
         try:
             # Get the relevant topic.
@@ -714,7 +757,7 @@ class GenerateQuizAPIView(QuizViewSet):
             # Topic does not exist.
             return Response({"error_description": "Topic does not exist"}, status=status.HTTP_400_BAD_REQUEST)
 
-        if not topic.questions.all():
+        if not topic.questions.exists():
             return Response({"error_description": "Topic has no questions. Add some questions to the topic first."},
                             status=status.HTTP_400_BAD_REQUEST)
 
@@ -725,21 +768,32 @@ class GenerateQuizAPIView(QuizViewSet):
             no_of_choices = serializer.validated_data['no_of_choices']
             show_all_alternative_answers = serializer.validated_data['show_all_alternative_answers']
             fixed_choices_only = serializer.validated_data['fixed_choices_only']
-
-            randomly_generated_quiz = topic.generate_quiz(no_of_questions=no_of_questions,
-                                                          no_of_choices=no_of_choices,
-                                                          show_all_alternative_answers=show_all_alternative_answers,
-                                                          fixed_choices_only=fixed_choices_only).quiz
+            adaptive = serializer.validated_data['adaptive']
+            rotation = serializer.validated_data['rotation']
+            stateless = serializer.validated_data['stateless']
+
+            quiz_object = topic.generate_quiz(no_of_questions=no_of_questions,
+                                              no_of_choices=no_of_choices,
+                                              show_all_alternative_answers=show_all_alternative_answers,
+                                              fixed_choices_only=fixed_choices_only,
+                                              adaptive=adaptive,
+                                              rotation=rotation,
+                                              save=not stateless)
+            randomly_generated_quiz = self.to_layout(quiz_object.quiz)
+            if stateless:
+                randomly_generated_quiz = {**randomly_generated_quiz,
+                                           'token': quiz_tokens.dumps(quiz_object, request.user)}
             return Response(randomly_generated_quiz, status=status.HTTP_201_CREATED)
 
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class CheckQuizAnswersAPIView(QuizViewSet):
+class CheckQuizAnswersAPIView(PayloadLayoutMixin, QuizViewSet):
     """
     Takes in a list of answers and attempts to answer a quiz of a particular ID (passed in as the pk).
 
-    Returns a dict with the quiz answers.
+    Returns a dict with the quiz answers. Pass in '?layout=columnar' to get the dict in the columnar layout (see
+    quiz.layouts).
 
     curl -X GET -H "Authorization: Bearer <Token>" -H "Content-Type: application/json"
          --data '{"answers":[[answer_text_1], [answer_text_2_1, answer_text_2_2], ...]}'
@@ -772,10 +826,248 @@ class CheckQuizAnswersAPIView(QuizViewSet):
             chosen_answers = serializer.validated_data['answers']
             # TODO - Add validation
             quiz_attempt = quiz.check_quiz_answers(chosen_answers=chosen_answers).quiz_attempt
-            return Response(quiz_attempt, status=status.HTTP_201_CREATED)
+            return Response(self.to_layout(quiz_attempt), status=status.HTTP_201_CREATED)
 
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    def create(self, request):
+        """
+        Check the answers to a stateless quiz (see GenerateQuizAPIView.update), with the token of the quiz.
+
+        curl -X POST -H "Authorization: Bearer <Token>" -H "Content-Type: application/json"
+         --data '{"token": "<quiz_token>", "answers":[[answer_text_1], [answer_text_2_1, answer_text_2_2], ...]}'
+         "<url>/api/attempt_quiz/"
+        """
+        serializer = QuizTokenAnswerSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            quiz_attempt = quiz_tokens.check_answers(serializer.validated_data['token'],
+                                                     serializer.validated_data['answers'], request.user).quiz_attempt
+        except signing.BadSignature:
+            return Response({"error_description": "Invalid or expired quiz token"}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(self.to_layout(quiz_attempt), status=status.HTTP_201_CREATED)
+
+
+# The lookup of the UUID routes, e.g. '3f2b6c1e-8f4a-4d2b-9c1e-2a7b5d9e0f13'.
+UUID_LOOKUP_REGEX = '[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}'
+
+
+class QuizByUUIDAPIView(ReplicaReadMixin, PayloadLayoutMixin, QuizViewSet):
+    """
+    Returns one of the user's quizzes by its UUID (the 'uuid' of the quiz payload), which, unlike the id, does not
+    tell how many quizzes there are. Pass in '?layout=columnar' to get the quiz in the columnar layout.
+
+    curl -X GET -H "Authorization: Bearer <Token>" "<url>/api/quizzes/<quiz_uuid>/"
+    """
+    permission_classes = (IsAuthenticated, TokenHasReadWriteScope)
+    lookup_field = 'uuid'
+    lookup_value_regex = UUID_LOOKUP_REGEX
+
+    def retrieve(self, request, uuid, format=None):
+        try:
+            quiz = self.quiz_queryset().get(uuid=uuid).quiz
+        except Quiz.DoesNotExist:
+            return Response({"error_description": "Quiz Does Not Exist"}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(self.to_layout(quiz), status=status.HTTP_200_OK)
+
+
+class QuizAttemptByUUIDAPIView(PayloadLayoutMixin, QuizViewSet):
+    """
+    Returns one of the user's quiz attempts by its UUID (the 'uuid' of the quiz attempt payload). Pass in
+    '?layout=columnar' to get the quiz attempt in the columnar layout.
+
+    curl -X GET -H "Authorization: Bearer <Token>" "<url>/api/quiz_attempts/<quiz_attempt_uuid>/"
+    """
+    permission_classes = (IsAuthenticated, TokenHasReadWriteScope)
+    lookup_field = 'uuid'
+    lookup_value_regex = UUID_LOOKUP_REGEX
+
+    def retrieve(self, request, uuid, format=None):
+        try:
+            quiz_attempt = QuizAttempt.objects.get(uuid=uuid, user=request.user).quiz_attempt
+        except QuizAttempt.DoesNotExist:
+            return Response({"error_description": "Quiz Attempt Does Not Exist"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        return Response(self.to_layout(quiz_attempt), status=status.HTTP_200_OK)
+
+
+class LeaderboardAPIView(ReplicaReadMixin, QuizViewSet):
+    """
+    The best score of every user over all quiz attempts (list), or over the attempts at one of the user's topics
+    (retrieve, with the topic ID as the pk). See quiz/leaderboards.py.
+
+    Returns the top ?limit=<n> users (10 by default) with their rank and percentile, the rank of the current user, and,
+    with ?attempt=<quiz_attempt_id>, the percentile of one of the current user's attempts.
+
+    curl -X GET -H "Authorization: Bearer <Token>" "<url>/api/leaderboard/<topic_id>/?attempt=<quiz_attempt_id>"
+    """
+    permission_classes = (IsAuthenticated, TokenHasReadWriteScope)
+
+    def list(self, request, format=None):
+        return self.leaderboard(request, topic=None)
+
+    def retrieve(self, request, pk, format=None):
+        try:
+            topic = self.topic_queryset().get(id=pk)
+        except Topic.DoesNotExist:
+            return Response({"error_description": "Topic does not exist"}, status=status.HTTP_400_BAD_REQUEST)
+        return self.leaderboard(request, topic=topic)
+
+    def leaderboard(self, request, topic):
+        serializer = LeaderboardSerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        attempt = None
+        if 'attempt' in serializer.validated_data:
+            try:
+                quiz_attempt = QuizAttempt.objects.get(id=serializer.validated_data['attempt'], user=request.user)
+            except QuizAttempt.DoesNotExist:
+                return Response({"error_description": "Quiz Attempt Does Not Exist"},
+                                status=status.HTTP_400_BAD_REQUEST)
+            attempt = {
+                'id': quiz_attempt.id,
+                'score': quiz_attempt.score,
+                'percentile': leaderboards.attempt_percentile(quiz_attempt, topic),
+            }
+
+        return Response({
+            'topic': topic.id if topic is not None else None,
+            'leaders': leaderboards.leaders(topic, serializer.validated_data['limit']),
+            'current_user': leaderboards.user_standing(request.user, topic),
+            'attempt': attempt,
+        }, status=status.HTTP_200_OK)
+
+
+class SearchAPIView(ReplicaReadMixin, QuizViewSet):
+    """
+    Full-text search over the text of the user's questions and answers (see quiz/search.py), best matches first.
+
+    Pass in ?type=question or ?type=answer to only search one of them, and ?limit=<n> (20 by default) and
+    ?offset=<n> to page through the results. next_offset is the offset of the next page, or null on the last page.
+
+    curl -X GET -H "Authorization: Bearer <Token>" "<url>/api/search/?q=capital%20fra&type=question"
+    """
+    permission_classes = (IsAuthenticated, TokenHasReadWriteScope)
+
+    def list(self, request, format=None):
+        serializer = SearchSerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        limit = serializer.validated_data['limit']
+        offset = serializer.validated_data['offset']
+        # Get one more result to know whether there is a next page.
+        results = search.search(request.user, serializer.validated_data['q'], serializer.validated_data.get('type'),
+                                limit=limit + 1, offset=offset)
+        return Response({
+            'results': results[:limit],
+            'next_offset': offset + limit if len(results) > limit else None,
+        }, status=status.HTTP_200_OK)
+
+
+class HistoryAPIView(ReplicaReadMixin, PayloadLayoutMixin, QuizViewSet):
+    """
+    Base of the histories of the user's quizzes and quiz attempts, newest first.
+
+    The list only reads the summary columns (summary_fields), never the pickled payloads, and pages with keyset
+    pagination: pass in ?before=<next_before> to get the page after, which is an index range scan however far back
+    the page is (unlike an offset). next_before is null on the last page. Pass in ?topic=<topic_id> to only get the
+    items of one topic, and ?limit=<n> (20 by default) for the page size.
+
+    The payload of one item is only loaded when it is retrieved by its id.
+    """
+    permission_classes = (IsAuthenticated, TokenHasReadWriteScope)
+    model = None
+    # The foreign key of the model to the user the items belong to.
+    owner_field = None
+    summary_fields = ()
+    payload_field = None
+    does_not_exist_description = None
+
+    def history_queryset(self):
+        return self.model.objects.filter(**{self.owner_field: self.request.user})
+
+    def list(self, request, format=None):
+        serializer = HistorySerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        limit = serializer.validated_data['limit']
+        items = self.history_queryset().order_by('-id')
+        if 'before' in serializer.validated_data:
+            items = items.filter(id__lt=serializer.validated_data['before'])
+        if 'topic' in serializer.validated_data:
+            items = items.filter(topic_id=serializer.validated_data['topic'])
+        # Get one more item to know whether there is a next page.
+        results = list(items.values(*self.summary_fields)[:limit + 1])
+        return Response({
+            'results': results[:limit],
+            'next_before': results[limit - 1]['id'] if len(results) > limit else None,
+        }, status=status.HTTP_200_OK)
+
+    def retrieve(self, request, pk, format=None):
+        try:
+            item = self.history_queryset().only(self.payload_field).get(id=pk)
+        except ObjectDoesNotExist:
+            return Response({"error_description": self.does_not_exist_description},
+                            status=status.HTTP_400_BAD_REQUEST)
+        return Response(self.to_layout(getattr(item, self.payload_field)), status=status.HTTP_200_OK)
+
+
+class QuizHistoryAPIView(HistoryAPIView):
+    """
+    The user's quizzes, newest first (see HistoryAPIView), and the quiz of a given id.
+
+    curl -X GET -H "Authorization: Bearer <Token>" "<url>/api/history/quizzes/?before=<next_before>"
+    """
+    model = Quiz
+    owner_field = 'creator'
+    summary_fields = ('id', 'uuid', 'topic', 'topic_name', 'no_of_questions', 'created_at')
+    payload_field = 'quiz'
+    does_not_exist_description = "Quiz Does Not Exist"
+
+
+class QuizAttemptHistoryAPIView(HistoryAPIView):
+    """
+    The user's quiz attempts, newest first (see HistoryAPIView), and the quiz attempt of a given id.
+
+    curl -X GET -H "Authorization: Bearer <Token>" "<url>/api/history/quiz_attempts/?topic=<topic_id>"
+    """
+    model = QuizAttempt
+    owner_field = 'user'
+    summary_fields = ('id', 'uuid', 'quiz', 'topic', 'topic_name', 'no_of_questions', 'score', 'created_at')
+    payload_field = 'quiz_attempt'
+    does_not_exist_description = "Quiz Attempt Does Not Exist"
+
+
+class RegradeJobAPIView(QuizViewSet):
+    """
+    The progress of the jobs regrading the user's quiz attempts after answer keys changed (see quiz/regrading.py),
+    newest first: status is pending, running, done or failed, and processed out of total attempts were checked, of
+    which regraded got a new grading.
+
+    curl -X GET -H "Authorization: Bearer <Token>" "<url>/api/regrade_jobs/<job_id>/"
+    """
+    permission_classes = (IsAuthenticated, TokenHasReadWriteScope)
+    fields = ('id', 'status', 'question_ids', 'total', 'processed', 'regraded', 'created_at', 'updated_at',
+              'finished_at')
+
+    def job_queryset(self):
+        return RegradeJob.objects.filter(user=self.request.user).order_by('-id')
+
+    def list(self, request, format=None):
+        return Response(list(self.job_queryset().values(*self.fields)[:100]), status=status.HTTP_200_OK)
+
+    def retrieve(self, request, pk, format=None):
+        try:
+            job = self.job_queryset().values(*self.fields).get(id=pk)
+        except RegradeJob.DoesNotExist:
+            return Response({"error_description": "Regrade Job Does Not Exist"}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(job, status=status.HTTP_200_OK)
+
 
 class UserCreateView(generics.CreateAPIView):
     """Used to register users from the frontend.
@@ -785,3 +1077,79 @@ class UserCreateView(generics.CreateAPIView):
 
     # Anyone should be able to register.
     permission_classes = (AllowAny,)
+
+
+class PerformanceStatsView(generics.GenericAPIView):
+    """
+    Returns the rolling histograms of the total time, SQL time, serialization time, query count (and peak allocation,
+    if traced) of the last requests per route (see quiz/instrumentation.py), and the stats of the database connection
+    pools (see quiz/backends/pooling.py). Staff only.
+
+    The histograms and pools are kept per worker process, so each request may get the ones of a different worker.
+    """
+    permission_classes = (IsAuthenticated, IsAdminUser)
+
+    def get(self, request):
+        return Response({
+            'routes': route_histograms.snapshot(),
+            'connection_pools': pool_stats(),
+        }, status=status.HTTP_200_OK)
+
+
+class SlowQueriesView(generics.GenericAPIView):
+    """
+    Returns the fingerprints of the slow queries with the most time, with the routes that made them and the plan of the
+    slowest one (see quiz/slow_queries.py). Staff only.
+
+    The slow queries are kept per worker process, so each request may get the ones of a different worker.
+    """
+    permission_classes = (IsAuthenticated, IsAdminUser)
+
+    def get(self, request):
+        return Response({
+            'enabled': settings.SLOW_QUERY_LOG,
+            'threshold_ms': settings.SLOW_QUERY_THRESHOLD_MS,
+            'queries': slow_queries.snapshot(),
+        }, status=status.HTTP_200_OK)
+
+
+class ProfilesView(generics.GenericAPIView):
+    """
+    Returns the profiled requests, newest first, with their route, user, method, path, status and duration (see
+    quiz/profiling.py). Staff only.
+
+    Profile a request with an 'X-Profile: 1' header or a profile=1 query parameter, then download its profile from
+    /api/performance/profiles/<id>/pstats/ or /api/performance/profiles/<id>/collapsed/.
+    """
+    permission_classes = (IsAuthenticated, IsAdminUser)
+
+    def get(self, request):
+        return Response(profiling.list_profiles(), status=status.HTTP_200_OK)
+
+
+class ProfileArtifactView(generics.GenericAPIView):
+    """
+    Downloads the cProfile stats (pstats) or the sampled stacks in the collapsed format of flame graphs (collapsed) of a
+    profiled request. Staff only.
+    """
+    permission_classes = (IsAuthenticated, IsAdminUser)
+
+    def get(self, request, profile_id, kind):
+        path = profiling.artifact_path(profile_id, kind)
+        if path is None:
+            raise Http404
+        return FileResponse(open(path, 'rb'), as_attachment=True, filename=path.name,
+                            content_type='application/octet-stream')
+
+
+def metrics_view(request):
+    """
+    Returns the Prometheus metrics of all the worker processes, in the text format (see quiz/metrics.py). If
+    METRICS_TOKEN is set, only to requests with an 'Authorization: Bearer <METRICS_TOKEN>' header.
+
+    curl "<url>/metrics"
+    """
+    if settings.METRICS_TOKEN and not constant_time_compare(request.META.get('HTTP_AUTHORIZATION', ''),
+                                                            f'Bearer {settings.METRICS_TOKEN}'):
+        return HttpResponse(status=status.HTTP_401_UNAUTHORIZED)
+    return HttpResponse(metrics.render(), content_type=CONTENT_TYPE_LATEST)
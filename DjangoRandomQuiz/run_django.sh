@@ -8,11 +8,17 @@ do
 done
 echo 'Postgres Service Started'
 
-python3 manage.py migrate --noinput
-python3 manage.py collectstatic --noinput
-python3 manage.py shell -c "exec(\"from django.contrib.auth import get_user_model\\nif not get_user_model().objects.filter(username='admin'):\\n get_user_model().objects.create_superuser('admin', 'admin@avodaq.com', 'Cisco1234*')\")"
+# Apply the migrations, collect the static files and create the admin user and the OAuth application with the client
+#  ID 'QuizAppClientID', in one process. Every step is skipped if there is nothing to do (see quiz/management/commands/
+#  bootstrap.py).
+python3 manage.py bootstrap
 
-# Create Quiz application for OAuth and hardcode client ID to 'QuizAppClientID'
-python3 manage.py shell -c "exec(\"from django.contrib.auth import get_user_model\\nfrom oauth2_provider.models import Application, AbstractApplication\\nif not Application.objects.filter(client_id='QuizAppClientID'):\\n Application.objects.create(client_id='QuizAppClientID', user=get_user_model().objects.get(username='admin'), authorization_grant_type=AbstractApplication.GRANT_PASSWORD, name='QuizApp', client_type=AbstractApplication.CLIENT_PUBLIC)\")"
-
-gunicorn -w 4 -b 0.0.0.0:8000 DjangoRandomQuiz.wsgi:application
+# gunicorn also reads gunicorn.conf.py, which sets up the metrics of the workers (see quiz/metrics.py).
+# Set SERVER_INTERFACE=asgi to serve with uvicorn workers. This enables the async endpoints under /api/async/, which do
+#  not block the worker while a quiz is being generated or graded.
+if [ "$SERVER_INTERFACE" = "asgi" ]
+then
+  gunicorn -w 4 -k uvicorn.workers.UvicornWorker -b 0.0.0.0:8000 DjangoRandomQuiz.asgi:application
+else
+  gunicorn -w 4 -b 0.0.0.0:8000 DjangoRandomQuiz.wsgi:application
+fi